@@ -0,0 +1,223 @@
+import heapq
+import itertools
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from config import BALANCER_ASSIGNMENT_TTL
+from pool_index import endpoints
+from proxy_parser import ProxyRecord
+from proxy_pool import proxy_pool
+
+Endpoint = Tuple[str, int]
+
+# Куча файла перестраивается, когда устаревших элементов становится больше
+HEAP_COMPACT_FACTOR = 4
+
+
+class _FileEndpoints:
+    """Записи одного файла, сгруппированные по адресу (host, port).
+
+    Корзина адреса - массив индексов; из индекса пула читаются только host и port.
+    """
+
+    def __init__(self, records: Sequence[ProxyRecord]):
+        self.records = records
+        self.buckets: Dict[Endpoint, array] = {}
+        for index, endpoint in enumerate(endpoints(records)):
+            bucket = self.buckets.get(endpoint)
+            if bucket is None:
+                bucket = self.buckets[endpoint] = array('I')
+            bucket.append(index)
+        # Позиция ротации записей внутри каждого адреса
+        self.cursors: Dict[Endpoint, int] = dict.fromkeys(self.buckets, 0)
+        # (активных назначений, порядковый номер, адрес); устаревшие элементы
+        # отбрасываются при извлечении
+        self.heap: List[Tuple[int, int, Endpoint]] = []
+
+    def find(self, endpoint: Endpoint, usable: Optional[Callable[[int], bool]]) -> Optional[int]:
+        """Позиция в корзине адреса первой подходящей записи от курсора ротации"""
+        bucket = self.buckets[endpoint]
+        start = self.cursors[endpoint]
+        for step in range(len(bucket)):
+            position = (start + step) % len(bucket)
+            if usable is None or usable(bucket[position]):
+                return position
+        return None
+
+    def advance(self, endpoint: Endpoint, position: int) -> int:
+        """Сдвигает курсор адреса за выданную позицию и возвращает индекс записи"""
+        bucket = self.buckets[endpoint]
+        self.cursors[endpoint] = (position + 1) % len(bucket)
+        return bucket[position]
+
+
+class EndpointBalancer:
+    """Распределение пользователей по физическим серверам.
+
+    Одни и те же host:port встречаются во многих строках и в разных файлах,
+    поэтому нагрузка считается по адресам: для каждого адреса хранится
+    число активных назначений (последний выданный пользователю прокси из
+    каждого файла), а выдаётся запись с наименее загруженного адреса файла.
+    Для файла поддерживается куча адресов по числу назначений, поэтому
+    выбор стоит O(log E), где E - число адресов в файле.
+
+    Назначение активно ttl секунд с момента выдачи (по умолчанию - срок
+    аренды), после чего перестаёт учитываться в нагрузке адреса.
+    """
+
+    def __init__(self, ttl: float = BALANCER_ASSIGNMENT_TTL):
+        self._ttl = ttl
+        self._files: Dict[str, _FileEndpoints] = {}
+        self._endpoint_files: Dict[Endpoint, Set[str]] = {}
+        self._active: Dict[Endpoint, int] = {}
+        # (user_id, файл) -> (адрес, момент истечения) в порядке истечения
+        self._assignments: "OrderedDict[Tuple[int, str], Tuple[Endpoint, float]]" = OrderedDict()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _push(self, file_name: str, endpoint: Endpoint):
+        entry = self._files[file_name]
+        heapq.heappush(entry.heap, (self._active.get(endpoint, 0), next(self._seq), endpoint))
+        if len(entry.heap) > HEAP_COMPACT_FACTOR * len(entry.buckets):
+            self._rebuild_heap(entry)
+
+    def _rebuild_heap(self, entry: _FileEndpoints):
+        entry.heap = [(self._active.get(endpoint, 0), next(self._seq), endpoint) for endpoint in entry.buckets]
+        heapq.heapify(entry.heap)
+
+    def _expire(self, now: float):
+        # Срок у всех назначений одинаковый, поэтому самые старые - в начале
+        while self._assignments:
+            key, (endpoint, expires_at) = next(iter(self._assignments.items()))
+            if expires_at > now:
+                break
+            del self._assignments[key]
+            self._changed(endpoint, -1)
+
+    def _assign(self, key: Tuple[int, str], endpoint: Endpoint, expires_at: float):
+        self._assignments[key] = (endpoint, expires_at)
+        self._assignments.move_to_end(key)
+        self._changed(endpoint, 1)
+
+    def _unassign(self, key: Tuple[int, str]) -> Optional[Tuple[Endpoint, float]]:
+        assignment = self._assignments.pop(key, None)
+        if assignment is not None:
+            self._changed(assignment[0], -1)
+        return assignment
+
+    def _changed(self, endpoint: Endpoint, delta: int):
+        self._active[endpoint] = self._active.get(endpoint, 0) + delta
+        if self._active[endpoint] <= 0:
+            del self._active[endpoint]
+        for file_name in self._endpoint_files.get(endpoint, ()):
+            self._push(file_name, endpoint)
+
+    def _file(self, file_name: str, records: Tuple[ProxyRecord, ...]) -> _FileEndpoints:
+        entry = self._files.get(file_name)
+        if entry is not None and entry.records is records:
+            return entry
+
+        if entry is not None:
+            for endpoint in entry.buckets:
+                self._endpoint_files[endpoint].discard(file_name)
+        entry = self._files[file_name] = _FileEndpoints(records)
+        for endpoint in entry.buckets:
+            self._endpoint_files.setdefault(endpoint, set()).add(file_name)
+        self._rebuild_heap(entry)
+        return entry
+
+    def _choose(self, entry: _FileEndpoints,
+                usable: Optional[Callable[[int], bool]]) -> Optional[Tuple[Endpoint, int]]:
+        """Наименее загруженный адрес с подходящей записью и позиция этой записи.
+
+        Сначала перебираются доступные адреса, затем недоступные. Куча
+        возвращается в прежнее состояние: назначение учитывает только pick().
+        """
+        if not entry.heap:
+            self._rebuild_heap(entry)
+        popped = []
+        unhealthy = []
+        try:
+            while entry.heap:
+                item = heapq.heappop(entry.heap)
+                count, _, endpoint = item
+                if endpoint not in entry.buckets or count != self._active.get(endpoint, 0):
+                    continue  # устаревший элемент
+                popped.append(item)
+                # Запись не декодируется: доступность проверяется по ключу адреса
+                if not proxy_pool.is_endpoint_healthy(endpoint):
+                    unhealthy.append(endpoint)
+                    continue
+                position = entry.find(endpoint, usable)
+                if position is not None:
+                    return endpoint, position
+            # Недоступны все подходящие адреса - берём наименее загруженный из них
+            for endpoint in unhealthy:
+                position = entry.find(endpoint, usable)
+                if position is not None:
+                    return endpoint, position
+            return None
+        finally:
+            for item in popped:
+                heapq.heappush(entry.heap, item)
+
+    def pick(self, file_name: str, records: Tuple[ProxyRecord, ...], user_id: Optional[int],
+             usable: Optional[Callable[[int], bool]] = None, now: Optional[float] = None) -> Optional[int]:
+        """Индекс подходящей записи с наименее загруженного адреса.
+
+        Прежнее назначение пользователя в файле заменяется выбранным адресом;
+        если для usable(index) подходящих записей нет, возвращается None и
+        назначения не меняются.
+        """
+        if not records:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            entry = self._file(file_name, records)
+            key = (user_id, file_name)
+            previous = self._unassign(key) if user_id is not None else None
+
+            choice = self._choose(entry, usable)
+            if choice is None:
+                if previous is not None:
+                    self._assign(key, *previous)
+                return None
+
+            endpoint, position = choice
+            if user_id is not None:
+                self._assign(key, endpoint, now + self._ttl)
+            else:
+                # Выдача без пользователя не занимает адрес, но сдвигает его в очереди
+                self._push(file_name, endpoint)
+            return entry.advance(endpoint, position)
+
+    def release(self, user_id: int, file_name: str):
+        """Снимает назначение пользователя в файле"""
+        with self._lock:
+            self._unassign((user_id, file_name))
+
+    def restore(self, assignments: Iterable[Tuple[int, str, Endpoint, float]], now: Optional[float] = None):
+        """Восстанавливает назначения после перезапуска: (user_id, файл, адрес,
+        время выдачи в секундах эпохи). Истёкшие назначения пропускаются.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            # Назначения вставляются в порядке выдачи, чтобы _expire видел их по сроку
+            for user_id, file_name, endpoint, issued_at in sorted(assignments, key=lambda item: item[3]):
+                key = (user_id, file_name)
+                self._unassign(key)
+                if issued_at + self._ttl > now:
+                    self._assign(key, endpoint, issued_at + self._ttl)
+            self._expire(now)
+
+    def load(self, now: Optional[float] = None) -> Dict[Endpoint, int]:
+        """Текущее число активных назначений по адресам"""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return dict(self._active)
+
+
+balancer = EndpointBalancer()
@@ -0,0 +1,163 @@
+"""Замер старта бота: от запуска процесса до первого обновления и ответа на /start.
+
+Бот запускается как в proxy_bot.main(), но с подменённой сессией Bot API:
+getUpdates отдаёт одно сообщение /start, ответы бота записываются и не уходят
+в сеть. Каждый прогон - отдельный процесс, поэтому импорт модулей, миграции и
+загрузка пулов каждый раз идут с холодного старта. БД и папки создаются во
+временном каталоге.
+
+    python bench_startup.py --runs 5 --pool-size 100000
+"""
+import time
+
+BOOT_STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+# Измерения выводятся строкой с этим префиксом
+RESULT_PREFIX = "BENCH "
+USER_ID = 1000
+
+
+def _prepare_env(workdir: str, pool_size: int):
+    os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+    os.environ.setdefault("ADMIN_CHAT_ID", "1")
+    os.environ["DB_FILE"] = os.path.join(workdir, "bot.db")
+    os.environ["PROXY_FOLDER"] = os.path.join(workdir, "proxies")
+    os.environ["MEDIA_FOLDER"] = os.path.join(workdir, "media")
+    os.environ["HEALTH_CHECK_ENABLED"] = "0"
+    os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+    if pool_size and not os.path.exists(os.environ["PROXY_FOLDER"]):
+        os.makedirs(os.environ["PROXY_FOLDER"])
+        with open(os.path.join(os.environ["PROXY_FOLDER"], "proxy.txt"), "w", encoding="utf-8") as f:
+            for i in range(pool_size):
+                f.write(f"trojan://secret@10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:443#{i}\n")
+
+
+async def _run_once() -> dict:
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.enums import ParseMode
+    from aiogram.methods import GetMe, GetUpdates, SendMessage
+    from aiogram.types import Chat, Message, Update, User
+    import lifecycle
+    from proxy_bot import create_dispatcher, set_main_menu
+
+    private = Chat(id=USER_ID, type="private")
+    start = Update(update_id=1, message=Message(
+        message_id=1, date=datetime.now(), chat=private, text="/start",
+        from_user=User(id=USER_ID, is_bot=False, first_name="Bench")))
+
+    class BenchSession(BaseSession):
+        """Сессия без сети: одно обновление /start и запись ответов"""
+
+        def __init__(self):
+            super().__init__()
+            self.updates = [start]
+            self.first_poll = None
+            self.reply = None
+            self.replied = asyncio.Event()
+
+        async def make_request(self, bot, method, timeout=None):
+            now = time.perf_counter()
+            if isinstance(method, GetUpdates):
+                if self.first_poll is None:
+                    self.first_poll = now
+                updates, self.updates = self.updates, []
+                if not updates:
+                    await asyncio.sleep(0.05)
+                return updates
+            if isinstance(method, GetMe):
+                return User(id=1, is_bot=True, first_name="Bench", username="bench_bot")
+            if isinstance(method, SendMessage):
+                if self.reply is None:
+                    self.reply = now
+                    self.replied.set()
+                return Message(message_id=2, date=datetime.now(), chat=private, text=method.text)
+            return True
+
+        async def stream_content(self, url, timeout, chunk_size, raise_for_status):
+            raise NotImplementedError
+            yield b""
+
+        async def close(self):
+            pass
+
+    session = BenchSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session, parse_mode=ParseMode.HTML)
+    dp = create_dispatcher(BOOT_STARTED)
+    ready = None
+
+    async def wait_ready():
+        nonlocal ready
+        await lifecycle.app_state.wait_ready()
+        ready = time.perf_counter()
+
+    async def stop_after_reply():
+        await session.replied.wait()
+        await dp.stop_polling()
+
+    watchers = [asyncio.create_task(wait_ready()), asyncio.create_task(stop_after_reply())]
+    try:
+        await lifecycle.serve(bot, dp, asyncio.gather(lifecycle.startup(bot), set_main_menu(bot)),
+                              handle_signals=False, close_bot_session=False)
+    finally:
+        await lifecycle.shutdown()
+        for task in watchers:
+            task.cancel()
+
+    first_update = BOOT_STARTED + lifecycle.app_state.phases["first_update"]
+    return {
+        "first_poll": session.first_poll - BOOT_STARTED,
+        "first_update": first_update - BOOT_STARTED,
+        "ready": ready - BOOT_STARTED,
+        "start_reply": session.reply - BOOT_STARTED,
+        # Холодный /start: от получения обновления до отправки ответа
+        "start_latency": session.reply - first_update,
+        "start_handler": lifecycle.app_state.phases["first_handler"],
+    }
+
+
+def _child(pool_size: int):
+    with tempfile.TemporaryDirectory(prefix="proxy-bot-bench-") as workdir:
+        _prepare_env(workdir, pool_size)
+        result = asyncio.run(_run_once())
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="число прогонов (каждый в новом процессе)")
+    parser.add_argument("--pool-size", type=int, default=0, help="записей в proxy.txt")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.pool_size)
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--pool-size", str(args.pool_size)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        line = next(line for line in output.splitlines() if line.startswith(RESULT_PREFIX))
+        runs.append(json.loads(line[len(RESULT_PREFIX):]))
+
+    print(f"Прогонов: {len(runs)}, записей в пуле: {args.pool_size}")
+    for key in runs[0]:
+        values = [run[key] * 1000 for run in runs]
+        print(f"{key:>14}: медиана {statistics.median(values):8.1f} мс, "
+              f"мин {min(values):8.1f} мс, макс {max(values):8.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+from aiogram.types import InlineKeyboardMarkup
+from config import PROXY_FOLDER
+from database import load_proxy_files
+from geo import country_index
+from keyboards import get_proxy_files_menu, get_download_menu, get_country_menu
+from proxy_parser import ProxyRecord
+from proxy_pool import proxy_pool
+from selection import selector
+
+
+class ProxyCatalog:
+    """Список прокси-файлов в памяти с заранее собранными клавиатурами.
+
+    Каталог загружается при старте и перезагружается через reload() после
+    изменения proxy_files (например, командой /addproxies), поэтому меню
+    «🍔 Получить прокси» и «📥 Скачать файл» не обращаются к БД. Меню стран
+    файла пересобирается, когда в пуле сменилось содержимое файла.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.files: Dict[str, dict] = {}
+        # None - нет ни одного доступного файла
+        self.proxy_keyboard: Optional[InlineKeyboardMarkup] = None
+        self.download_keyboard: Optional[InlineKeyboardMarkup] = None
+        # Меню стран файла и записи пула, по которым оно собрано (None -
+        # страну не удалось определить ни у одной записи)
+        self._country_menus: Dict[str, Tuple[Sequence[ProxyRecord], Optional[InlineKeyboardMarkup]]] = {}
+        self._lock = asyncio.Lock()
+
+    def _existing(self, proxy_files: List[dict]) -> List[dict]:
+        existing = []
+        for file in proxy_files:
+            file_path = os.path.join(self.folder, file['name'])
+            if os.path.exists(file_path):
+                existing.append(file)
+            else:
+                logging.warning(f"Файл прокси не найден: {file_path}")
+        return existing
+
+    def _country_menu(self, file_name: str) -> Optional[InlineKeyboardMarkup]:
+        records = proxy_pool.get(file_name)
+        menu = self._country_menus.get(file_name)
+        if menu is not None and menu[0] is records:
+            return menu[1]
+        countries = country_index.countries(file_name, records)
+        keyboard = get_country_menu(file_name, countries) if countries else None
+        self._country_menus[file_name] = (records, keyboard)
+        return keyboard
+
+    def _countries(self, existing: List[dict]):
+        # Индекс стран строится при загрузке каталога, а не при выдаче прокси
+        names = {file['name'] for file in existing}
+        for file_name in list(self._country_menus):
+            if file_name not in names:
+                del self._country_menus[file_name]
+        for file_name in names:
+            self._country_menu(file_name)
+
+    async def reload(self) -> int:
+        """Перечитывает каталог из БД и пересобирает клавиатуры"""
+        async with self._lock:
+            proxy_files = await load_proxy_files()
+            existing = await asyncio.to_thread(self._existing, proxy_files)
+
+            self.files = {file['name']: file for file in proxy_files}
+            selector.set_modes({file['name']: file['mode'] for file in proxy_files})
+            self.proxy_keyboard = get_proxy_files_menu(existing) if existing else None
+            self.download_keyboard = get_download_menu(proxy_files) if proxy_files else None
+            await asyncio.to_thread(self._countries, existing)
+            return len(proxy_files)
+
+    async def country_keyboard(self, file_name: str) -> Optional[InlineKeyboardMarkup]:
+        """Меню стран файла или None, если у записей страна не определена.
+
+        Пул проверяет только os.stat файла, а индекс стран строится заново лишь
+        после изменения файла (например, загрузкой через /addproxies).
+        """
+        if file_name not in self.files:
+            return None
+        return await asyncio.to_thread(self._country_menu, file_name)
+
+    def display_name(self, file_name: str) -> str:
+        file = self.files.get(file_name)
+        return file['display'] if file else file_name
+
+
+catalog = ProxyCatalog(PROXY_FOLDER)
@@ -8,9 +8,52 @@ load_dotenv()
 API_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
 DB_FILE = os.getenv("DB_FILE", "proxy_bot.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000"))
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", "60"))
+ADMIN_DIGEST_MAX_EVENTS = int(os.getenv("ADMIN_DIGEST_MAX_EVENTS", "50"))
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "3.0"))
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(1024 ** 3)))
+# Строки загрузки длиннее этого числа символов пропускаются как некорректные
+INGEST_MAX_LINE = int(os.getenv("INGEST_MAX_LINE", "16384"))
+HEALTH_CHECK_ENABLED = os.getenv("HEALTH_CHECK_ENABLED", "1") == "1"
+HEALTH_CONFIG_FILE = os.getenv("HEALTH_CONFIG_FILE", "ProxyNova.json")
+HEALTH_CONCURRENCY = int(os.getenv("HEALTH_CONCURRENCY", "64"))
+HEALTH_PER_HOST = int(os.getenv("HEALTH_PER_HOST", "2"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "5.0"))
 PROXY_FOLDER = os.getenv("PROXY_FOLDER", "proxies")
+# Читать пул из скомпилированного .pidx через mmap вместо разбора .txt в память
+POOL_INDEX_ENABLED = os.getenv("POOL_INDEX_ENABLED", "1") == "1"
+# CSV с диапазонами IP (начало,конец,код страны) для записей без флага в примечании
+GEOIP_FILE = os.getenv("GEOIP_FILE", "")
+# Срок аренды выданного прокси в секундах (0 - аренда выключена, выдача по кругу)
+PROXY_LEASE_TTL = float(os.getenv("PROXY_LEASE_TTL", "0"))
+LEASE_SWEEP_INTERVAL = float(os.getenv("LEASE_SWEEP_INTERVAL", "60"))
+# Сколько секунд выдача учитывается в нагрузке адреса в режиме balanced
+# (по умолчанию - срок аренды, а без аренды - сутки)
+BALANCER_ASSIGNMENT_TTL = float(os.getenv("BALANCER_ASSIGNMENT_TTL", str(PROXY_LEASE_TTL or 86400)))
+# Не выдавать пользователю повторно прокси, пока он не получит все записи файла
+PROXY_NO_REPEAT = os.getenv("PROXY_NO_REPEAT", "1") == "1"
+SEEN_CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", "10000"))
 MAX_TICKETS_PER_USER = int(os.getenv("MAX_TICKETS_PER_USER", "5"))
+# Записей на странице списков тикетов, истории и скачиваний
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
 MEDIA_FOLDER = os.getenv("MEDIA_FOLDER", "support_media")
+# Сколько вложений поддержки скачивается одновременно и таймаут одной загрузки, с
+MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv("MEDIA_DOWNLOAD_CONCURRENCY", "4"))
+MEDIA_DOWNLOAD_TIMEOUT = int(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", "60"))
+# Срок хранения вложений закрытых тикетов в днях и квоты в байтах (0 - без ограничения)
+MEDIA_RETENTION_DAYS = float(os.getenv("MEDIA_RETENTION_DAYS", "30"))
+MEDIA_USER_QUOTA = int(os.getenv("MEDIA_USER_QUOTA", str(100 * 1024 ** 2)))
+MEDIA_GLOBAL_QUOTA = int(os.getenv("MEDIA_GLOBAL_QUOTA", str(5 * 1024 ** 3)))
+# Очистка идёт пакетами по MEDIA_GC_BATCH операций раз в MEDIA_GC_INTERVAL секунд
+MEDIA_GC_INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", "300"))
+MEDIA_GC_BATCH = int(os.getenv("MEDIA_GC_BATCH", "100"))
+MEDIA_ORPHAN_GRACE = float(os.getenv("MEDIA_ORPHAN_GRACE", "3600"))
 LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", "INFO")
 MAX_FEEDBACK_LENGTH = int(os.getenv("MAX_FEEDBACK_LENGTH", "4000"))
 
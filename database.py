@@ -3,8 +3,28 @@ import datetime
 import logging
 import os
 import json
+import time
 from typing import List, Dict, Any, Optional, Tuple
-from config import DB_FILE, PROXY_FOLDER, MAX_TICKETS_PER_USER
+from config import (
+    DB_FILE, PROXY_FOLDER, MAX_TICKETS_PER_USER, DB_READERS, PAGE_SIZE,
+    WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_INTERVAL
+)
+from db_pool import DatabasePool, HAS_RETURNING
+from geo import country_index
+from media_store import media_store
+from leases import lease_manager
+from proxy_pool import proxy_pool
+from seen import seen_tracker
+from selection import DEFAULT_MODE, selector
+from write_behind import WriteBehindQueue
+from migrations import apply_migrations, rebuild_statistics as _rebuild_statistics
+from pagination import Page, keyset_page
+
+# Общий пул соединений: запросы хендлеров выполняются вне event loop
+db = DatabasePool(DB_FILE, readers=DB_READERS)
+
+# Журналы выдачи и скачиваний пишутся пакетами, а не отдельной транзакцией на событие
+write_behind = WriteBehindQueue(db, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_INTERVAL)
 
 def get_connection() -> sqlite3.Connection:
     """Создает и возвращает соединение с базой данных"""
@@ -13,268 +33,105 @@ def get_connection() -> sqlite3.Connection:
     return conn
 
 def init_db():
-    """Инициализация базы данных и создание таблиц, если они не существуют"""
+    """Инициализация базы данных: применяет недостающие миграции схемы"""
     try:
         with get_connection() as conn:
-            c = conn.cursor()
-            
-            # Таблица прокси-файлов
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_files (
-                        file_name TEXT PRIMARY KEY,
-                        display_name TEXT NOT NULL,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            # Таблица пользователей
-            c.execute('''CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            # Таблица истории прокси
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        proxy TEXT,
-                        proxy_type TEXT,
-                        issue_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-            
-            # Таблица настроек пользователя
-            c.execute('''CREATE TABLE IF NOT EXISTS user_settings (
-                        user_id INTEGER PRIMARY KEY,
-                        language TEXT DEFAULT 'ru',
-                        notifications INTEGER DEFAULT 1,
-                        last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-            
-            # Таблица тикетов поддержки
-            c.execute('''CREATE TABLE IF NOT EXISTS support_tickets (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        message TEXT,
-                        media_type TEXT,
-                        media_path TEXT,
-                        status TEXT DEFAULT 'open',
-                        admin_id INTEGER,
-                        reply_message TEXT,
-                        reply_media_type TEXT,
-                        reply_media_path TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        replied_at TIMESTAMP,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-            
-            # Таблица сообщений поддержки
-            c.execute('''CREATE TABLE IF NOT EXISTS support_messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        ticket_id INTEGER,
-                        user_id INTEGER,
-                        message_text TEXT,
-                        is_from_admin BOOLEAN DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY(ticket_id) REFERENCES support_tickets(id),
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-            
-            # Создаем папку для прокси, если её нет
-            os.makedirs(PROXY_FOLDER, exist_ok=True)
-            
-            # Таблица для хранения информации о прокси-файлах
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_files (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        file_name TEXT UNIQUE NOT NULL,
-                        display_name TEXT NOT NULL,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            # Таблица для хранения индекса текущего прокси
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_index (
-                        file_name TEXT PRIMARY KEY,
-                        last_index INTEGER DEFAULT 0)''')
-            
-            # Таблица для хранения использованных прокси
-            c.execute('''CREATE TABLE IF NOT EXISTS used_proxies (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        proxy TEXT NOT NULL,
-                        proxy_type TEXT NOT NULL,
-                        used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(proxy, proxy_type))''')
-            
-            # Таблица для отслеживания скачиваний прокси-файлов
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_downloads (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        file_name TEXT NOT NULL,
-                        download_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-            
-            # Создаем записи для существующих прокси-файлов, если их нет
-            c.execute("SELECT file_name FROM proxy_files")
-            for (file_name,) in c.fetchall():
-                c.execute('''INSERT OR IGNORE INTO proxy_index (file_name, last_index) 
-                            VALUES (?, 0)''', (file_name,))
-            
-            conn.commit()
-            
+            version = apply_migrations(conn)
+            logging.info(f"Версия схемы базы данных: {version}")
     except Exception as e:
         logging.error(f"Ошибка при инициализации базы данных: {e}")
         raise
 
-def migrate_db():
-    """Миграция базы данных при обновлении структуры"""
-    try:
-        with get_connection() as conn:
-            c = conn.cursor()
-            
-            # Создаем таблицу для индексации прокси, если её нет
-            c.execute('''CREATE TABLE IF NOT EXISTS proxy_index (
-                        file_name TEXT PRIMARY KEY,
-                        last_index INTEGER DEFAULT 0)''')
-            logging.info("Проверена/создана таблица proxy_index")
-            
-            # Проверяем наличие таблицы user_settings
-            c.execute("""SELECT name FROM sqlite_master 
-                        WHERE type='table' AND name='user_settings'""")
-            table_exists = c.fetchone() is not None
-            
-            if table_exists:
-                # Проверяем наличие колонок в таблице user_settings
-                c.execute("PRAGMA table_info(user_settings)")
-                columns = [column[1] for column in c.fetchall()]
-                
-                # Список колонок для добавления
-                columns_to_add = [
-                    ('language', 'TEXT', "DEFAULT 'ru'"),
-                    ('notifications', 'INTEGER', 'DEFAULT 1'),
-                    ('last_update', 'TIMESTAMP', 'DEFAULT CURRENT_TIMESTAMP')
-                ]
-                
-                for column_name, column_type, default_value in columns_to_add:
-                    if column_name not in columns:
-                        try:
-                            c.execute(f'''ALTER TABLE user_settings 
-                                        ADD COLUMN {column_name} {column_type} {default_value}''')
-                            logging.info(f"Добавлена колонка '{column_name}' в таблицу user_settings")
-                        except sqlite3.Error as e:
-                            logging.error(f"Ошибка при добавлении колонки '{column_name}': {e}")
-            
-            # Проверяем и обновляем таблицу support_tickets
-            c.execute("PRAGMA table_info(support_tickets)")
-            ticket_columns = [column[1] for column in c.fetchall()]
-            
-            # Список колонок для добавления в support_tickets
-            ticket_columns_to_add = [
-                ('username', 'TEXT'),
-                ('first_name', 'TEXT'),
-                ('last_name', 'TEXT'),
-                ('message', 'TEXT'),
-                ('media_type', 'TEXT'),
-                ('media_path', 'TEXT'),
-                ('status', 'TEXT', "DEFAULT 'open'"),
-                ('admin_id', 'INTEGER'),
-                ('reply_message', 'TEXT'),
-                ('reply_media_type', 'TEXT'),
-                ('reply_media_path', 'TEXT'),
-                ('replied_at', 'TIMESTAMP')
-            ]
-            
-            for column_info in ticket_columns_to_add:
-                column_name = column_info[0]
-                if column_name not in ticket_columns:
-                    try:
-                        if len(column_info) == 3:
-                            # Если есть значение по умолчанию
-                            c.execute(f'''ALTER TABLE support_tickets 
-                                        ADD COLUMN {column_name} {column_info[1]} {column_info[2]}''')
-                        else:
-                            c.execute(f'''ALTER TABLE support_tickets 
-                                        ADD COLUMN {column_name} {column_info[1]}''')
-                        logging.info(f"Добавлена колонка '{column_name}' в таблицу support_tickets")
-                    except sqlite3.Error as e:
-                        logging.error(f"Ошибка при добавлении колонки '{column_name}': {e}")
-            
-            conn.commit()
-            logging.info("Миграция базы данных выполнена успешно")
-            
-    except Exception as e:
-        logging.error(f"Ошибка при миграции базы данных: {e}")
-        raise
-
 # Сохранение тикета в БД
-def create_support_ticket(user_id, username, first_name, last_name, message, media_type=None, media_path=None):
-    with get_connection() as conn:
-        c = conn.cursor()
-        
-        # Проверяем лимит открытых тикетов
-        c.execute("SELECT COUNT(*) FROM support_tickets WHERE user_id = ? AND status = 'open'", (user_id,))
-        open_tickets = c.fetchone()[0]
-        
-        if open_tickets >= MAX_TICKETS_PER_USER:
-            return None
-        
-        c.execute('''INSERT INTO support_tickets 
-                     (user_id, username, first_name, last_name, message, media_type, media_path) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                  (user_id, username, first_name, last_name, message, media_type, media_path))
-        
-        ticket_id = c.lastrowid
-        return ticket_id
-
-# Обновление ответа на тикет
-def update_ticket_reply(ticket_id, admin_id, reply_message, reply_media_type=None, reply_media_path=None):
-    conn = sqlite3.connect(DB_FILE)
+def _create_support_ticket(conn, user_id, username, first_name, last_name, message, media_type, media_path, media_name):
     c = conn.cursor()
     
-    c.execute('''UPDATE support_tickets 
-                 SET status = 'closed',
-                     replied_at = CURRENT_TIMESTAMP,
-                     admin_id = ?,
-                     reply_message = ?,
-                     reply_media_type = ?,
-                     reply_media_path = ?
-                 WHERE id = ?''',
-              (admin_id, reply_message, reply_media_type, reply_media_path, ticket_id))
+    # Проверяем лимит открытых тикетов
+    c.execute("SELECT COUNT(*) FROM support_tickets WHERE user_id = ? AND status = 'open'", (user_id,))
+    open_tickets = c.fetchone()[0]
+    
+    if open_tickets >= MAX_TICKETS_PER_USER:
+        return None
+    
+    c.execute('''INSERT INTO support_tickets 
+                 (user_id, username, first_name, last_name, message, media_type, media_path) 
+                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
+              (user_id, username, first_name, last_name, message, media_type, media_path))
+    ticket_id = c.lastrowid
     
-    conn.commit()
-    conn.close()
+    # Вложение закрепляется за пользователем и тикетом в той же транзакции
+    if media_path:
+        media_store.add_ref(conn, media_path, user_id, ticket_id, "ticket", media_name)
+    return ticket_id
+
+async def create_support_ticket(user_id, username, first_name, last_name, message, media_type=None, media_path=None,
+                                media_name=None):
+    return await db.write(
+        _create_support_ticket,
+        user_id, username, first_name, last_name, message, media_type, media_path, media_name
+    )
+
+# Вложения поддержки в хранилище по содержимому
+async def add_media_ref(media_path, owner_id, ticket_id, role, media_name=None):
+    return await db.write(media_store.add_ref, media_path, owner_id, ticket_id, role, media_name)
+
+async def release_media(ref_id):
+    return await db.write(media_store.release, ref_id)
+
+async def get_user_files(user_id):
+    return await db.read(media_store.user_files, user_id)
+
+# Обновление ответа на тикет
+def _update_ticket_reply(conn, ticket_id, admin_id, reply_message, reply_media_type, reply_media_path):
+    conn.execute('''UPDATE support_tickets 
+                    SET status = 'closed',
+                        replied_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP,
+                        admin_id = ?,
+                        reply_message = ?,
+                        reply_media_type = ?,
+                        reply_media_path = ?
+                    WHERE id = ?''',
+                 (admin_id, reply_message, reply_media_type, reply_media_path, ticket_id))
+
+async def update_ticket_reply(ticket_id, admin_id, reply_message, reply_media_type=None, reply_media_path=None):
+    await db.write(_update_ticket_reply, ticket_id, admin_id, reply_message, reply_media_type, reply_media_path)
+
+# Списки ниже отдаются страницами: cursor - id крайней записи предыдущей
+# страницы, newer - листать к более новым записям (см. pagination.keyset_page)
 
 # Получение открытых тикетов
-def get_open_tickets():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM support_tickets WHERE status = 'open'")
-    tickets = c.fetchall()
-    conn.close()
-    return tickets
+def _get_open_tickets(conn, cursor, newer, limit):
+    return keyset_page(conn, "SELECT * FROM support_tickets WHERE status = 'open'", (),
+                       "support_tickets", "created_at", cursor, newer, limit)
+
+async def get_open_tickets(cursor: Optional[int] = None, newer: bool = False, limit: int = PAGE_SIZE) -> Page:
+    return await db.read(_get_open_tickets, cursor, newer, limit)
 
 # Получение тикетов пользователя
-def get_user_tickets(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM support_tickets WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-    tickets = c.fetchall()
-    conn.close()
-    return tickets
+def _get_user_tickets(conn, user_id, cursor, newer, limit):
+    return keyset_page(conn, "SELECT * FROM support_tickets WHERE user_id = ?", (user_id,),
+                       "support_tickets", "created_at", cursor, newer, limit)
+
+async def get_user_tickets(user_id, cursor: Optional[int] = None, newer: bool = False, limit: int = PAGE_SIZE) -> Page:
+    return await db.read(_get_user_tickets, user_id, cursor, newer, limit)
 
 # Получение информации о тикете
-def get_ticket_info(ticket_id):
+def _get_ticket_info(conn, ticket_id):
+    return conn.execute("SELECT * FROM support_tickets WHERE id = ?", (ticket_id,)).fetchone()
+
+async def get_ticket_info(ticket_id):
     """Получение информации о тикете по ID"""
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM support_tickets WHERE id = ?",
-            (ticket_id,)
-        )
-        return cursor.fetchone()
-
-def update_ticket_status(ticket_id: int, status: str) -> bool:
+    return await db.read(_get_ticket_info, ticket_id)
+
+def _update_ticket_status(conn, ticket_id, status):
+    cursor = conn.execute(
+        "UPDATE support_tickets SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (status, ticket_id)
+    )
+    return cursor.rowcount > 0
+
+async def update_ticket_status(ticket_id: int, status: str) -> bool:
     """Обновление статуса тикета
     
     Args:
@@ -285,176 +142,378 @@ def update_ticket_status(ticket_id: int, status: str) -> bool:
         bool: True если обновление прошло успешно, иначе False
     """
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE support_tickets SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (status, ticket_id)
-            )
-            conn.commit()
-            return cursor.rowcount > 0
+        return await db.write(_update_ticket_status, ticket_id, status)
     except Exception as e:
         logging.error(f"Ошибка при обновлении статуса тикета {ticket_id}: {e}")
         return False
 
 # Загрузка списка прокси-файлов
-def load_proxy_files():
+def _load_proxy_files(conn):
+    c = conn.execute("SELECT file_name, display_name, description, selection_mode FROM proxy_files")
+    return [{"name": f[0], "display": f[1], "description": f[2], "mode": f[3]} for f in c.fetchall()]
+
+async def load_proxy_files():
     """Load all proxy files from the database.
     
     Returns:
         list: List of dictionaries containing proxy file info, or empty list if none found
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT file_name, display_name, description FROM proxy_files")
-        files = c.fetchall()
-        return [{"name": f[0], "display": f[1], "description": f[2]} for f in files]
+        return await db.read(_load_proxy_files)
     except sqlite3.Error as e:
         logging.error(f"Error loading proxy files: {e}")
         return []
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # Добавление нового прокси-файла
-def add_proxy_file(file_name, display_name, description=""):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+def _add_proxy_file(conn, file_name, display_name, description):
     try:
-        c.execute("INSERT INTO proxy_files (file_name, display_name, description) VALUES (?, ?, ?)",
-                  (file_name, display_name, description))
-        conn.commit()
+        conn.execute("INSERT INTO proxy_files (file_name, display_name, description) VALUES (?, ?, ?)",
+                     (file_name, display_name, description))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
-# Загрузка прокси из файла
-def load_proxies(file_name):
-    file_path = os.path.join(PROXY_FOLDER, file_name)
-    try:
-        with open(file_path, 'r') as f:
-            return [line.strip() for line in f if line.strip()]
-    except FileNotFoundError:
-        return []
+async def add_proxy_file(file_name, display_name, description=""):
+    return await db.write(_add_proxy_file, file_name, display_name, description)
+
+def _set_selection_mode(conn, file_name, mode):
+    c = conn.execute("UPDATE proxy_files SET selection_mode = ? WHERE file_name = ?", (mode, file_name))
+    return c.rowcount > 0
+
+async def set_selection_mode(file_name, mode):
+    """Меняет режим выбора прокси для файла; False, если файла нет в БД"""
+    return await db.write(_set_selection_mode, file_name, mode)
+
+# Атомарный сдвиг курсора ротации
+def _advance_index(conn, file_name, pool_size):
+    """Сдвигает proxy_index.last_index на одну позицию и возвращает новое значение.
+
+    Чтение и запись курсора выполняются одной операцией под блокировкой записи
+    SQLite, поэтому параллельные вызовы (в том числе из разных процессов,
+    работающих с одной БД) никогда не получают один и тот же индекс.
+    """
+    if HAS_RETURNING:
+        rows = conn.execute('''INSERT INTO proxy_index (file_name, last_index)
+                               VALUES (?, 1 % ?)
+                               ON CONFLICT(file_name)
+                               DO UPDATE SET last_index = (last_index + 1) % ?
+                               RETURNING last_index''',
+                            (file_name, pool_size, pool_size)).fetchall()
+        return rows[0][0]
+
+    # Старые версии SQLite без RETURNING. Транзакция writer'а уже может быть
+    # открыта (например, после снятия аренд), поэтому BEGIN здесь нельзя:
+    # сдвиг делает UPDATE, который сразу берёт блокировку записи, а SELECT в
+    # той же транзакции читает уже наше значение
+    conn.execute("INSERT OR IGNORE INTO proxy_index (file_name, last_index) VALUES (?, 0)", (file_name,))
+    conn.execute("UPDATE proxy_index SET last_index = (last_index + 1) % ? WHERE file_name = ?",
+                 (pool_size, file_name))
+    return conn.execute("SELECT last_index FROM proxy_index WHERE file_name = ?", (file_name,)).fetchone()[0]
+
+def _positions_after(current, pool_size, seen=None):
+    # Позиции пула по кругу после current; выданные пользователю (seen)
+    # пропускаются целыми сериями через next_unset()
+    if seen is None:
+        for step in range(1, pool_size + 1):
+            yield (current + step) % pool_size
+        return
+    for start, end in ((current + 1, pool_size), (0, current + 1)):
+        position = seen.next_unset(start)
+        while position < end:
+            yield position
+            position = seen.next_unset(position + 1)
+
+def _advance_index_matching(conn, file_name, all_proxies, usable, seen=None):
+    """Сдвигает курсор на следующую запись, для индекса которой usable(index) истинно.
+
+    Следующая позиция вычисляется в памяти и записывается условным UPDATE
+    (compare-and-set): если курсор успел сдвинуть другой процесс, попытка
+    повторяется от нового значения. Если подходящих записей нет, курсор не
+    меняется и возвращается None. Индексы из seen (CompactBitmap) не
+    выдаются и не передаются в usable.
+    """
+    pool_size = len(all_proxies)
+    while True:
+        row = conn.execute("SELECT last_index FROM proxy_index WHERE file_name = ?", (file_name,)).fetchone()
+        current = row[0] if row else 0
+
+        next_index = next(filter(usable, _positions_after(current, pool_size, seen)), None)
+        if next_index is None:
+            return None
+
+        if row is None:
+            updated = conn.execute('''INSERT OR IGNORE INTO proxy_index (file_name, last_index)
+                                      VALUES (?, ?)''', (file_name, next_index)).rowcount
+        else:
+            updated = conn.execute('''UPDATE proxy_index SET last_index = ?
+                                      WHERE file_name = ? AND last_index = ?''',
+                                   (next_index, file_name, current)).rowcount
+        if updated:
+            return next_index
+
+def _next_index(conn, file_name, all_proxies, user_id, usable=None, country=None, seen=None):
+    """Индекс следующей записи с учётом режима выбора, страны и фильтра usable.
+
+    seen - выданные пользователю индексы, которые usable уже отсеивает;
+    курсор ротации с ними пропускает эти индексы без вызова usable.
+    """
+    if country is not None:
+        # Запись выбранной страны берётся по курсору её корзины в индексе
+        healthy = lambda index: (usable is None or usable(index)) and proxy_pool.is_healthy(all_proxies[index])
+        next_index = country_index.pick(file_name, all_proxies, country, healthy)
+        if next_index is None and proxy_pool.has_unhealthy:
+            next_index = country_index.pick(file_name, all_proxies, country, usable)
+        return next_index
+
+    # Файлы с режимом weighted/lru/p2c/balanced выбирают запись в памяти без курсора в БД
+    if selector.mode(file_name) != DEFAULT_MODE:
+        return selector.pick(file_name, all_proxies, user_id, usable)
+
+    if usable is None:
+        if not proxy_pool.has_unhealthy:
+            return _advance_index(conn, file_name, len(all_proxies))
+        usable = lambda index: True
+        fallback = None
+    else:
+        fallback = usable
+
+    if not proxy_pool.has_unhealthy:
+        return _advance_index_matching(conn, file_name, all_proxies, fallback, seen)
+
+    # Проверка нашла недоступные адреса - пропускаем их записи
+    healthy = _advance_index_matching(conn, file_name, all_proxies,
+                                      lambda index: usable(index) and proxy_pool.is_healthy(all_proxies[index]),
+                                      seen)
+    if healthy is not None:
+        return healthy
+    # Если недоступны все подходящие записи, выдаём без учёта проверки:
+    # скорее всего, недоступна сеть самого бота, а не все прокси сразу
+    if fallback is None:
+        return _advance_index(conn, file_name, len(all_proxies))
+    return _advance_index_matching(conn, file_name, all_proxies, fallback, seen)
+
+def _pick_index(conn, file_name, all_proxies, user_id, usable, seen, country):
+    if seen is not None:
+        # Сначала ищем запись, которую пользователь ещё не получал
+        next_index = _next_index(conn, file_name, all_proxies, user_id,
+                                 lambda index: index not in seen and (usable is None or usable(index)),
+                                 country, seen)
+        if next_index is not None:
+            return next_index
+        if len(seen) >= len(all_proxies):
+            # Пользователь получил все записи файла - начинаем новый круг.
+            # Если невыданные есть, но заняты арендой, круг не сбрасывается
+            seen_tracker.reset(user_id, file_name)
+    return _next_index(conn, file_name, all_proxies, user_id, usable, country)
 
 # Получение следующего прокси из файла
-def get_next_proxy(file_name):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Получаем все прокси из файла
-    all_proxies = load_proxies(file_name)
+def _get_next_proxy(conn, file_name, user_id=None, country=None):
+    # Получаем прокси файла из пула в памяти
+    all_proxies = proxy_pool.get(file_name)
     if not all_proxies:
         return None
     
-    # Получаем текущий индекс
-    c.execute("SELECT last_index FROM proxy_index WHERE file_name = ?", (file_name,))
-    result = c.fetchone()
-    current_index = result[0] if result else 0
+    if user_id is None:
+        # Пользователю выдаётся исходный URI проверенной записи
+        next_index = _next_index(conn, file_name, all_proxies, user_id, country=country)
+        return all_proxies[next_index].uri if next_index is not None else None
     
-    # Выбираем следующий прокси
-    next_index = (current_index + 1) % len(all_proxies)
-    proxy = all_proxies[next_index]
+    usable = None
+    if lease_manager.enabled:
+        # Аренда: новый прокси заменяет прежний прокси пользователя в этом файле
+        now = time.time()
+        lease_manager.expire(conn, now)
+        lease_manager.refresh(conn, file_name, now)
+        lease_manager.release(conn, user_id, file_name)
+        usable = lambda index: not lease_manager.is_leased(file_name, all_proxies[index].uri, now)
     
-    # Обновляем индекс
-    c.execute('''INSERT OR REPLACE INTO proxy_index (file_name, last_index)
-                 VALUES (?, ?)''', (file_name, next_index))
+    seen = None
+    if seen_tracker.enabled:
+        seen = seen_tracker.get(conn, user_id, file_name, all_proxies, _pending_history(user_id))
+    synced = False
+    while True:
+        next_index = None
+        if not lease_manager.enabled or lease_manager.leased_count(file_name) < len(all_proxies):
+            next_index = _pick_index(conn, file_name, all_proxies, user_id, usable, seen, country)
+        if next_index is None:
+            if not lease_manager.enabled or synced:
+                return None
+            # По памяти свободных записей нет: аренды могли снять другие
+            # процессы, поэтому один раз сверяемся с таблицей
+            lease_manager.sync(conn, file_name, now)
+            synced = True
+            continue
+        proxy = all_proxies[next_index].uri
+        # Запись мог занять другой процесс: его аренда попадает в память,
+        # и следующий выбор её пропускает
+        if not lease_manager.enabled or lease_manager.acquire(conn, file_name, proxy, user_id, now) is not None:
+            break
     
-    conn.commit()
-    conn.close()
+    if seen is not None:
+        seen_tracker.mark(user_id, file_name, next_index)
     return proxy
 
+async def get_next_proxy(file_name, user_id=None, country=None):
+    try:
+        proxy = await db.write(_get_next_proxy, file_name, user_id, country)
+    except Exception:
+        # Транзакция откатилась, а память аренд уже изменена - файл будет
+        # перечитан из таблицы в следующей выдаче
+        if lease_manager.enabled:
+            lease_manager.invalidate(file_name)
+        raise
+    if seen_tracker.enabled and user_id is not None:
+        # Отметки выданных записей пишутся вместе с ближайшим пакетом истории
+        write_behind.defer(seen_tracker.flush)
+    return proxy
+
+def _get_latest_issues(conn):
+    # Последний выданный прокси каждого пользователя по каждому типу и время
+    # выдачи в секундах эпохи
+    c = conn.execute('''SELECT user_id, proxy_type, proxy, CAST(strftime('%s', issue_date) AS INTEGER)
+                        FROM proxy_history
+                        WHERE id IN (SELECT MAX(id) FROM proxy_history GROUP BY user_id, proxy_type)''')
+    return c.fetchall()
+
+async def get_latest_issues():
+    await write_behind.flush()
+    return await db.read(_get_latest_issues)
+
 # Помечаем прокси как использованный
 def mark_proxy_as_used(proxy, proxy_type):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    try:
-        c.execute("INSERT INTO used_proxies (proxy, proxy_type) VALUES (?, ?)", (proxy, proxy_type))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # Прокси уже помечен как использованный
-        return False
-    finally:
-        conn.close()
+    # Повторная выдача того же прокси не должна ломать пакетную транзакцию
+    write_behind.add("INSERT OR IGNORE INTO used_proxies (proxy, proxy_type) VALUES (?, ?)",
+                     (proxy, proxy_type))
 
 # Сохранение истории прокси
+_HISTORY_INSERT = "INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (?, ?, ?)"
+
 def save_proxy_history(user_id, proxy, proxy_type):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-    c.execute("INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (?, ?, ?)", 
-              (user_id, proxy, proxy_type))
-    conn.commit()
-    conn.close()
+    write_behind.add("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+    write_behind.add(_HISTORY_INSERT, (user_id, proxy, proxy_type))
+
+def _pending_history(user_id):
+    # Выданные пользователю прокси (URI, proxy_type), которые ещё ждут записи в proxy_history
+    for sql, params in write_behind.pending():
+        if sql == _HISTORY_INSERT and params[0] == user_id:
+            yield params[1], params[2]
 
 # Получение истории прокси
-def get_proxy_history(user_id, limit=10):
-    with get_connection() as conn:
-        c = conn.cursor()
-        c.execute('''
-            SELECT id, proxy, proxy_type, datetime(issue_date, 'localtime') as issue_date
-            FROM proxy_history
-            WHERE user_id = ?
-            ORDER BY issue_date DESC
-            LIMIT ?
-        ''', (user_id, limit))
-        return [dict(row) for row in c.fetchall()]
+def _get_proxy_history(conn, user_id, cursor, newer, limit):
+    return keyset_page(conn, '''
+        SELECT h.id, h.proxy, h.proxy_type, datetime(h.issue_date, 'localtime') as issue_date
+        FROM proxy_history h
+        WHERE h.user_id = ?''', (user_id,), "proxy_history", "issue_date", cursor, newer, limit, alias="h")
+
+async def get_proxy_history(user_id, cursor: Optional[int] = None, newer: bool = False, limit: int = PAGE_SIZE) -> Page:
+    await write_behind.flush()
+    return await db.read(_get_proxy_history, user_id, cursor, newer, limit)
 
 def log_proxy_download(user_id: int, file_name: str) -> None:
-    with get_connection() as conn:
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO proxy_downloads (user_id, file_name)
-            VALUES (?, ?)
-        ''', (user_id, file_name))
-        conn.commit()
-
-def get_proxy_downloads(limit: int = 50) -> list[dict]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('''
-            SELECT d.id, d.user_id, d.file_name, 
-                   datetime(d.download_time, 'localtime') as download_time,
-                   u.username, u.first_name, u.last_name
-            FROM proxy_downloads d
-            LEFT JOIN users u ON d.user_id = u.user_id
-            ORDER BY d.download_time DESC
-            LIMIT ?
-        ''', (limit,))
-        return [dict(row) for row in c.fetchall()]
-
-def get_user_proxy_downloads(user_id: int, limit: int = 20) -> list[dict]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('''
-            SELECT id, file_name, datetime(download_time, 'localtime') as download_time
-            FROM proxy_downloads
-            WHERE user_id = ?
-            ORDER BY download_time DESC
-            LIMIT ?
-        ''', (user_id, limit))
-        return [dict(row) for row in c.fetchall()]
+    write_behind.add('''
+        INSERT INTO proxy_downloads (user_id, file_name)
+        VALUES (?, ?)
+    ''', (user_id, file_name))
+
+def _get_proxy_downloads(conn, cursor, newer, limit):
+    return keyset_page(conn, '''
+        SELECT d.id, d.user_id, d.file_name, 
+               datetime(d.download_time, 'localtime') as download_time,
+               u.username, u.first_name, u.last_name
+        FROM proxy_downloads d
+        LEFT JOIN users u ON d.user_id = u.user_id
+        WHERE 1''', (), "proxy_downloads", "download_time", cursor, newer, limit, alias="d")
+
+async def get_proxy_downloads(cursor: Optional[int] = None, newer: bool = False, limit: int = PAGE_SIZE) -> Page:
+    await write_behind.flush()
+    return await db.read(_get_proxy_downloads, cursor, newer, limit)
+
+def _get_user_proxy_downloads(conn, user_id, cursor, newer, limit):
+    return keyset_page(conn, '''
+        SELECT d.id, d.file_name, datetime(d.download_time, 'localtime') as download_time
+        FROM proxy_downloads d
+        WHERE d.user_id = ?''', (user_id,), "proxy_downloads", "download_time", cursor, newer, limit, alias="d")
+
+async def get_user_proxy_downloads(user_id: int, cursor: Optional[int] = None, newer: bool = False,
+                                   limit: int = PAGE_SIZE) -> Page:
+    await write_behind.flush()
+    return await db.read(_get_user_proxy_downloads, user_id, cursor, newer, limit)
 
 # Получение настроек пользователя
-def get_user_settings(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM user_settings WHERE user_id = ?", (user_id,))
-    settings = c.fetchone()
+def _get_user_settings(conn, user_id):
+    settings = conn.execute("SELECT * FROM user_settings WHERE user_id = ?", (user_id,)).fetchone()
     if not settings:
-        c.execute('''INSERT INTO user_settings (user_id) VALUES (?)''', (user_id,))
-        conn.commit()
+        conn.execute('''INSERT INTO user_settings (user_id) VALUES (?)''', (user_id,))
         settings = (user_id, 'ru', 1)
-    conn.close()
     return {
         'user_id': settings[0],
         'language': settings[1],
         'notifications': settings[2]
-    }
\ No newline at end of file
+    }
+
+async def get_user_settings(user_id):
+    return await db.write(_get_user_settings, user_id)
+
+# Статистика для администратора
+def _get_statistics(conn, since):
+    c = conn.cursor()
+
+    # Общая статистика
+    c.execute("SELECT key, value FROM stats_totals")
+    values = dict(c.fetchall())
+    totals = tuple(values.get(key, 0) for key in ("users", "proxies_issued", "downloads", "active_users"))
+    
+    # Хранилище вложений: занято сейчас и освобождено очисткой
+    media = tuple(values.get(key, 0) for key in (
+        "media_stored_files", "media_stored_bytes", "media_reclaimed_files", "media_reclaimed_bytes"))
+
+    # Статистика по дням
+    c.execute("""
+        SELECT day, SUM(issued) as count
+        FROM stats_daily
+        WHERE day >= ?
+        GROUP BY day
+        ORDER BY day DESC
+    """, (since,))
+    daily = [tuple(row) for row in c.fetchall()]
+
+    # Популярные прокси
+    c.execute("""
+        SELECT proxy_type, issued
+        FROM stats_proxy_type
+        ORDER BY issued DESC
+        LIMIT 5
+    """)
+    top_proxies = [tuple(row) for row in c.fetchall()]
+
+    # Активные пользователи
+    c.execute("""
+        SELECT s.user_id, u.first_name, u.username, s.issued
+        FROM stats_user s
+        LEFT JOIN users u ON u.user_id = s.user_id
+        ORDER BY s.issued DESC
+        LIMIT 5
+    """)
+    active_users = [tuple(row) for row in c.fetchall()]
+
+    return {
+        'totals': totals,
+        'media': media,
+        'daily': daily,
+        'top_proxies': top_proxies,
+        'active_users': active_users
+    }
+
+async def get_statistics(since: str) -> dict:
+    """Сводная статистика для экрана «📊 Статистика»
+
+    Args:
+        since: Дата (YYYY-MM-DD), начиная с которой считается активность по дням
+    """
+    await write_behind.flush()
+    return await db.read(_get_statistics, since)
+
+async def rebuild_statistics() -> None:
+    """Полный пересчёт агрегатов статистики (команда /rebuildstats)"""
+    await write_behind.flush()
+    await db.write(_rebuild_statistics)
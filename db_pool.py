@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+# Настройки соединений: WAL позволяет читателям работать параллельно с writer'ом,
+# а synchronous=NORMAL в режиме WAL делает fsync только при checkpoint
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+# INSERT/UPDATE/DELETE ... RETURNING появились в SQLite 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class DatabasePool:
+    """Пул долгоживущих соединений SQLite.
+
+    Все записи выполняются одним выделенным потоком-writer'ом на одном
+    соединении, чтения - несколькими потоками-reader'ами, у каждого из которых
+    своё соединение. Запросы выполняются вне event loop, корутины только
+    ожидают результат.
+    """
+
+    def __init__(self, db_file: str, readers: int = 4, cached_statements: int = 256):
+        self.db_file = db_file
+        self.readers = readers
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._reader_executor: Optional[ThreadPoolExecutor] = None
+        self._writer_executor: Optional[ThreadPoolExecutor] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        # Каждый поток пула получает собственное соединение при первом обращении
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _run_read(self, func: Callable[..., Any], args: tuple) -> Any:
+        return func(self._thread_connection(), *args)
+
+    def _run_write(self, func: Callable[..., Any], args: tuple) -> Any:
+        conn = self._thread_connection()
+        # Одна транзакция на вызов: commit при успехе, rollback при ошибке
+        with conn:
+            return func(conn, *args)
+
+    def _executors(self):
+        if self._writer_executor is None:
+            self._reader_executor = ThreadPoolExecutor(
+                max_workers=self.readers, thread_name_prefix="db-reader"
+            )
+            self._writer_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="db-writer"
+            )
+        return self._reader_executor, self._writer_executor
+
+    async def read(self, func: Callable[..., Any], *args) -> Any:
+        """Выполняет func(conn, *args) на одном из соединений-читателей"""
+        reader, _ = self._executors()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(reader, self._run_read, func, args)
+
+    async def write(self, func: Callable[..., Any], *args) -> Any:
+        """Выполняет func(conn, *args) в транзакции на соединении-writer'е"""
+        _, writer = self._executors()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(writer, self._run_write, func, args)
+
+    def close(self):
+        """Дожидается завершения запросов и закрывает все соединения"""
+        for executor in (self._reader_executor, self._writer_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._reader_executor = None
+        self._writer_executor = None
+        self._local = threading.local()
+
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Ошибка при закрытии соединения с БД: {e}")
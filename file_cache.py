@@ -0,0 +1,107 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from database import write_behind
+from sender import outbound
+
+# Тип вложения -> метод Bot API и одноимённый параметр с файлом
+SEND_METHODS = {
+    "photo": "send_photo",
+    "video": "send_video",
+    "document": "send_document",
+}
+
+Signature = Tuple[int, int]
+
+
+class _CachedFile:
+    __slots__ = ("signature", "kind", "file_id")
+
+    def __init__(self, signature: Signature, kind: str, file_id: str):
+        self.signature = signature
+        self.kind = kind
+        self.file_id = file_id
+
+
+def _file_id(message: Any, kind: str) -> Optional[str]:
+    """file_id отправленного вложения из ответа Bot API"""
+    if kind == "photo":
+        # Последний размер фото - исходное изображение
+        return message.photo[-1].file_id if message.photo else None
+    # Документ Telegram может вернуть как анимацию или видео
+    for attribute in (kind, "document", "animation", "video"):
+        attachment = getattr(message, attribute, None)
+        if attachment is not None:
+            return attachment.file_id
+    return None
+
+
+class FileIdCache:
+    """Кэш file_id уже загруженных в Telegram файлов.
+
+    Ключ - абсолютный путь файла, значение действительно, пока у файла те же
+    (mtime_ns, размер) и тот же тип вложения. Первая отправка загружает файл
+    целиком, следующие передают только file_id. Если Telegram отклоняет
+    file_id, запись удаляется и файл загружается заново.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _CachedFile] = {}
+
+    def load(self, conn: sqlite3.Connection) -> int:
+        """Загружает сохранённые file_id при старте"""
+        rows = conn.execute("SELECT path, kind, mtime_ns, size, file_id FROM telegram_files").fetchall()
+        for path, kind, mtime_ns, size, file_id in rows:
+            self._entries[path] = _CachedFile((mtime_ns, size), kind, file_id)
+        return len(rows)
+
+    def lookup(self, path: str, kind: str) -> Optional[str]:
+        """file_id файла, если он уже загружен и с тех пор не менялся"""
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None or entry.kind != kind:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return entry.file_id if entry.signature == (stat.st_mtime_ns, stat.st_size) else None
+
+    def remember(self, path: str, kind: str, signature: Signature, file_id: str):
+        path = os.path.abspath(path)
+        self._entries[path] = _CachedFile(signature, kind, file_id)
+        write_behind.add(
+            '''INSERT OR REPLACE INTO telegram_files (path, kind, mtime_ns, size, file_id, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (path, kind, signature[0], signature[1], file_id, time.time())
+        )
+
+    def forget(self, path: str):
+        path = os.path.abspath(path)
+        if self._entries.pop(path, None) is not None:
+            write_behind.add("DELETE FROM telegram_files WHERE path = ?", (path,))
+
+    async def send(self, bot: Bot, chat_id: int, kind: str, path: str, **kwargs) -> Any:
+        """Отправляет файл как вложение kind через outbound, по возможности по file_id"""
+        method = getattr(bot, SEND_METHODS[kind])
+        file_id = self.lookup(path, kind)
+        if file_id is not None:
+            try:
+                return await outbound.send(method, chat_id, **{kind: file_id}, **kwargs)
+            except TelegramBadRequest as e:
+                logging.warning(f"Telegram отклонил file_id для {path}, файл будет загружен заново: {e}")
+                self.forget(path)
+
+        stat = os.stat(path)
+        message = await outbound.send(method, chat_id, **{kind: FSInputFile(path)}, **kwargs)
+        file_id = _file_id(message, kind)
+        if file_id is not None:
+            self.remember(path, kind, (stat.st_mtime_ns, stat.st_size), file_id)
+        return message
+
+
+file_id_cache = FileIdCache()
@@ -0,0 +1,174 @@
+import ipaddress
+import itertools
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from config import GEOIP_FILE
+from pool_index import column
+from proxy_parser import ProxyRecord
+
+# Флаг страны - пара символов Regional Indicator, кодирующих ISO 3166-1 alpha-2
+_INDICATOR_A = 0x1F1E6
+_INDICATOR_Z = 0x1F1FF
+
+
+def flag_country(text: str) -> Optional[str]:
+    """Код страны по первому флагу в тексте ("🇷🇺Россия#29" -> "RU")"""
+    previous = None
+    for char in text:
+        code = ord(char)
+        if _INDICATOR_A <= code <= _INDICATOR_Z:
+            if previous is not None:
+                return chr(previous - _INDICATOR_A + 65) + chr(code - _INDICATOR_A + 65)
+            previous = code
+        else:
+            previous = None
+    return None
+
+
+def country_flag(country: str) -> str:
+    """Флаг по коду страны ("RU" -> "🇷🇺")"""
+    return "".join(chr(_INDICATOR_A + ord(letter) - 65) for letter in country.upper())
+
+
+class IpRanges:
+    """Локальная таблица диапазонов IP -> страна с поиском бинарным поиском.
+
+    Формат файла - CSV без заголовка: начальный адрес, конечный адрес, код
+    страны (как в бесплатных базах вида dbip-country-lite.csv). Диапазоны
+    IPv4 и IPv6 хранятся раздельно отсортированными по началу.
+    """
+
+    def __init__(self):
+        self._starts: Dict[int, List[int]] = {4: [], 6: []}
+        self._ends: Dict[int, List[int]] = {4: [], 6: []}
+        self._countries: Dict[int, List[str]] = {4: [], 6: []}
+
+    def __len__(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def load(self, path: str) -> int:
+        """Загружает таблицу из файла; возвращает число диапазонов"""
+        ranges: Dict[int, List[Tuple[int, int, str]]] = {4: [], 6: []}
+        skipped = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) < 3:
+                    continue
+                try:
+                    start = ipaddress.ip_address(parts[0].strip())
+                    end = ipaddress.ip_address(parts[1].strip())
+                except ValueError:
+                    skipped += 1
+                    continue
+                country = parts[2].strip().strip('"').upper()
+                if start.version == end.version and len(country) == 2:
+                    ranges[start.version].append((int(start), int(end), country))
+
+        for version, items in ranges.items():
+            items.sort()
+            self._starts[version] = [start for start, _, _ in items]
+            self._ends[version] = [end for _, end, _ in items]
+            self._countries[version] = [country for _, _, country in items]
+        if skipped:
+            logging.warning(f"Таблица стран {path}: пропущено {skipped} некорректных строк")
+        return len(self)
+
+    def lookup(self, host: str) -> Optional[str]:
+        """Страна для IP-адреса; доменные имена не разрешаются"""
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return None
+        value = int(address)
+        starts = self._starts[address.version]
+        position = bisect_right(starts, value) - 1
+        if position >= 0 and value <= self._ends[address.version][position]:
+            return self._countries[address.version][position]
+        return None
+
+
+class _FileCountries:
+    """Корзины записей одного файла по странам с курсором ротации в каждой.
+
+    Корзина - массив индексов (4 байта на запись); из индекса пула читаются
+    только примечание и хост записи.
+    """
+
+    def __init__(self, records: Sequence[ProxyRecord], ranges: IpRanges):
+        self.records = records
+        self.buckets: Dict[str, array] = {}
+        hosts = column(records, "host") if len(ranges) else itertools.repeat(None)
+        for index, (remark, host) in enumerate(zip(column(records, "remark"), hosts)):
+            country = flag_country(remark) or (ranges.lookup(host) if host is not None else None)
+            if country is not None:
+                bucket = self.buckets.get(country)
+                if bucket is None:
+                    bucket = self.buckets[country] = array('I')
+                bucket.append(index)
+        self.cursors: Dict[str, int] = dict.fromkeys(self.buckets, 0)
+        # Страны по убыванию числа записей - порядок кнопок в меню
+        self.countries: List[Tuple[str, int]] = sorted(
+            ((country, len(bucket)) for country, bucket in self.buckets.items()),
+            key=lambda item: (-item[1], item[0])
+        )
+
+
+class CountryIndex:
+    """Инвертированный индекс страна -> записи файла.
+
+    Строится один раз на содержимое файла (при смене кортежа записей в пуле),
+    страна определяется по флагу в примечании записи, а если его нет - по
+    таблице диапазонов IP. Выдача из корзины страны идёт по курсору в памяти
+    и не просматривает файл целиком.
+    """
+
+    def __init__(self, ranges: IpRanges):
+        self.ranges = ranges
+        self._files: Dict[str, _FileCountries] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, file_name: str, records: Tuple[ProxyRecord, ...]) -> _FileCountries:
+        entry = self._files.get(file_name)
+        if entry is None or entry.records is not records:
+            entry = self._files[file_name] = _FileCountries(records, self.ranges)
+        return entry
+
+    def countries(self, file_name: str, records: Tuple[ProxyRecord, ...]) -> List[Tuple[str, int]]:
+        """Страны файла и число записей в каждой"""
+        with self._lock:
+            return self._file(file_name, records).countries
+
+    def pick(self, file_name: str, records: Tuple[ProxyRecord, ...], country: str,
+             usable: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """Следующий по кругу индекс записи страны, для которого usable(index) истинно"""
+        with self._lock:
+            entry = self._file(file_name, records)
+            bucket = entry.buckets.get(country)
+            if not bucket:
+                return None
+            position = entry.cursors[country]
+            for step in range(len(bucket)):
+                index = bucket[(position + step) % len(bucket)]
+                if usable is None or usable(index):
+                    entry.cursors[country] = (position + step + 1) % len(bucket)
+                    return index
+            return None
+
+
+ip_ranges = IpRanges()
+country_index = CountryIndex(ip_ranges)
+
+
+def load_ip_ranges() -> int:
+    """Загружает таблицу диапазонов из GEOIP_FILE, если она задана"""
+    if not GEOIP_FILE:
+        return 0
+    try:
+        return ip_ranges.load(GEOIP_FILE)
+    except OSError as e:
+        logging.error(f"Не удалось загрузить таблицу стран {GEOIP_FILE}: {e}")
+        return 0
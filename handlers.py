@@ -1,26 +1,38 @@
+import html
 import logging
 import os
+import time
 from aiogram import types, F, Bot, Router, Dispatcher
-from aiogram.filters import Command, or_f
+from aiogram.filters import Command, CommandObject, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramBadRequest
 from database import (
-    load_proxy_files, get_next_proxy, mark_proxy_as_used, save_proxy_history, 
-    update_ticket_status, init_db, migrate_db, create_support_ticket, 
+    get_next_proxy, mark_proxy_as_used, save_proxy_history, 
+    update_ticket_status, create_support_ticket, 
     get_proxy_history, get_user_settings, get_user_tickets, update_ticket_reply,
-    get_ticket_info, get_user_proxy_downloads, log_proxy_download, get_proxy_downloads
+    get_ticket_info, get_user_proxy_downloads, log_proxy_download, get_proxy_downloads,
+    get_open_tickets, add_proxy_file, get_statistics, rebuild_statistics,
+    set_selection_mode, add_media_ref, release_media, get_user_files
 )
-from utils import init_proxy_files
+from ingest import ingest_proxy_file, pool_file_name
+from sender import outbound, PRIORITY_ADMIN
+from notifications import admin_digest
+from catalog import catalog
+from file_cache import file_id_cache, SEND_METHODS
+from geo import country_flag
+from pagination import split_html
+from leases import lease_manager
+from selection import SELECTION_MODES
 
 # Create a router
 router = Router()
 from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import (
-    ADMIN_CHAT_ID, DB_FILE, MEDIA_FOLDER as SUPPORT_MEDIA_FOLDER,
+    ADMIN_CHAT_ID, MEDIA_FOLDER as SUPPORT_MEDIA_FOLDER,
     PROXY_FOLDER, MAX_TICKETS_PER_USER, ADMIN_IDS
 )
-import sqlite3
 from datetime import datetime, timedelta
 from keyboards import *
 from states import SupportStates
@@ -29,9 +41,6 @@ from utils import save_media, format_date
 # ========== ОСНОВНЫЕ КОМАНДЫ ==========
 @router.message(Command("start"))
 async def cmd_start(message: types.Message):
-    init_db()
-    migrate_db()
-    init_proxy_files()
     await message.answer(
         "👋 Привет! Я бот для выдачи прокси.\n\n"
         "👇 Нажмите на кнопку 🆘 Поддержка. Напишите сообщение: \"Отправить инструкцию по подключению прокси\". Я вам отправлю эту инструкцию.\n\n"
@@ -43,45 +52,17 @@ async def cmd_start(message: types.Message):
 @router.message(F.text == "🍔 Получить прокси")
 async def get_proxy_handler(message: types.Message):
     try:
-        # Загружаем список прокси-файлов
-        proxy_files = load_proxy_files()
-        
-        # Если список пуст, инициализируем файлы заново
-        if not proxy_files:
-            init_proxy_files()
-            proxy_files = load_proxy_files()
-            
-            # Если после инициализации все еще пусто, выводим ошибку
-            if not proxy_files:
-                await message.answer("⚠️ Ошибка: не удалось загрузить список прокси. Пожалуйста, попробуйте позже или обратитесь к администратору.")
-                return
-        
-        # Создаем список кнопок
-        buttons = []
-        for file in proxy_files:
-            # Проверяем, что файл существует
-            file_path = os.path.join("proxies", file['name'])
-            if not os.path.exists(file_path):
-                logging.warning(f"Файл прокси не найден: {file_path}")
-                continue
-                
-            buttons.append(
-                InlineKeyboardButton(
-                    text=file['display'],
-                    callback_data=f"getproxy_{file['name']}"
-                )
-            )
+        # Прокси-файлы создаются при запуске бота; пустой каталог - ошибка конфигурации
+        if not catalog.files:
+            await message.answer("⚠️ Ошибка: не удалось загрузить список прокси. Пожалуйста, попробуйте позже или обратитесь к администратору.")
+            return
         
         # Если нет доступных прокси, выводим сообщение
-        if not buttons:
+        keyboard = catalog.proxy_keyboard
+        if keyboard is None:
             await message.answer("⚠️ В данный момент нет доступных прокси. Пожалуйста, попробуйте позже.")
             return
         
-        # Группируем кнопки по 2 в ряд
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            buttons[i:i+2] for i in range(0, len(buttons), 2)
-        ])
-        
         # Удаляем предыдущее сообщение с кнопками, если оно есть
         try:
             await message.delete()
@@ -102,64 +83,73 @@ async def get_proxy_handler(message: types.Message):
 @router.callback_query(F.data.startswith("getproxy_"))
 async def get_proxy_callback(callback: types.CallbackQuery):
     file_name = callback.data.split("_", 1)[1]
+    await _issue_proxy(callback, file_name)
+
+@router.callback_query(F.data.startswith("countries_"))
+async def countries_callback(callback: types.CallbackQuery):
+    file_name = callback.data.split("_", 1)[1]
+    keyboard = await catalog.country_keyboard(file_name)
+    if keyboard is None:
+        await callback.answer("⚠️ Для этого файла страны не определены", show_alert=True)
+        return
     
-    # Получаем следующий прокси
-    proxy = get_next_proxy(file_name)
+    await callback.message.edit_text(
+        f"🌍 Выберите страну ({catalog.display_name(file_name)}):",
+        reply_markup=keyboard
+    )
+
+@router.callback_query(F.data.startswith("getcountry_"))
+async def get_country_proxy_callback(callback: types.CallbackQuery):
+    _, country, file_name = callback.data.split("_", 2)
+    await _issue_proxy(callback, file_name, country)
+
+async def _issue_proxy(callback: types.CallbackQuery, file_name: str, country: str = None):
+    # Получаем следующий прокси (из корзины страны, если она выбрана)
+    proxy = await get_next_proxy(file_name, callback.from_user.id, country)
     
     if not proxy:
-        await callback.answer("⚠️ В этом файле закончились прокси!", show_alert=True)
+        if country:
+            await callback.answer("⚠️ Для этой страны сейчас нет доступных прокси!", show_alert=True)
+        else:
+            await callback.answer("⚠️ В этом файле закончились прокси!", show_alert=True)
         return
     
     # Помечаем прокси как использованный
     mark_proxy_as_used(proxy, file_name)
     
     # Сохраняем в историю
-    display_name = next((f['display'] for f in load_proxy_files() if f['name'] == file_name), file_name)
+    display_name = catalog.display_name(file_name)
     save_proxy_history(callback.from_user.id, proxy, display_name)
     
+    lease_text = ""
+    if lease_manager.enabled:
+        lease_text = f"⏳ Прокси закреплён за вами до {format_date(time.time() + lease_manager.ttl)}\n"
+    
+    country_text = f" {country_flag(country)}" if country else ""
+    has_countries = await catalog.country_keyboard(file_name) is not None
     await callback.message.edit_text(
-        f"🔑 Ваш прокси ({display_name}):\n<code>{proxy}</code>\n\n"
+        f"🔑 Ваш прокси ({display_name}{country_text}):\n<code>{proxy}</code>\n\n"
+        f"{lease_text}"
         "✅ Сохраните его в безопасном месте!\n"
-        "🔄 Для нового прокси нажмите кнопку ещё раз"
+        "🔄 Для нового прокси нажмите кнопку ещё раз",
+        reply_markup=get_country_button(file_name) if has_countries else None
     )
     
-    # Уведомление админу
-    await callback.bot.send_message(
-        ADMIN_CHAT_ID,
-        f"🆕 Выдан прокси пользователю {callback.from_user.mention_html()}\n"
-        f"ID: {callback.from_user.id}\n"
-        f"Тип: {display_name}\n"
-        f"Прокси: {proxy}"
+    # Уведомление админу попадёт в ближайшую сводку
+    admin_digest.notify(
+        "proxy_issued",
+        f"• {callback.from_user.mention_html()} (ID: {callback.from_user.id}) - {display_name}"
     )
 
 @router.message(F.text == "📥 Скачать файл")
 async def download_file_handler(message: types.Message):
-    proxy_files = load_proxy_files()
-    if not proxy_files:
+    if catalog.download_keyboard is None:
         await message.answer("⚠️ Нет доступных прокси-файлов. Обратитесь к администратору.")
         return
     
-    # Создаем список кнопок
-    buttons = []
-    for file in proxy_files:
-        # Создаем две кнопки для каждого файла: одна для скачивания, другая для получения имени файла
-        buttons_row = [
-            InlineKeyboardButton(
-                text=f"📄 {file['display']}",
-                callback_data=f"download_{file['name']}"
-            ),
-            InlineKeyboardButton(
-                text="🔗 Ссылка",
-                callback_data=f"link_{file['name']}"
-            )
-        ]
-        buttons.append(buttons_row)
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
     await message.answer(
         "📥 Выберите файл для скачивания или получите ссылку на него:",
-        reply_markup=keyboard
+        reply_markup=catalog.download_keyboard
     )
 
 @router.callback_query(F.data.startswith("download_"))
@@ -175,26 +165,21 @@ async def download_file_callback(callback: types.CallbackQuery):
         # Логируем скачивание
         log_proxy_download(callback.from_user.id, file_name)
         
-        # Отправляем файл пользователю
-        await callback.bot.send_document(
+        # Отправляем файл пользователю; повторно загружается только изменённый файл
+        await file_id_cache.send(
+            callback.bot,
             callback.from_user.id,
-            FSInputFile(file_path),
+            "document",
+            file_path,
             caption=f"📥 <b>Файл:</b> {file_name}\n\n<i>Сохраните файл на свое устройство</i>"
         )
         await callback.answer("✅ Файл отправлен!")
         
-        # Уведомляем администратора о скачивании
+        # Уведомляем администратора о скачивании через сводку
         if str(callback.from_user.id) != str(ADMIN_CHAT_ID):
-            admin_message = (
-                f"📥 Пользователь скачал прокси-файл\n"
-                f"👤 Пользователь: {callback.from_user.mention_html()}\n"
-                f"🆔 ID: {callback.from_user.id}\n"
-                f"📂 Файл: {file_name}"
-            )
-            await callback.bot.send_message(
-                ADMIN_CHAT_ID,
-                admin_message,
-                parse_mode='HTML'
+            admin_digest.notify(
+                "file_downloaded",
+                f"• {callback.from_user.mention_html()} (ID: {callback.from_user.id}) - {file_name}"
             )
             
     except Exception as e:
@@ -217,99 +202,92 @@ async def get_file_link_callback(callback: types.CallbackQuery):
     )
     await callback.answer("✅ Ссылка скопирована!")
 
+def _user_info(item):
+    user_info = f"{item.get('first_name') or ''} {item.get('last_name') or ''} (@{item.get('username') or ''})".strip()
+    return html.escape(user_info) if user_info != "(@)" else f"ID: {item['user_id']}"
+
+def _render_downloads(page):
+    response = "📥 <b>Последние скачивания прокси-файлов:</b>\n\n"
+    for dl in page.items:
+        response += (
+            f"👤 <b>{_user_info(dl)}</b>\n"
+            f"📂 Файл: {html.escape(dl['file_name'])}\n"
+            f"🕒 {dl['download_time']}\n"
+            "────────────────────\n"
+        )
+    return response
+
+def _render_my_downloads(page):
+    response = "📥 <b>Ваши последние скачивания:</b>\n\n"
+    for dl in page.items:
+        response += (
+            f"📂 Файл: {html.escape(dl['file_name'])}\n"
+            f"🕒 {dl['download_time']}\n"
+            "────────────────────\n"
+        )
+    return response
+
+def _render_history(page):
+    response = "📜 <b>Ваша история:</b>\n\n<b>Выданные прокси:</b>\n"
+    for item in page.items:
+        proxy_type = html.escape(item.get('proxy_type') or 'Неизвестный тип')
+        proxy = html.escape(item.get('proxy') or 'Нет данных')
+        date = item.get('issue_date') or 'Неизвестная дата'
+        response += f"• <b>{proxy_type}</b>\n<code>{proxy}</code>\n└ {date}\n\n"
+    response += "📥 Скачанные файлы: /mydownloads"
+    return response
+
 @router.message(Command("downloads"))
 async def cmd_downloads(message: types.Message):
     """Показать историю скачиваний (только для администратора)"""
     if str(message.from_user.id) != str(ADMIN_CHAT_ID):
         return
         
-    downloads = get_proxy_downloads(limit=20)
-    if not downloads:
+    page = await get_proxy_downloads()
+    if not page.items:
         await message.answer("📭 Нет данных о скачиваниях")
         return
     
-    response = "📥 <b>Последние скачивания прокси-файлов:</b>\n\n"
-    for dl in downloads:
-        user_info = f"{dl.get('first_name', '')} {dl.get('last_name', '')} (@{dl.get('username', '')})".strip()
-        if not user_info.strip():
-            user_info = f"ID: {dl['user_id']}"
-            
-        response += (
-            f"👤 <b>{user_info}</b>\n"
-            f"📂 Файл: {dl['file_name']}\n"
-            f"🕒 {dl['download_time']}\n"
-            "────────────────────\n"
-        )
-    
-    await message.answer(response, parse_mode='HTML')
+    await _send_page(message, _render_downloads(page), get_page_keyboard("downloads", page))
 
 @router.message(Command("mydownloads"))
 async def cmd_my_downloads(message: types.Message):
     """Показать историю моих скачиваний"""
-    downloads = get_user_proxy_downloads(message.from_user.id)
-    if not downloads:
+    page = await get_user_proxy_downloads(message.from_user.id)
+    if not page.items:
         await message.answer("📭 Вы еще не скачивали прокси-файлы")
         return
     
-    response = "📥 <b>Ваши последние скачивания:</b>\n\n"
-    for dl in downloads:
-        response += (
-            f"📂 Файл: {dl['file_name']}\n"
-            f"🕒 {dl['download_time']}\n"
-            "────────────────────\n"
-        )
-    
-    await message.answer(response, parse_mode='HTML')
+    await _send_page(message, _render_my_downloads(page), get_page_keyboard("mydownloads", page))
 
 @router.message(F.text == "📜 История")
 async def history_handler(message: types.Message):
-    # Получаем историю прокси и загрузок
-    proxy_history = get_proxy_history(message.from_user.id)
-    download_history = get_user_proxy_downloads(message.from_user.id, limit=10)
+    # История выданных прокси по страницам, скачивания - в /mydownloads
+    page = await get_proxy_history(message.from_user.id)
     
-    if not proxy_history and not download_history:
+    if not page.items:
         await message.answer("📭 У вас еще нет истории", 
                            reply_markup=get_main_menu())
         return
     
-    response = "📜 <b>Ваша история:</b>\n\n"
-    
-    # История прокси
-    if proxy_history:
-        response += "<b>Выданные прокси:</b>\n"
-        for item in proxy_history:
-            proxy_type = item.get('proxy_type', 'Неизвестный тип')
-            proxy = item.get('proxy', 'Нет данных')
-            date = item.get('issue_date', 'Неизвестная дата')
-            response += f"• <b>{proxy_type}</b>\n<code>{proxy}</code>\n└ {date}\n\n"
-    
-    # История загрузок
-    if download_history:
-        response += "\n<b>Скачанные файлы:</b>\n"
-        for dl in download_history:
-            file_name = dl.get('file_name', 'Неизвестный файл')
-            dl_time = dl.get('download_time', 'Неизвестное время')
-            response += f"• {file_name}\n└ {dl_time}\n"
-    
-    await message.answer(response, parse_mode='HTML')
+    await _send_page(message, _render_history(page), get_page_keyboard("history", page))
 
 @router.message(F.text == "📎 Мои файлы")
 async def my_files_handler(message: types.Message):
     """Показать прикрепленные файлы пользователя"""
-    user_id = message.from_user.id
-    user_dir = os.path.join(SUPPORT_MEDIA_FOLDER, str(user_id))
+    # Один запрос по индексу (owner_id, created_at) вместо обхода папок
+    files = await get_user_files(message.from_user.id)
     
-    if not os.path.exists(user_dir) or not os.listdir(user_dir):
+    if not files:
         await message.answer("📭 У вас пока нет прикрепленных файлов.")
         return
     
-    files = [f for f in os.listdir(user_dir) if os.path.isfile(os.path.join(user_dir, f))]
-    
     response = "📁 <b>Ваши прикрепленные файлы:</b>\n\n"
-    for idx, file in enumerate(files, 1):
-        file_path = os.path.join(user_dir, file)
-        file_size = os.path.getsize(file_path) / 1024  # размер в КБ
-        response += f"{idx}. {file} ({file_size:.1f} КБ)\n"
+    for idx, (_, name, media_type, size, ticket_id, _) in enumerate(files, 1):
+        media_icon = "🖼️" if media_type == "photo" else "🎥" if media_type == "video" else "📄"
+        title = html.escape(name) if name else "Фото" if media_type == "photo" else "Видео" if media_type == "video" else "Документ"
+        ticket_info = f", тикет #{ticket_id}" if ticket_id else ""
+        response += f"{idx}. {media_icon} {title} ({size / 1024:.1f} КБ{ticket_info})\n"
     
     response += "\n📌 Для загрузки файла просто отправьте его боту в чат поддержки."
     
@@ -323,58 +301,13 @@ async def show_statistics(message: types.Message):
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
-        # Общая статистика
-        c.execute("""
-            SELECT
-                (SELECT COUNT(*) FROM users) as total_users,
-                (SELECT COUNT(*) FROM proxy_history) as total_proxies_issued,
-                (SELECT COUNT(*) FROM proxy_downloads) as total_downloads,
-                (SELECT COUNT(DISTINCT user_id) FROM proxy_downloads) as active_users
-        """)
-        stats = c.fetchone()
-
-        # Статистика по дням
         week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        c.execute("""
-            SELECT
-                date(issue_date) as day,
-                COUNT(*) as count
-            FROM proxy_history
-            WHERE date(issue_date) >= ?
-            GROUP BY date(issue_date)
-            ORDER BY day DESC
-        """, (week_ago,))
-        daily_stats = c.fetchall()
-
-        # Популярные прокси
-        c.execute("""
-            SELECT
-                proxy_type,
-                COUNT(*) as count
-            FROM proxy_history
-            GROUP BY proxy_type
-            ORDER BY count DESC
-            LIMIT 5
-        """)
-        top_proxies = c.fetchall()
-
-        # Активные пользователи
-        c.execute("""
-            SELECT
-                u.user_id,
-                u.first_name,
-                u.username,
-                COUNT(h.id) as proxy_count
-            FROM users u
-            LEFT JOIN proxy_history h ON u.user_id = h.user_id
-            GROUP BY u.user_id
-            ORDER BY proxy_count DESC
-            LIMIT 5
-        """)
-        active_users = c.fetchall()
+        statistics = await get_statistics(week_ago)
+        stats = statistics['totals']
+        daily_stats = statistics['daily']
+        top_proxies = statistics['top_proxies']
+        active_users = statistics['active_users']
+        media_files, media_size, reclaimed_files, reclaimed_size = statistics['media']
 
         # Формируем сообщение
         response = (
@@ -382,7 +315,9 @@ async def show_statistics(message: types.Message):
             f"👥 Всего пользователей: <b>{stats[0]}</b>\n"
             f"🔑 Выдано прокси: <b>{stats[1]}</b>\n"
             f"📥 Всего загрузок: <b>{stats[2]}</b>\n"
-            f"👥 Активных пользователей: <b>{stats[3]}</b>\n\n"
+            f"👥 Активных пользователей: <b>{stats[3]}</b>\n"
+            f"📎 Вложений поддержки: <b>{media_files}</b> ({media_size / 1024 / 1024:.1f} МБ)\n"
+            f"🧹 Очищено вложений: <b>{reclaimed_files}</b> ({reclaimed_size / 1024 / 1024:.1f} МБ)\n\n"
             "<b>📈 Активность за неделю:</b>\n"
         )
 
@@ -407,9 +342,52 @@ async def show_statistics(message: types.Message):
         logging.error(f"Ошибка при получении статистики: {e}")
         await message.answer("❌ Произошла ошибка при загрузке статистики")
 
+@router.message(Command("rebuildstats"))
+async def cmd_rebuild_stats(message: types.Message):
+    """Пересчитать агрегаты статистики (только для администратора)"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        await rebuild_statistics()
+        await message.answer("✅ Статистика пересчитана")
+    except Exception as e:
+        logging.error(f"Ошибка при пересчёте статистики: {e}")
+        await message.answer("❌ Не удалось пересчитать статистику")
+
+@router.message(Command("selection"))
+async def cmd_selection(message: types.Message, command: CommandObject):
+    """Режим выбора прокси для файла: /selection <файл> <режим> (только для администратора)"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    args = (command.args or "").split()
+    if len(args) != 2:
+        modes = "\n".join(f"• <code>{mode}</code> - {title}" for mode, title in SELECTION_MODES.items())
+        files = "\n".join(
+            f"• {name}: <code>{file['mode']}</code>" for name, file in catalog.files.items()
+        )
+        return await message.answer(
+            "ℹ️ Использование: /selection &lt;файл&gt; &lt;режим&gt;\n\n"
+            f"<b>Режимы:</b>\n{modes}\n\n<b>Файлы:</b>\n{files}"
+        )
+
+    file_name, mode = args
+    if mode not in SELECTION_MODES:
+        return await message.answer(f"❌ Неизвестный режим: {mode}")
+
+    try:
+        if not await set_selection_mode(file_name, mode):
+            return await message.answer(f"❌ Файл не найден: {file_name}")
+        await catalog.reload()
+        await message.answer(f"✅ Режим выбора для '{file_name}': {SELECTION_MODES[mode]}")
+    except Exception as e:
+        logging.error(f"Ошибка при смене режима выбора: {e}")
+        await message.answer("❌ Не удалось сменить режим выбора")
+
 @router.message(F.text == "⚙️ Настройки")
 async def settings_handler(message: types.Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await get_user_settings(message.from_user.id)
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -442,34 +420,36 @@ async def support_handler(message: types.Message, state: FSMContext):
     )
     await state.set_state(SupportStates.WAITING_MESSAGE)
 
-@router.message(SupportStates.WAITING_MESSAGE, F.text == "✉️ Мои обращения")
-async def my_tickets_handler(message: types.Message, state: FSMContext):
-    tickets = get_user_tickets(message.from_user.id)
-    
-    if not tickets:
-        await message.answer("📭 У вас еще нет обращений в поддержку", reply_markup=get_support_menu())
-        return
-    
+def _render_my_tickets(page):
     tickets_text = "📬 <b>Ваши обращения в поддержку:</b>\n\n"
-    for ticket in tickets:
-        status = "🟢 Открыт" if ticket[8] == 'open' else "🔴 Закрыт"
-        date_str = format_date(ticket[9])
+    for ticket in page.items:
+        status = "🟢 Открыт" if ticket['status'] == 'open' else "🔴 Закрыт"
+        date_str = format_date(ticket['created_at'])
         
         # Добавляем информацию о медиа
         media_info = ""
-        if ticket[6]:  # media_type
-            media_icon = "🖼️" if ticket[6] == "photo" else "🎥" if ticket[6] == "video" else "📄"
+        if ticket['media_type']:
+            media_icon = "🖼️" if ticket['media_type'] == "photo" else "🎥" if ticket['media_type'] == "video" else "📄"
             media_info = f"\n{media_icon} Прикреплен файл"
         
         # Добавляем информацию о медиа в ответе
         reply_media_info = ""
-        if len(ticket) > 13 and ticket[13]:  # reply_media_type
-            reply_media_icon = "🖼️" if ticket[13] == "photo" else "🎥" if ticket[13] == "video" else "📄"
+        if ticket['reply_media_type']:
+            reply_media_icon = "🖼️" if ticket['reply_media_type'] == "photo" else "🎥" if ticket['reply_media_type'] == "video" else "📄"
             reply_media_info = f"\n{reply_media_icon} В ответе прикреплен файл"
         
-        tickets_text += f"<b>#{ticket[0]}</b> - {status}{media_info}{reply_media_info}\nДата: {date_str}\n\n"
+        tickets_text += f"<b>#{ticket['id']}</b> - {status}{media_info}{reply_media_info}\nДата: {date_str}\n\n"
+    return tickets_text
+
+@router.message(SupportStates.WAITING_MESSAGE, F.text == "✉️ Мои обращения")
+async def my_tickets_handler(message: types.Message, state: FSMContext):
+    page = await get_user_tickets(message.from_user.id)
+    
+    if not page.items:
+        await message.answer("📭 У вас еще нет обращений в поддержку", reply_markup=get_support_menu())
+        return
     
-    await message.answer(tickets_text, reply_markup=get_support_menu())
+    await _send_page(message, _render_my_tickets(page), get_page_keyboard("mytickets", page))
 
 @router.message(SupportStates.WAITING_MESSAGE, F.text == "❌ Отмена")
 async def cancel_support_handler(message: types.Message, state: FSMContext):
@@ -489,6 +469,7 @@ async def process_support_message(message: types.Message, state: FSMContext):
         ticket_text = message.caption
     
     # Обработка медиафайлов
+    media_name = None
     if message.photo:
         media = message.photo[-1]  # Берем фото с самым высоким разрешением
         media_type, media_path = await save_media(media, message.from_user.id, message.bot)
@@ -496,6 +477,7 @@ async def process_support_message(message: types.Message, state: FSMContext):
         media_type, media_path = await save_media(message.video, message.from_user.id, message.bot)
     elif message.document:
         media_type, media_path = await save_media(message.document, message.from_user.id, message.bot)
+        media_name = message.document.file_name
     
     # Обработка слишком больших файлов
     if media_type == "too_big":
@@ -508,14 +490,15 @@ async def process_support_message(message: types.Message, state: FSMContext):
         return
     
     # Создаем тикет
-    ticket_id = create_support_ticket(
+    ticket_id = await create_support_ticket(
         user.id,
         user.username,
         user.first_name,
         user.last_name,
         ticket_text,
         media_type,
-        media_path
+        media_path,
+        media_name
     )
     
     if not ticket_id:
@@ -560,63 +543,55 @@ async def process_support_message(message: types.Message, state: FSMContext):
             # Проверяем существование файла перед отправкой
             if not os.path.exists(media_path):
                 logging.error(f"Файл не найден: {media_path}")
-                await message.bot.send_message(
+                await outbound.send(
+                    message.bot.send_message,
                     ADMIN_CHAT_ID,
                     f"⚠️ <b>Ошибка: Файл не найден</b>\n\n{caption}",
                     reply_markup=admin_kb,
-                    parse_mode='HTML'
+                    parse_mode='HTML',
+                    priority=PRIORITY_ADMIN
                 )
                 return
 
             try:
-                # Отправляем медиафайл используя FSInputFile с абсолютным путем
-                file = FSInputFile(media_path)
-                if media_type == "photo":
-                    await message.bot.send_photo(
-                        ADMIN_CHAT_ID,
-                        file,
-                        caption=caption,
-                        reply_markup=admin_kb,
-                        parse_mode='HTML'
-                    )
-                elif media_type == "video":
-                    await message.bot.send_video(
-                        ADMIN_CHAT_ID,
-                        file,
-                        caption=caption,
-                        reply_markup=admin_kb,
-                        parse_mode='HTML'
-                    )
-                else:  # document
-                    await message.bot.send_document(
-                        ADMIN_CHAT_ID,
-                        file,
-                        caption=caption,
-                        reply_markup=admin_kb,
-                        parse_mode='HTML'
-                    )
+                # Отправляем медиафайл; уже загруженный файл уходит по file_id
+                await file_id_cache.send(
+                    message.bot,
+                    ADMIN_CHAT_ID,
+                    media_type if media_type in SEND_METHODS else "document",
+                    media_path,
+                    caption=caption,
+                    reply_markup=admin_kb,
+                    parse_mode='HTML',
+                    priority=PRIORITY_ADMIN
+                )
             except Exception as e:
                 logging.error(f"Ошибка при отправке медиафайла: {e}")
-                await message.bot.send_message(
+                await outbound.send(
+                    message.bot.send_message,
                     ADMIN_CHAT_ID,
                     f"⚠️ <b>Ошибка при отправке файла</b>\n\n{caption}",
                     reply_markup=admin_kb,
-                    parse_mode='HTML'
+                    parse_mode='HTML',
+                    priority=PRIORITY_ADMIN
                 )
         else:
             # Отправляем текстовое сообщение
-            await message.bot.send_message(
+            await outbound.send(
+                message.bot.send_message,
                 ADMIN_CHAT_ID,
                 f"🆘 <b>Новое обращение в поддержку!</b>\n\n"
                 f"🔢 ID: <code>#{ticket_id}</code>\n"
                 f"👤 Пользователь: {user.mention_html()}\n"
                 f"🆔 ID: <code>{user.id}</code>\n\n"
                 f"📝 Сообщение:\n<code>{ticket_text}</code>",
-                reply_markup=admin_kb
+                reply_markup=admin_kb,
+                priority=PRIORITY_ADMIN
             )
     except Exception as e:
         logging.error(f"Ошибка при отправке уведомления администратору: {e}")
-        await message.bot.send_message(
+        await outbound.send(
+            message.bot.send_message,
             ADMIN_CHAT_ID,
             f"🆘 <b>Новое обращение в поддержку!</b>\n\n"
             f"🔢 ID: <code>#{ticket_id}</code>\n"
@@ -624,7 +599,8 @@ async def process_support_message(message: types.Message, state: FSMContext):
             f"🆔 ID: <code>{user.id}</code>\n\n"
             f"⚠️ <b>Ошибка при загрузке медиафайла!</b>\n"
             f"📝 Сообщение:\n<code>{ticket_text}</code>",
-            reply_markup=admin_kb
+            reply_markup=admin_kb,
+            priority=PRIORITY_ADMIN
         )
     
     # Ответ пользователю
@@ -644,7 +620,7 @@ async def process_support_message(message: types.Message, state: FSMContext):
 @router.callback_query(F.data.startswith("reply_ticket_"))
 async def reply_ticket_callback(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
     ticket_id = callback.data.split("_")[2]
-    ticket = get_ticket_info(ticket_id)
+    ticket = await get_ticket_info(ticket_id)
     
     if not ticket:
         await callback.answer("❌ Тикет не найден!", show_alert=True)
@@ -705,7 +681,7 @@ async def reply_ticket_callback(callback: types.CallbackQuery, state: FSMContext
 async def download_media_callback(callback: types.CallbackQuery):
     try:
         ticket_id = callback.data.split("_")[2]
-        ticket = get_ticket_info(ticket_id)
+        ticket = await get_ticket_info(ticket_id)
         
         if not ticket or not ticket[7]:  # media_path
             await callback.answer("❌ Файл не найден в базе данных!", show_alert=True)
@@ -721,31 +697,16 @@ async def download_media_callback(callback: types.CallbackQuery):
             return
             
         try:
-            # Отправляем файл администратору используя FSInputFile
-            file = FSInputFile(media_path)
+            # Отправляем файл администратору; уже загруженный файл уходит по file_id
             caption = f"📎 Файл из тикета #{ticket_id}"
-            
-            if media_type == "photo":
-                await callback.bot.send_photo(
-                    chat_id=callback.from_user.id,
-                    photo=file,
-                    caption=caption,
-                    parse_mode='HTML'
-                )
-            elif media_type == "video":
-                await callback.bot.send_video(
-                    chat_id=callback.from_user.id,
-                    video=file,
-                    caption=caption,
-                    parse_mode='HTML'
-                )
-            else:  # document
-                await callback.bot.send_document(
-                    chat_id=callback.from_user.id,
-                    document=file,
-                    caption=caption,
-                    parse_mode='HTML'
-                )
+            await file_id_cache.send(
+                callback.bot,
+                callback.from_user.id,
+                media_type if media_type in SEND_METHODS else "document",
+                media_path,
+                caption=caption,
+                parse_mode='HTML'
+            )
             
             await callback.answer("✅ Файл отправлен в ваш чат!")
             
@@ -760,7 +721,7 @@ async def download_media_callback(callback: types.CallbackQuery):
 async def send_final_reply(message: types.Message, state: FSMContext, bot: Bot):
     data = await state.get_data()
     ticket_id = data.get('ticket_id')
-    ticket = get_ticket_info(ticket_id)
+    ticket = await get_ticket_info(ticket_id)
     
     if not ticket:
         await message.answer("❌ Ошибка: тикет не найден", reply_markup=ReplyKeyboardRemove())
@@ -782,47 +743,37 @@ async def send_final_reply(message: types.Message, state: FSMContext, bot: Bot):
         
         try:
             if media_path and os.path.exists(media_path):
-                # Use FSInputFile which handles file operations internally
+                # Уже загруженный файл уходит по file_id, новый загружается
                 try:
-                    if media_type == 'photo':
-                        await bot.send_photo(
-                            chat_id=user_id,
-                            photo=FSInputFile(media_path),
-                            caption=response,
-                            parse_mode='HTML'
-                        )
-                    elif media_type == 'video':
-                        await bot.send_video(
-                            chat_id=user_id,
-                            video=FSInputFile(media_path),
-                            caption=response,
-                            parse_mode='HTML'
-                        )
-                    elif media_type == 'document':
-                        await bot.send_document(
-                            chat_id=user_id,
-                            document=FSInputFile(media_path),
+                    if media_type in SEND_METHODS:
+                        await file_id_cache.send(
+                            bot,
+                            user_id,
+                            media_type,
+                            media_path,
                             caption=response,
                             parse_mode='HTML'
                         )
                 except Exception as file_error:
                     logging.error(f"Ошибка при отправке файла {media_path}: {file_error}", exc_info=True)
                     # Fallback to text message if file sending fails
-                    await bot.send_message(
-                        chat_id=user_id,
+                    await outbound.send(
+                        bot.send_message,
+                        user_id,
                         text=f"{response}\n\n⚠️ Не удалось отправить вложение. Обратитесь в поддержку.",
                         parse_mode='HTML'
                     )
                     raise  # Re-raise to trigger the outer exception handler
             else:
-                await bot.send_message(
-                    chat_id=user_id,
+                await outbound.send(
+                    bot.send_message,
+                    user_id,
                     text=response,
                     parse_mode='HTML'
                 )
             
             # Обновляем статус тикета
-            update_ticket_status(ticket_id, 'closed')
+            await update_ticket_status(ticket_id, 'closed')
             
             # Отправляем подтверждение администратору
             await message.answer(
@@ -830,12 +781,15 @@ async def send_final_reply(message: types.Message, state: FSMContext, bot: Bot):
                 reply_markup=ReplyKeyboardRemove()
             )
             
-            # Удаляем временный файл, если он существует
-            if media_path and os.path.exists(media_path):
+            # Снимаем ссылку ответа на вложение; файл удаляется, если он больше нигде не нужен
+            reply_media_ref = data.get('reply_media_ref')
+            if reply_media_ref:
                 try:
-                    os.remove(media_path)
+                    removed_path = await release_media(reply_media_ref)
+                    if removed_path:
+                        file_id_cache.forget(removed_path)
                 except Exception as e:
-                    logging.error(f"Ошибка при удалении временного файла: {e}")
+                    logging.error(f"Ошибка при освобождении вложения ответа: {e}")
                     
         except Exception as e:
             logging.error(f"Ошибка при отправке ответа: {e}")
@@ -868,6 +822,8 @@ async def process_admin_reply(message: types.Message, state: FSMContext, bot: Bo
             return
     
     if message.text == "❌ Отменить ответ":
+        if data.get('reply_media_ref'):
+            await release_media(data['reply_media_ref'])
         await message.answer("❌ Ответ отменен", reply_markup=ReplyKeyboardRemove())
         await state.clear()
         return
@@ -918,6 +874,7 @@ async def process_admin_media(message: types.Message, state: FSMContext, bot: Bo
             
     reply_media_type = None
     reply_media_path = None
+    reply_media_name = None
     
     # Обработка медиафайлов
     if message.photo:
@@ -927,6 +884,7 @@ async def process_admin_media(message: types.Message, state: FSMContext, bot: Bo
         reply_media_type, reply_media_path = await save_media(message.video, message.from_user.id, bot)
     elif message.document:
         reply_media_type, reply_media_path = await save_media(message.document, message.from_user.id, bot)
+        reply_media_name = message.document.file_name
     else:
         await message.answer("❌ Пожалуйста, прикрепите фото, видео или документ.")
         return
@@ -938,10 +896,20 @@ async def process_admin_media(message: types.Message, state: FSMContext, bot: Bo
     
     media_icon = "🖼️" if reply_media_type == "photo" else "🎥" if reply_media_type == "video" else "📄"
     
+    # Вложение ответа удерживается ссылкой, пока ответ не отправлен или не отменён
+    reply_media_ref = None
+    if reply_media_path:
+        if data.get('reply_media_ref'):
+            await release_media(data['reply_media_ref'])
+        reply_media_ref = await add_media_ref(
+            reply_media_path, message.from_user.id, data.get('ticket_id'), "reply", reply_media_name
+        )
+    
     # Сохраняем информацию о медиа
     await state.update_data(
         reply_media_type=reply_media_type,
-        reply_media_path=reply_media_path
+        reply_media_path=reply_media_path,
+        reply_media_ref=reply_media_ref
     )
     
     # Создаем клавиатуру для отправки ответа
@@ -972,60 +940,133 @@ async def cmd_addproxies(message: types.Message):
     
     try:
         if not message.reply_to_message or not message.reply_to_message.document:
-            return await message.answer("ℹ️ Ответьте этой командой на файл с прокси (txt)")
+            return await message.answer("ℹ️ Ответьте этой командой на файл с прокси (txt, gz или zip)")
         
         file = await message.bot.get_file(message.reply_to_message.document.file_id)
-        file_name = message.reply_to_message.document.file_name
+        upload_name = message.reply_to_message.document.file_name
         
-        # Проверяем расширение файла
-        if not file_name.endswith('.txt'):
-            return await message.answer("❌ Неподдерживаемый формат файла. Используйте .txt", reply_markup=get_main_menu())
+        # Проверяем расширение файла: архивы распаковываются в файл <имя>.txt
+        file_name = pool_file_name(upload_name)
+        if file_name is None:
+            return await message.answer("❌ Неподдерживаемый формат файла. Используйте .txt, .gz или .zip", reply_markup=get_main_menu())
         
-        file_path = os.path.join(PROXY_FOLDER, file_name)
-        await message.bot.download_file(file.file_path, file_path)
+        status = await message.answer(f"⏳ Загрузка файла '{upload_name}'...")
+        
+        # Загружаем во временный файл рядом с пулом: текущий файл заменяется
+        # только после сравнения с ним
+        upload_path = os.path.join(PROXY_FOLDER, f".{file_name}.upload")
+        try:
+            await message.bot.download_file(file.file_path, upload_path)
+        except Exception:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            raise
+        
+        async def show_progress(progress):
+            if progress.stage == "parse":
+                text = f"⏳ Обработка '{upload_name}': {progress.percent}%, строк: {progress.lines}"
+            else:
+                text = f"⏳ Обработка '{upload_name}': сравнение с текущим пулом..."
+            await status.edit_text(text)
         
         # Добавляем в базу, если это новый файл
         display_name = os.path.splitext(file_name)[0].capitalize()
-        add_proxy_file(file_name, display_name)
+        await add_proxy_file(file_name, display_name)
+        report = await ingest_proxy_file(file_name, upload_path, catalog.files,
+                                         upload_name=upload_name, on_progress=show_progress)
+        # Файл мог появиться на диске впервые - пересобираем меню каталога
+        await catalog.reload()
         
-        proxies = load_proxies(file_name)
-        await message.answer(
+        await status.edit_text(
             f"✅ Файл '{file_name}' обновлён!\n"
-            f"Загружено {len(proxies)} прокси\n"
-            f"Тип: {display_name}",
-            reply_markup=get_main_menu()
+            f"Загружено {report.total} проверенных прокси\n"
+            f"➕ Новых: {report.added}\n"
+            f"➖ Удалено: {report.removed}\n"
+            f"🔁 Без изменений: {report.unchanged}\n"
+            f"⚠️ Некорректных строк: {report.invalid}\n"
+            f"♻️ Дубликатов в файле: {report.duplicates}\n"
+            f"📂 Уже есть в других файлах: {report.cross_duplicates}\n"
+            f"Тип: {display_name}"
         )
     except Exception as e:
         await message.answer(f"❌ Ошибка: {str(e)}", reply_markup=get_main_menu())
 
-@router.message(Command("tickets"))
-async def list_tickets_handler(message: types.Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
-        return await message.answer("⛔ Доступ запрещён!", reply_markup=get_main_menu())
-    
-    tickets = get_open_tickets()
-    
-    if not tickets:
-        return await message.answer("ℹ️ Нет открытых обращений")
-    
+def _render_open_tickets(page):
     tickets_text = "📬 <b>Открытые обращения:</b>\n\n"
-    for ticket in tickets:
-        date_str = format_date(ticket[9])
+    for ticket in page.items:
+        date_str = format_date(ticket['created_at'])
         
         # Информация о медиа
         media_info = ""
-        if ticket[6] and ticket[6] != "too_big":  # media_type
-            media_icon = "🖼️" if ticket[6] == "photo" else "🎥" if ticket[6] == "video" else "📄"
+        if ticket['media_type'] and ticket['media_type'] != "too_big":
+            media_icon = "🖼️" if ticket['media_type'] == "photo" else "🎥" if ticket['media_type'] == "video" else "📄"
             media_info = f"\n{media_icon} Прикреплен файл"
         
         tickets_text += (
-            f"<b>#{ticket[0]}</b>{media_info}\n"
-            f"👤 {ticket[3]} (@{ticket[2]})\n"
-            f"🆔 <code>{ticket[1]}</code>\n"
+            f"<b>#{ticket['id']}</b>{media_info}\n"
+            f"👤 {html.escape(ticket['first_name'] or '')} (@{html.escape(ticket['username'] or '')})\n"
+            f"🆔 <code>{ticket['user_id']}</code>\n"
             f"📅 {date_str}\n\n"
         )
+    return tickets_text
+
+@router.message(Command("tickets"))
+async def list_tickets_handler(message: types.Message):
+    if message.from_user.id != ADMIN_CHAT_ID:
+        return await message.answer("⛔ Доступ запрещён!", reply_markup=get_main_menu())
+    
+    page = await get_open_tickets()
+    
+    if not page.items:
+        return await message.answer("ℹ️ Нет открытых обращений")
+    
+    await _send_page(message, _render_open_tickets(page), get_page_keyboard("tickets", page))
+
+# ========== ПОСТРАНИЧНЫЕ СПИСКИ ========== #
+async def _send_page(message: types.Message, text: str, reply_markup, edit: bool = False):
+    """Отправляет страницу списка частями не длиннее лимита Telegram; кнопки - под последней"""
+    parts = split_html(text)
+    if edit and len(parts) == 1:
+        try:
+            await message.edit_text(parts[0], reply_markup=reply_markup, parse_mode='HTML')
+        except TelegramBadRequest as e:
+            # Повторное нажатие той же кнопки: текст страницы не изменился
+            if "message is not modified" not in str(e):
+                raise
+        return
+    for i, part in enumerate(parts):
+        await message.answer(part, reply_markup=reply_markup if i == len(parts) - 1 else None, parse_mode='HTML')
+
+# Имя списка в callback_data -> загрузка страницы, отрисовка, только для администратора
+PAGED_LISTS = {
+    "tickets": (lambda user_id, cursor, newer: get_open_tickets(cursor, newer), _render_open_tickets, True),
+    "downloads": (lambda user_id, cursor, newer: get_proxy_downloads(cursor, newer), _render_downloads, True),
+    "mytickets": (get_user_tickets, _render_my_tickets, False),
+    "mydownloads": (get_user_proxy_downloads, _render_my_downloads, False),
+    "history": (get_proxy_history, _render_history, False),
+}
+
+async def page_callback(callback: types.CallbackQuery):
+    # page_{список}_{newer|older}_{id крайней записи}
+    try:
+        _, list_name, direction, cursor = callback.data.split("_", 3)
+        load, render, admin_only = PAGED_LISTS[list_name]
+        cursor = int(cursor)
+    except (ValueError, KeyError):
+        await callback.answer("❌ Неизвестная страница", show_alert=True)
+        return
+    if admin_only and callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔ Доступ запрещён!", show_alert=True)
+        return
+    
+    # Пользовательские списки всегда строятся по нажавшему кнопку
+    page = await load(callback.from_user.id, cursor, direction == "newer")
+    if not page.items:
+        await callback.answer("📭 Больше записей нет")
+        return
     
-    await message.answer(tickets_text)
+    await _send_page(callback.message, render(page), get_page_keyboard(list_name, page), edit=True)
+    await callback.answer()
 
 # ========== ОБРАБОТЧИКИ ИНЛАЙН-КНОПОК ========== #
 @router.callback_query(F.data == "change_lang")
@@ -1119,6 +1160,8 @@ def setup_handlers(dp: Dispatcher):
     dp.message.register(get_proxy_handler, Command("getproxy"))
     dp.message.register(get_proxy_handler, F.text == "🍔 Получить прокси")
     dp.callback_query.register(get_proxy_callback, F.data.startswith("getproxy_"))
+    dp.callback_query.register(countries_callback, F.data.startswith("countries_"))
+    dp.callback_query.register(get_country_proxy_callback, F.data.startswith("getcountry_"))
     
     # Обработчики для загрузки файлов
     dp.message.register(download_file_handler, Command("download"))
@@ -1127,17 +1170,24 @@ def setup_handlers(dp: Dispatcher):
     
     # Обработчик статистики
     dp.message.register(show_statistics, F.text == "📊 Статистика")
+    dp.message.register(cmd_rebuild_stats, Command("rebuildstats"))
+    
+    # Обновление прокси-файлов администратором
+    dp.message.register(cmd_addproxies, Command("addproxies"))
+    dp.message.register(cmd_selection, Command("selection"))
     
     # Обработчики истории загрузок
     dp.message.register(cmd_downloads, Command("downloads"))
     dp.message.register(cmd_my_downloads, Command("mydownloads"))
     dp.message.register(my_files_handler, F.text == "📎 Мои файлы")
     dp.message.register(history_handler, F.text == "📜 История")
+    dp.callback_query.register(page_callback, F.data.startswith("page_"))
     
     # Обработчики поддержки
     dp.message.register(support_handler, F.text == "🆘 Поддержка")
     dp.message.register(support_handler, Command("support"))
     dp.message.register(my_tickets_handler, Command("mytickets"))
+    dp.message.register(list_tickets_handler, Command("tickets"))
     dp.message.register(cancel_support_handler, Command("cancel"), F.text == "❌ Отмена")
     
     # Обработчики ответов администратора
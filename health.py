@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import re
+import ssl
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from config import HEALTH_CONFIG_FILE, HEALTH_CONCURRENCY, HEALTH_PER_HOST, HEALTH_TIMEOUT
+from pool_index import endpoints
+from proxy_parser import ProxyRecord
+from proxy_pool import proxy_pool
+from selection import selector
+
+# Интервал проверки, если в конфиге xray нет секции observatory
+DEFAULT_INTERVAL = 180.0
+
+# Режимы security, при которых сервер отвечает на TLS-рукопожатие
+TLS_SECURITY = ("tls", "reality", "xtls")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Длительность в формате xray ("3m", "1m30s", "500ms") в секундах"""
+    parts = _DURATION_PART.findall(value.strip())
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def load_observatory(path: str) -> Tuple[float, bool]:
+    """Интервал и параллельность проверок из секции observatory конфига xray"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            observatory = json.load(f).get("observatory") or {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Не удалось прочитать observatory из {path}: {e}")
+        return DEFAULT_INTERVAL, True
+
+    interval = parse_duration(str(observatory.get("probeInterval", ""))) or DEFAULT_INTERVAL
+    return interval, bool(observatory.get("enableConcurrency", True))
+
+
+class _Probe:
+    __slots__ = ("host", "port", "use_tls", "sni")
+
+    def __init__(self, record: ProxyRecord):
+        self.host = record.host
+        self.port = record.port
+        self.use_tls = record.security in TLS_SECURITY
+        self.sni = record.sni or record.host
+
+
+class HealthChecker:
+    """Фоновая проверка доступности адресов пула.
+
+    Раз в interval секунд каждый уникальный адрес (host, port) из всех
+    прокси-файлов проверяется TCP-подключением, а для tls/reality - ещё и
+    TLS-рукопожатием с SNI записи. Одновременно выполняется не больше
+    concurrency проверок и не больше per_host на один хост. Недоступные
+    адреса передаются в пул, и get_next_proxy пропускает такие записи, а
+    измеренные задержки - в selector для взвешенных режимов выдачи.
+    """
+
+    def __init__(self, interval: float, concurrency: int, per_host: int, timeout: float):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+        # Проверка только факта рукопожатия: сертификаты reality и
+        # самоподписанные сертификаты прокси не проходят валидацию
+        self._ssl = ssl.create_default_context()
+        self._ssl.check_hostname = False
+        self._ssl.verify_mode = ssl.CERT_NONE
+
+    async def _probe(self, probe: _Probe) -> Optional[float]:
+        """Время подключения (и рукопожатия) в секундах или None, если адрес недоступен"""
+        writer = None
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    probe.host, probe.port,
+                    ssl=self._ssl if probe.use_tls else None,
+                    server_hostname=probe.sni if probe.use_tls else None
+                ),
+                timeout=self.timeout
+            )
+            return time.perf_counter() - started
+        except (OSError, ValueError, asyncio.TimeoutError, ssl.SSLError):
+            # ValueError - в том числе некорректное для IDNA имя хоста
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+
+    @staticmethod
+    def _collect(records: Iterable[ProxyRecord]) -> Dict[Tuple[str, int], _Probe]:
+        """Уникальные адреса записей; records перебираются один раз и не сохраняются"""
+        probes: Dict[Tuple[str, int], _Probe] = {}
+        for record in records:
+            endpoint = (record.host, record.port)
+            if endpoint not in probes:
+                probes[endpoint] = _Probe(record)
+        return probes
+
+    @staticmethod
+    def _collect_pools(file_names: Iterable[str]) -> Dict[Tuple[str, int], _Probe]:
+        # Из индекса пула читаются только адреса; запись целиком декодируется
+        # один раз на новый адрес
+        probes: Dict[Tuple[str, int], _Probe] = {}
+        for name in file_names:
+            records = proxy_pool.get(name)
+            for index, endpoint in enumerate(endpoints(records)):
+                if endpoint not in probes:
+                    probes[endpoint] = _Probe(records[index])
+        return probes
+
+    async def _run_probes(self, probes: Dict[Tuple[str, int], _Probe]) -> Dict[Tuple[str, int], Optional[float]]:
+        # Не задача на каждый адрес, а concurrency обработчиков, которые
+        # по очереди забирают адреса из общего итератора
+        pending = iter(probes.items())
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+        status: Dict[Tuple[str, int], Optional[float]] = {}
+
+        async def worker():
+            for endpoint, probe in pending:
+                host_limit = host_limits.setdefault(probe.host, asyncio.Semaphore(self.per_host))
+                async with host_limit:
+                    status[endpoint] = await self._probe(probe)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(probes)))))
+        return status
+
+    async def check(self, records: Iterable[ProxyRecord]) -> Dict[Tuple[str, int], Optional[float]]:
+        """Проверяет уникальные адреса записей и возвращает их задержку (None - недоступен)"""
+        return await self._run_probes(self._collect(records))
+
+    async def check_pool(self, file_names: Iterable[str]) -> Dict[Tuple[str, int], Optional[float]]:
+        """Проверяет все записи указанных файлов и обновляет статус в пуле"""
+        file_names = list(file_names)
+        # Файлы перебираются лениво в отдельном потоке: в памяти остаются
+        # только уникальные адреса, а не список всех записей пула
+        probes = await asyncio.to_thread(self._collect_pools, file_names)
+        started = time.perf_counter()
+        status = await self._run_probes(probes)
+        proxy_pool.set_unhealthy(frozenset(endpoint for endpoint, rtt in status.items() if rtt is None))
+        selector.observe(status)
+
+        alive = sum(1 for rtt in status.values() if rtt is not None)
+        logging.info(
+            f"Проверка прокси: доступно {alive} из {len(status)} адресов "
+            f"за {time.perf_counter() - started:.1f} с"
+        )
+        return status
+
+    async def _run(self, file_names: Callable[[], Iterable[str]]):
+        while True:
+            try:
+                await self.check_pool(file_names())
+            except Exception as e:
+                logging.error(f"Ошибка при проверке прокси: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, file_names: Callable[[], Iterable[str]]):
+        """Запускает периодическую проверку; file_names() возвращает текущий список файлов"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(file_names))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _create_checker() -> HealthChecker:
+    interval, concurrent = load_observatory(HEALTH_CONFIG_FILE)
+    return HealthChecker(
+        interval=interval,
+        concurrency=HEALTH_CONCURRENCY if concurrent else 1,
+        per_host=HEALTH_PER_HOST,
+        timeout=HEALTH_TIMEOUT
+    )
+
+
+health_checker = _create_checker()
@@ -0,0 +1,309 @@
+import asyncio
+import gzip
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import zipfile
+from typing import Awaitable, BinaryIO, Callable, Iterable, Iterator, Optional
+from config import INGEST_MAX_BYTES, INGEST_MAX_LINE, INGEST_PROGRESS_INTERVAL
+from database import db
+from pool_index import column
+from proxy_parser import parse_proxy_uri
+from proxy_pool import proxy_pool
+
+# Форматы загрузки: обычный текст, gzip и zip-архив с .txt внутри
+UPLOAD_FORMATS = (".txt", ".gz", ".zip")
+
+# Как часто (в строках) обновлять счётчики прогресса из потока разбора
+PROGRESS_STEP = 5000
+
+# Рабочая БД загрузки во временном файле: URI загрузки, текущего пула и
+# остальных файлов. Повторы и разница с пулом ищутся по её индексам на диске,
+# а не множествами в памяти, поэтому память не зависит от размера загрузки
+WORK_SCHEMA = '''
+CREATE TABLE uploaded (seq INTEGER PRIMARY KEY, uri TEXT NOT NULL UNIQUE);
+CREATE TABLE other (uri TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE old (pos INTEGER PRIMARY KEY, uri TEXT NOT NULL UNIQUE);
+'''
+# Кэш страниц рабочей БД, КиБ
+WORK_CACHE_KIB = 4096
+
+# Сохранившиеся записи в прежнем порядке, затем новые в порядке загрузки
+_KEPT = "SELECT o.uri FROM old o JOIN uploaded u ON u.uri = o.uri ORDER BY o.pos"
+_ADDED = '''SELECT u.uri FROM uploaded u
+            WHERE NOT EXISTS (SELECT 1 FROM old o WHERE o.uri = u.uri) ORDER BY u.seq'''
+
+
+class IngestReport:
+    """Итог загрузки файла: разница с текущим пулом и отброшенные строки"""
+
+    __slots__ = ("file_name", "total", "added", "removed", "unchanged",
+                 "invalid", "duplicates", "cross_duplicates", "cursor")
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.total = 0
+        self.added = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.invalid = 0
+        # Повторы внутри загруженного файла
+        self.duplicates = 0
+        # Строки, которые уже есть в других прокси-файлах
+        self.cross_duplicates = 0
+        # Новая позиция курсора ротации (None - курсора ещё не было)
+        self.cursor: Optional[int] = None
+
+
+class IngestProgress:
+    """Счётчики прогресса разбора; пишутся из потока, читаются из event loop"""
+
+    __slots__ = ("lines", "bytes_read", "bytes_total", "stage")
+
+    def __init__(self, bytes_total: int):
+        self.lines = 0
+        self.bytes_read = 0
+        self.bytes_total = bytes_total
+        self.stage = "parse"
+
+    @property
+    def percent(self) -> int:
+        if not self.bytes_total:
+            return 0
+        return min(100, self.bytes_read * 100 // self.bytes_total)
+
+
+def pool_file_name(upload_name: str) -> Optional[str]:
+    """Имя прокси-файла для загрузки: vless.txt.gz и vless.zip -> vless.txt"""
+    lower = upload_name.lower()
+    if not lower.endswith(UPLOAD_FORMATS):
+        return None
+    base = upload_name
+    for suffix in (".gz", ".zip"):
+        if lower.endswith(suffix):
+            base = upload_name[:-len(suffix)]
+    if not base.lower().endswith(".txt"):
+        base += ".txt"
+    return os.path.basename(base)
+
+
+def _text_stream(binary: BinaryIO) -> io.TextIOWrapper:
+    return io.TextIOWrapper(binary, encoding='utf-8', errors='replace')
+
+
+def _iter_upload_lines(raw: BinaryIO, upload_name: str, progress: IngestProgress) -> Iterator[Optional[str]]:
+    """Построчно распаковывает загрузку, не держа её целиком в памяти.
+
+    Прогресс считается по позиции в исходном (сжатом) файле, а лимит
+    INGEST_MAX_BYTES - по числу байт распакованного текста в UTF-8. Строка
+    длиннее INGEST_MAX_LINE символов дочитывается порциями и вместо неё
+    возвращается None.
+    """
+    lower = upload_name.lower()
+    if lower.endswith(".zip"):
+        archive = zipfile.ZipFile(raw)
+        streams = (
+            _text_stream(archive.open(info))
+            for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".txt")
+        )
+    elif lower.endswith(".gz"):
+        streams = iter((_text_stream(gzip.GzipFile(fileobj=raw)),))
+    else:
+        streams = iter((_text_stream(raw),))
+
+    unpacked = 0
+    for stream in streams:
+        with stream:
+            skipping = False
+            while True:
+                chunk = stream.readline(INGEST_MAX_LINE)
+                if not chunk:
+                    break
+                unpacked += len(chunk.encode())
+                if unpacked > INGEST_MAX_BYTES:
+                    raise ValueError(f"Распакованный файл больше {INGEST_MAX_BYTES} байт")
+                complete = chunk.endswith("\n")
+                if skipping or (not complete and len(chunk) >= INGEST_MAX_LINE):
+                    skipping = not complete
+                    if skipping:
+                        continue
+                    chunk = None
+                progress.lines += 1
+                if progress.lines % PROGRESS_STEP == 0:
+                    progress.bytes_read = raw.tell()
+                yield chunk
+            if skipping:
+                progress.lines += 1
+                yield None
+    progress.bytes_read = progress.bytes_total
+
+
+def _open_work(path: str) -> sqlite3.Connection:
+    # Рабочая БД временная: журнал и fsync не нужны
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(f"PRAGMA cache_size=-{WORK_CACHE_KIB}")
+    return conn
+
+
+def _parse_upload(file_name: str, upload_path: str, upload_name: str, other_files: Iterable[str],
+                  work_path: str, progress: IngestProgress) -> IngestReport:
+    report = IngestReport(file_name)
+    work = _open_work(work_path)
+    try:
+        with work:
+            work.executescript(WORK_SCHEMA)
+            for other in other_files:
+                if other != file_name:
+                    work.executemany("INSERT OR IGNORE INTO other (uri) VALUES (?)",
+                                     ((uri,) for uri in column(proxy_pool.get(other), "uri")))
+
+            valid = 0
+
+            def valid_uris(lines: Iterable[Optional[str]]) -> Iterator[tuple]:
+                nonlocal valid
+                for line in lines:
+                    if line is None:
+                        report.invalid += 1
+                        continue
+                    uri = line.strip()
+                    if not uri or uri[0] == "#":
+                        continue
+                    if parse_proxy_uri(uri) is None:
+                        report.invalid += 1
+                        continue
+                    valid += 1
+                    yield (uri,)
+
+            # Повтор уже загруженной строки не вставляется (INSERT OR IGNORE)
+            changes = work.total_changes
+            with open(upload_path, 'rb') as raw:
+                work.executemany("INSERT OR IGNORE INTO uploaded (uri) VALUES (?)",
+                                 valid_uris(_iter_upload_lines(raw, upload_name, progress)))
+            report.duplicates = valid - (work.total_changes - changes)
+
+            progress.stage = "diff"
+            report.cross_duplicates = work.execute(
+                "DELETE FROM uploaded WHERE uri IN (SELECT uri FROM other)").rowcount
+            report.total = work.execute("SELECT COUNT(*) FROM uploaded").fetchone()[0]
+    finally:
+        work.close()
+    return report
+
+
+def _remap_cursor(work: sqlite3.Connection, last_index: int, total: int) -> int:
+    """Переносит курсор на последнюю выданную запись, сохранившуюся в файле"""
+    if not total:
+        return 0
+    # Сохранившиеся записи идут в начале нового файла в прежнем порядке,
+    # поэтому позиция = число сохранившихся записей до курсора включительно - 1
+    kept_before = work.execute('''SELECT COUNT(*) FROM old o JOIN uploaded u ON u.uri = o.uri
+                                  WHERE o.pos <= ?''', (last_index,)).fetchone()[0]
+    return (kept_before - 1) % total
+
+
+def _write_merged(work: sqlite3.Connection, path: str):
+    # Новый файл пишется построчно прямо из запросов к рабочей БД
+    with open(path, 'w', encoding='utf-8') as f:
+        for query in (_KEPT, _ADDED):
+            f.writelines(uri + "\n" for (uri,) in work.execute(query))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _apply(conn: sqlite3.Connection, file_name: str, work_path: str, report: IngestReport) -> IngestReport:
+    # Выполняется в потоке записи БД: get_next_proxy не может выдать запись
+    # между заменой файла и переносом курсора
+    work = _open_work(work_path)
+    try:
+        with work:
+            old = proxy_pool.get(file_name)
+            work.executemany("INSERT OR IGNORE INTO old (pos, uri) VALUES (?, ?)",
+                             enumerate(column(old, "uri")))
+            report.unchanged = work.execute(
+                "SELECT COUNT(*) FROM old o JOIN uploaded u ON u.uri = o.uri").fetchone()[0]
+            report.removed = len(old) - report.unchanged
+            report.added = report.total - report.unchanged
+
+            file_path = os.path.join(proxy_pool.folder, file_name)
+            tmp_path = os.path.join(proxy_pool.folder, f".{file_name}.tmp")
+            try:
+                _write_merged(work, tmp_path)
+                os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            proxy_pool.install(file_name, report.total)
+
+            row = conn.execute("SELECT last_index FROM proxy_index WHERE file_name = ?", (file_name,)).fetchone()
+            if row is not None:
+                report.cursor = _remap_cursor(work, row[0], report.total)
+                conn.execute("UPDATE proxy_index SET last_index = ? WHERE file_name = ?",
+                             (report.cursor, file_name))
+    finally:
+        work.close()
+    return report
+
+
+async def _report_progress(progress: IngestProgress,
+                           on_progress: Callable[[IngestProgress], Awaitable[None]]):
+    last = None
+    while True:
+        await asyncio.sleep(INGEST_PROGRESS_INTERVAL)
+        state = (progress.stage, progress.lines, progress.bytes_read)
+        if state == last:
+            continue
+        last = state
+        try:
+            await on_progress(progress)
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс загрузки: {e}")
+
+
+async def ingest_proxy_file(file_name: str, upload_path: str, other_files: Iterable[str],
+                            upload_name: Optional[str] = None,
+                            on_progress: Optional[Callable[[IngestProgress], Awaitable[None]]] = None
+                            ) -> IngestReport:
+    """Применяет загруженный файл к пулу как разницу с текущим содержимым.
+
+    Загрузка (.txt, .gz или .zip) распаковывается и разбирается потоково,
+    повторы и разница с пулом считаются во временной SQLite-базе на диске, а
+    новый файл и его индекс пишутся построчно, поэтому память процесса не
+    растёт с размером загрузки.
+
+    Args:
+        file_name: имя прокси-файла в PROXY_FOLDER
+        upload_path: временный файл с загрузкой; после вызова он удаляется
+        other_files: остальные файлы пула для поиска пересечений
+        upload_name: исходное имя загрузки, по расширению выбирается распаковка
+        on_progress: корутина, которая раз в INGEST_PROGRESS_INTERVAL секунд
+            получает текущий прогресс
+    """
+    progress = IngestProgress(os.path.getsize(upload_path))
+    reporter = asyncio.create_task(_report_progress(progress, on_progress)) if on_progress else None
+    fd, work_path = tempfile.mkstemp(prefix=f".{file_name}.", suffix=".ingest", dir=proxy_pool.folder)
+    os.close(fd)
+    try:
+        report = await asyncio.to_thread(
+            _parse_upload, file_name, upload_path, upload_name or file_name, list(other_files),
+            work_path, progress
+        )
+        progress.stage = "apply"
+        report = await db.write(_apply, file_name, work_path, report)
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        for path in (upload_path, work_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    logging.info(
+        f"Файл {file_name} обновлён: +{report.added} -{report.removed} ={report.unchanged}, "
+        f"некорректных {report.invalid}, дубликатов {report.duplicates}, "
+        f"в других файлах {report.cross_duplicates}, курсор {report.cursor}"
+    )
+    return report
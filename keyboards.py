@@ -6,6 +6,7 @@ from aiogram.types import (
     ReplyKeyboardRemove
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from geo import country_flag
 
 def get_main_menu():
     builder = ReplyKeyboardBuilder()
@@ -39,4 +40,49 @@ def get_admin_reply_menu():
     builder.row(KeyboardButton(text="📎 Прикрепить файл"))
     builder.row(KeyboardButton(text="📤 Отправить ответ"))
     builder.row(KeyboardButton(text="❌ Отменить ответ"))
-    return builder.as_markup(resize_keyboard=True)
\ No newline at end of file
+    return builder.as_markup(resize_keyboard=True)
+
+def get_proxy_files_menu(proxy_files):
+    # Кнопки выбора прокси-файла, по 2 в ряд
+    buttons = [
+        InlineKeyboardButton(text=file['display'], callback_data=f"getproxy_{file['name']}")
+        for file in proxy_files
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        buttons[i:i+2] for i in range(0, len(buttons), 2)
+    ])
+
+def get_country_menu(file_name, countries):
+    # Кнопки стран файла (флаг и число прокси), по 3 в ряд
+    buttons = [
+        InlineKeyboardButton(text=f"{country_flag(country)} {count}", callback_data=f"getcountry_{country}_{file_name}")
+        for country, count in countries
+    ]
+    rows = [buttons[i:i+3] for i in range(0, len(buttons), 3)]
+    rows.append([InlineKeyboardButton(text="🎲 Любая страна", callback_data=f"getproxy_{file_name}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_country_button(file_name):
+    # Кнопка под выданным прокси: перейти к выбору страны
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🌍 Выбрать страну", callback_data=f"countries_{file_name}")]
+    ])
+
+def get_download_menu(proxy_files):
+    # Для каждого файла две кнопки: скачать файл и получить его имя
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f"📄 {file['display']}", callback_data=f"download_{file['name']}"),
+            InlineKeyboardButton(text="🔗 Ссылка", callback_data=f"link_{file['name']}")
+        ]
+        for file in proxy_files
+    ])
+
+def get_page_keyboard(list_name, page):
+    # Навигация по страницам списка: id крайней записи в callback_data
+    buttons = []
+    if page.has_newer:
+        buttons.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"page_{list_name}_newer_{page.first_id}"))
+    if page.has_older:
+        buttons.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"page_{list_name}_older_{page.last_id}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import PROXY_LEASE_TTL
+
+# Аренда прокси: запись закрепляется за одним пользователем на ttl секунд.
+# Источник истины - таблица proxy_leases: эксклюзивность обеспечивает её
+# первичный ключ, поэтому одну запись не арендуют и два процесса с общей БД.
+# Словари и куча сроков в памяти - кэш таблицы для быстрых проверок.
+
+LeaseKey = Tuple[str, str]  # (файл, URI прокси)
+
+_SELECT_LEASES = "SELECT file_name, proxy, user_id, expires_at FROM proxy_leases"
+
+
+class Lease:
+    __slots__ = ("user_id", "expires_at")
+
+    def __init__(self, user_id: int, expires_at: float):
+        self.user_id = user_id
+        self.expires_at = expires_at
+
+
+class LeaseManager:
+    """Эксклюзивная аренда прокси с истечением по TTL.
+
+    - _leases: (файл, прокси) -> аренда, проверка занятости за O(1)
+    - _by_user: (пользователь, файл) -> прокси, одна аренда на файл
+    - _expiry: куча (срок, файл, прокси) для снятия истёкших за O(log n)
+    - _files: арендованные прокси файла, чтобы сразу определить исчерпание пула
+
+    Изменяющие методы принимают соединение и вызываются в потоке записи БД:
+    сначала выполняется SQL, и только после его успеха меняется память. Если
+    транзакция потом откатывается, вызывающий код помечает файл через
+    invalidate(), и его аренды перечитываются из таблицы в следующей
+    транзакции. Аренды других процессов попадают в память, когда acquire()
+    натыкается на занятую запись, при sync() и при фоновом sweep().
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._leases: Dict[LeaseKey, Lease] = {}
+        self._by_user: Dict[Tuple[int, str], str] = {}
+        self._expiry: List[Tuple[float, str, str]] = []
+        self._files: Dict[str, Set[str]] = {}
+        # Файлы, память которых могла разойтись с таблицей после отката
+        self._stale: Set[str] = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _add(self, file_name: str, proxy: str, user_id: int, expires_at: float):
+        self._remove(file_name, proxy)
+        previous = self._by_user.get((user_id, file_name))
+        if previous is not None:
+            self._remove(file_name, previous)
+        self._leases[(file_name, proxy)] = Lease(user_id, expires_at)
+        self._by_user[(user_id, file_name)] = proxy
+        self._files.setdefault(file_name, set()).add(proxy)
+        heapq.heappush(self._expiry, (expires_at, file_name, proxy))
+
+    def _remove(self, file_name: str, proxy: str) -> Optional[Lease]:
+        lease = self._leases.pop((file_name, proxy), None)
+        if lease is not None:
+            self._by_user.pop((lease.user_id, file_name), None)
+            self._files[file_name].discard(proxy)
+        return lease
+
+    def _reload(self, rows: Iterable[Tuple[str, str, int, float]], file_name: Optional[str] = None):
+        # Память файла (или всех файлов) заменяется строками таблицы;
+        # элементы кучи от прежних аренд отбрасываются при извлечении
+        for name in (list(self._files) if file_name is None else [file_name]):
+            for proxy in list(self._files.get(name, ())):
+                self._remove(name, proxy)
+            self._stale.discard(name)
+        for row in rows:
+            self._add(*row)
+
+    def load(self, conn: sqlite3.Connection) -> int:
+        """Загружает действующие аренды из БД при старте"""
+        rows = conn.execute(f"{_SELECT_LEASES} WHERE expires_at > ?", (time.time(),)).fetchall()
+        with self._lock:
+            self._reload(rows)
+        return len(rows)
+
+    def sync(self, conn: sqlite3.Connection, file_name: str, now: float):
+        """Перечитывает аренды файла из таблицы"""
+        rows = conn.execute(f"{_SELECT_LEASES} WHERE file_name = ? AND expires_at > ?",
+                            (file_name, now)).fetchall()
+        with self._lock:
+            self._reload(rows, file_name)
+
+    def refresh(self, conn: sqlite3.Connection, file_name: str, now: float):
+        """Перечитывает аренды файла, если он помечен invalidate()"""
+        if file_name in self._stale:
+            self.sync(conn, file_name, now)
+
+    def invalidate(self, file_name: str):
+        """Помечает память файла устаревшей после отката транзакции"""
+        with self._lock:
+            self._stale.add(file_name)
+
+    def is_leased(self, file_name: str, proxy: str, now: float) -> bool:
+        lease = self._leases.get((file_name, proxy))
+        return lease is not None and lease.expires_at > now
+
+    def leased_count(self, file_name: str) -> int:
+        return len(self._files.get(file_name, ()))
+
+    def expire(self, conn: sqlite3.Connection, now: float) -> int:
+        """Снимает истёкшие аренды, в том числе выданные другими процессами.
+
+        В куче могут быть устаревшие элементы от продлений и перечитываний.
+        """
+        conn.execute("DELETE FROM proxy_leases WHERE expires_at <= ?", (now,))
+        expired = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, file_name, proxy = heapq.heappop(self._expiry)
+                lease = self._leases.get((file_name, proxy))
+                if lease is not None and lease.expires_at == expires_at:
+                    self._remove(file_name, proxy)
+                    expired += 1
+        return expired
+
+    def sweep(self, conn: sqlite3.Connection, now: float) -> int:
+        """Снимает истёкшие аренды и заново сверяет память с таблицей"""
+        expired = self.expire(conn, now)
+        rows = conn.execute(f"{_SELECT_LEASES} WHERE expires_at > ?", (now,)).fetchall()
+        with self._lock:
+            self._reload(rows)
+        return expired
+
+    def release(self, conn: sqlite3.Connection, user_id: int, file_name: str) -> Optional[str]:
+        """Возвращает в пул прокси, который пользователь арендует в файле"""
+        conn.execute("DELETE FROM proxy_leases WHERE user_id = ? AND file_name = ?", (user_id, file_name))
+        with self._lock:
+            proxy = self._by_user.get((user_id, file_name))
+            if proxy is not None:
+                self._remove(file_name, proxy)
+        return proxy
+
+    def acquire(self, conn: sqlite3.Connection, file_name: str, proxy: str, user_id: int,
+                now: float) -> Optional[float]:
+        """Закрепляет прокси за пользователем и возвращает срок окончания аренды.
+
+        Истёкшие аренды и прежняя аренда пользователя в файле должны быть сняты
+        в той же транзакции (expire() и release()). Если запись уже занята,
+        например другим процессом, её аренда загружается в память и
+        возвращается None.
+        """
+        expires_at = now + self.ttl
+        inserted = conn.execute('''INSERT OR IGNORE INTO proxy_leases
+                                   (file_name, proxy, user_id, leased_at, expires_at)
+                                   VALUES (?, ?, ?, ?, ?)''',
+                                (file_name, proxy, user_id, now, expires_at)).rowcount
+        if not inserted:
+            row = conn.execute(f"{_SELECT_LEASES} WHERE file_name = ? AND proxy = ?",
+                               (file_name, proxy)).fetchone()
+            if row is not None:
+                with self._lock:
+                    self._add(*row)
+            return None
+        with self._lock:
+            self._add(file_name, proxy, user_id, expires_at)
+        return expires_at
+
+    async def _run(self, pool, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                expired = await pool.write(self.sweep, time.time())
+                if expired:
+                    logging.info(f"Освобождено {expired} прокси с истёкшей арендой")
+            except Exception as e:
+                logging.error(f"Ошибка при освобождении аренд прокси: {e}")
+
+    def start(self, pool, interval: float):
+        """Запускает фоновое снятие истёкших аренд через пул БД pool"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(pool, interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+lease_manager = LeaseManager(PROXY_LEASE_TTL)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from balancer import balancer
+from catalog import catalog
+from config import HEALTH_CHECK_ENABLED, LEASE_SWEEP_INTERVAL, MEDIA_GC_INTERVAL
+from database import init_db, db, write_behind, get_latest_issues
+from file_cache import file_id_cache
+from geo import load_ip_ranges
+from health import health_checker
+from leases import lease_manager
+from media_gc import media_gc
+from notifications import admin_digest
+from pool_index import column
+from proxy_pool import proxy_pool
+from selection import selector
+from sender import outbound
+from utils import init_proxy_files
+
+
+class AppState:
+    """Состояние процесса: готовность к обработке обновлений и замеры старта"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @ready.setter
+    def ready(self, value: bool):
+        if value:
+            self._ready.set()
+        else:
+            self._ready.clear()
+
+    async def wait_ready(self):
+        await self._ready.wait()
+
+
+app_state = AppState()
+
+
+async def _timed(name: str, coro: Awaitable[Any]) -> Any:
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        app_state.phases[name] = time.perf_counter() - started
+
+
+async def _restore_balancer() -> int:
+    """Восстанавливает назначения пользователей для файлов в режиме balanced"""
+    balanced = {
+        file['display']: name for name, file in catalog.files.items()
+        if selector.mode(name) == "balanced"
+    }
+    if not balanced:
+        return 0
+
+    # В истории хранится отображаемое имя файла, а не имя на диске
+    wanted: Dict[str, Dict[str, List[Tuple[int, int]]]] = {}
+    for user_id, proxy_type, proxy, issued_at in await get_latest_issues():
+        file_name = balanced.get(proxy_type)
+        if file_name is not None:
+            wanted.setdefault(file_name, {}).setdefault(proxy, []).append((user_id, issued_at))
+
+    def match() -> List[Tuple[int, str, Tuple[str, int], int]]:
+        # Пул просматривается по URI без карты всех записей: в памяти только
+        # выданные пользователям прокси, запись декодируется лишь для совпадений
+        assignments = []
+        for file_name, users in wanted.items():
+            records = proxy_pool.get(file_name)
+            for index, uri in enumerate(column(records, "uri")):
+                if uri in users:
+                    record = records[index]
+                    assignments.extend((user_id, file_name, (record.host, record.port), issued_at)
+                                       for user_id, issued_at in users.pop(uri))
+                    if not users:
+                        break
+        return assignments
+
+    assignments = await asyncio.to_thread(match)
+    balancer.restore(assignments)
+    return len(assignments)
+
+
+async def startup(bot: Bot):
+    """Однократная инициализация при запуске процесса.
+
+    Миграции, создание прокси-файлов и запуск фоновых сервисов выполняются
+    здесь, а не в хендлерах, поэтому /start не трогает схему и файловую систему.
+    """
+    await _timed("migrations", asyncio.to_thread(init_db))
+    await _timed("proxy_files", init_proxy_files())
+
+    ranges = await _timed("geoip", asyncio.to_thread(load_ip_ranges))
+    if ranges:
+        logging.info(f"Загружено {ranges} диапазонов IP для определения стран")
+
+    files_count = await _timed("catalog", catalog.reload())
+    logging.info(f"Загружено {files_count} файлов прокси")
+
+    if lease_manager.enabled:
+        leases = await _timed("leases", db.read(lease_manager.load))
+        logging.info(f"Загружено {leases} действующих аренд прокси")
+
+    cached_files = await _timed("file_ids", db.read(file_id_cache.load))
+    logging.info(f"Загружено {cached_files} file_id отправленных файлов")
+
+    restored = await _timed("balancer", _restore_balancer())
+    if restored:
+        logging.info(f"Восстановлено {restored} назначений прокси по серверам")
+
+    write_behind.start()
+    outbound.start()
+    admin_digest.start(bot)
+    lease_manager.start(db, LEASE_SWEEP_INTERVAL)
+    media_gc.start(db, MEDIA_GC_INTERVAL)
+    if HEALTH_CHECK_ENABLED:
+        # Первая проверка идёт в фоне: до её результатов все записи считаются живыми
+        health_checker.start(lambda: list(catalog.files))
+
+    app_state.ready = True
+    phases = ", ".join(f"{name}: {seconds * 1000:.1f} мс" for name, seconds in app_state.phases.items())
+    logging.info(f"Инициализация завершена ({phases})")
+
+
+async def serve(bot: Bot, dp: Dispatcher, init: Awaitable[Any], **polling_kwargs):
+    """Опрашивает обновления, не дожидаясь окончания инициализации init.
+
+    Обновления, полученные во время инициализации, ждут её в
+    ReadinessMiddleware. Если инициализация завершилась ошибкой, опрос
+    останавливается, а ошибка пробрасывается вызывающему.
+    """
+    init_task = asyncio.ensure_future(init)
+
+    async def stop_on_failure():
+        try:
+            await asyncio.shield(init_task)
+        except Exception:
+            await dp.stop_polling()
+
+    watcher = asyncio.create_task(stop_on_failure())
+    try:
+        await dp.start_polling(bot, **polling_kwargs)
+    finally:
+        watcher.cancel()
+        if not init_task.done():
+            init_task.cancel()
+        await asyncio.gather(watcher, init_task, return_exceptions=True)
+    if not init_task.cancelled() and init_task.exception() is not None:
+        raise init_task.exception()
+
+
+async def shutdown():
+    """Останавливает фоновые сервисы, досылая накопленные данные"""
+    app_state.ready = False
+    await health_checker.stop()
+    await lease_manager.stop()
+    await media_gc.stop()
+    # Последняя сводка и очередь сообщений уходят до закрытия сессии бота
+    await admin_digest.stop()
+    await outbound.stop()
+    # Сбрасываем накопленные журналы до закрытия соединений
+    await write_behind.stop()
+    db.close()
+
+
+class ReadinessMiddleware(BaseMiddleware):
+    """Задерживает обновления до готовности и замеряет время до первого обновления.
+
+    Регистрируется до startup(): опрос начинается сразу после запуска
+    процесса, а обновления, пришедшие во время инициализации, обрабатываются
+    после неё, а не теряются.
+    """
+
+    def __init__(self, boot_started: float):
+        self.boot_started = boot_started
+        self.first_update_seen = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        first = not self.first_update_seen
+        self.first_update_seen = True
+        if first:
+            elapsed = time.perf_counter() - self.boot_started
+            logging.info(f"Первое обновление получено через {elapsed:.2f} с после запуска процесса")
+            app_state.phases["first_update"] = elapsed
+
+        if not app_state.ready:
+            logging.info("Обновление получено до завершения инициализации и ждёт её")
+            await app_state.wait_ready()
+
+        if not first:
+            return await handler(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            app_state.phases["first_handler"] = time.perf_counter() - started
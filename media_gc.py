@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, List, Optional, Tuple
+from config import (
+    MEDIA_RETENTION_DAYS, MEDIA_USER_QUOTA, MEDIA_GLOBAL_QUOTA, MEDIA_GC_BATCH, MEDIA_ORPHAN_GRACE
+)
+from db_pool import HAS_RETURNING
+from media_store import MediaStore, INCOMING_FOLDER, media_store
+
+# Пауза между пакетами, когда работы больше, чем помещается в один пакет
+BATCH_PAUSE = 1.0
+
+
+class GcReport:
+    __slots__ = ("files", "bytes", "refs")
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.refs = 0
+
+    def removed(self, result: Optional[Tuple[str, int]]):
+        if result is not None:
+            self.files += 1
+            self.bytes += result[1]
+
+
+class MediaGarbageCollector:
+    """Фоновая очистка хранилища вложений поддержки.
+
+    За один проход выполняется не больше batch_size операций на каждом шаге:
+    - снимаются ссылки вложений тикетов, закрытых раньше срока хранения;
+    - пользователи сверх личной квоты теряют самые старые вложения закрытых тикетов;
+    - при превышении общей квоты удаляются самые старые вложения закрытых тикетов;
+    - удаляются файлы без ссылок и брошенные временные файлы загрузок.
+    Вложения открытых тикетов квоты не трогают. Если пакет заполнен целиком,
+    следующий проход начинается после короткой паузы, иначе - через interval.
+    """
+
+    def __init__(self, store: MediaStore, retention_days: float, user_quota: int, global_quota: int,
+                 batch_size: int, orphan_grace: float):
+        self.store = store
+        self.retention_days = retention_days
+        self.user_quota = user_quota
+        self.global_quota = global_quota
+        self.batch_size = batch_size
+        self.orphan_grace = orphan_grace
+        self._task: Optional[asyncio.Task] = None
+
+    def _release(self, conn: sqlite3.Connection, ref_ids: List[int], report: GcReport):
+        for ref_id in ref_ids:
+            if HAS_RETURNING:
+                row = conn.execute("DELETE FROM media_refs WHERE id = ? RETURNING digest", (ref_id,)).fetchone()
+            else:
+                row = conn.execute("SELECT digest FROM media_refs WHERE id = ?", (ref_id,)).fetchone()
+                if row is not None and not conn.execute("DELETE FROM media_refs WHERE id = ?", (ref_id,)).rowcount:
+                    row = None
+            if row is not None:
+                report.refs += 1
+                report.removed(self.store.remove_unreferenced(conn, row[0]))
+
+    def _expire_closed(self, conn: sqlite3.Connection, now: float, report: GcReport):
+        if self.retention_days <= 0:
+            return
+        cutoff = now - self.retention_days * 86400
+        rows = conn.execute('''
+            SELECT r.id FROM media_refs r JOIN support_tickets t ON t.id = r.ticket_id
+            WHERE t.status = 'closed' AND COALESCE(t.updated_at, t.created_at) < datetime(?, 'unixepoch')
+            LIMIT ?''', (cutoff, self.batch_size)).fetchall()
+        self._release(conn, [row[0] for row in rows], report)
+
+    def _evictable(self, conn: sqlite3.Connection, owner_id: Optional[int], limit: int) -> List[int]:
+        # Кандидаты на вытеснение: вложения закрытых тикетов и без тикета, старые первыми
+        owner_filter = "AND r.owner_id = ?" if owner_id is not None else ""
+        params = (owner_id, limit) if owner_id is not None else (limit,)
+        return [row[0] for row in conn.execute(f'''
+            SELECT r.id FROM media_refs r
+            LEFT JOIN support_tickets t ON t.id = r.ticket_id
+            WHERE COALESCE(t.status, 'closed') = 'closed' {owner_filter}
+            ORDER BY r.created_at, r.id
+            LIMIT ?''', params)]
+
+    def _evict(self, conn: sqlite3.Connection, candidates: List[int], used: Callable[[], int], quota: int,
+               report: GcReport) -> int:
+        """Снимает ссылки по одной, пока used() не опустится до quota; возвращает число снятых.
+
+        used() читает нарастающий итог после каждой ссылки, поэтому учитываются
+        только действительно освобождённые байты: файл, на который остались
+        другие ссылки, место не освобождает.
+        """
+        released = 0
+        for ref_id in candidates:
+            if used() <= quota:
+                break
+            self._release(conn, [ref_id], report)
+            released += 1
+        return released
+
+    def _owner_usage(self, conn: sqlite3.Connection, owner_id: int) -> int:
+        row = conn.execute("SELECT bytes FROM media_usage WHERE owner_id = ?", (owner_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _stored_bytes(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM stats_totals WHERE key = 'media_stored_bytes'").fetchone()
+        return row[0] if row else 0
+
+    def _enforce_user_quota(self, conn: sqlite3.Connection, report: GcReport):
+        if self.user_quota <= 0:
+            return
+        # Объём по владельцам ведут триггеры (media_usage), поиск идёт по индексу
+        owners = conn.execute('''SELECT owner_id FROM media_usage WHERE bytes > ?
+                                 ORDER BY bytes DESC LIMIT ?''', (self.user_quota, self.batch_size)).fetchall()
+        budget = self.batch_size
+        for (owner_id,) in owners:
+            if budget <= 0:
+                break
+            candidates = self._evictable(conn, owner_id, budget)
+            self._evict(conn, candidates, lambda: self._owner_usage(conn, owner_id), self.user_quota, report)
+            budget -= len(candidates)
+
+    def _enforce_global_quota(self, conn: sqlite3.Connection, report: GcReport):
+        if self.global_quota <= 0:
+            return
+        if self._stored_bytes(conn) > self.global_quota:
+            self._evict(conn, self._evictable(conn, None, self.batch_size), lambda: self._stored_bytes(conn),
+                        self.global_quota, report)
+
+    def _remove_orphans(self, conn: sqlite3.Connection, now: float, report: GcReport):
+        # Файлы без ссылок: тикет не создан после загрузки или ссылки сняты вручную.
+        # Свежие записи пропускаются - их ссылка может ещё создаваться
+        rows = conn.execute('''
+            SELECT f.digest FROM media_files f
+            WHERE NOT EXISTS (SELECT 1 FROM media_refs r WHERE r.digest = f.digest)
+              AND f.created_at < datetime(?, 'unixepoch')
+            LIMIT ?''', (now - self.orphan_grace, self.batch_size)).fetchall()
+        for (digest,) in rows:
+            report.removed(self.store.remove_unreferenced(conn, digest))
+
+        # Недокачанные временные файлы, оставшиеся после падения процесса
+        incoming = os.path.join(self.store.folder, INCOMING_FOLDER)
+        try:
+            entries = list(os.scandir(incoming))[:self.batch_size]
+        except FileNotFoundError:
+            return
+        stale = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if stat.st_mtime < now - self.orphan_grace:
+                    os.remove(entry.path)
+                    stale.append(stat.st_size)
+            except FileNotFoundError:
+                continue
+        if stale:
+            self.store.count_reclaimed(conn, len(stale), sum(stale))
+            report.files += len(stale)
+            report.bytes += sum(stale)
+
+    def collect(self, conn: sqlite3.Connection, now: float) -> GcReport:
+        """Один проход очистки; выполняется в потоке записи БД"""
+        report = GcReport()
+        self._expire_closed(conn, now, report)
+        self._enforce_user_quota(conn, report)
+        self._enforce_global_quota(conn, report)
+        self._remove_orphans(conn, now, report)
+        return report
+
+    async def _run(self, pool, interval: float):
+        while True:
+            try:
+                report = await pool.write(self.collect, time.time())
+                if report.files or report.refs:
+                    logging.info(
+                        f"Очистка вложений: снято {report.refs} ссылок, удалено {report.files} файлов "
+                        f"({report.bytes / 1024 / 1024:.1f} МБ)"
+                    )
+                # Пакет заполнен - вероятно, осталась работа: продолжаем после паузы
+                busy = report.refs + report.files >= self.batch_size
+            except Exception as e:
+                logging.error(f"Ошибка при очистке вложений: {e}")
+                busy = False
+            await asyncio.sleep(BATCH_PAUSE if busy else interval)
+
+    def start(self, pool, interval: float):
+        """Запускает фоновую очистку через пул БД pool"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(pool, interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+media_gc = MediaGarbageCollector(
+    media_store, MEDIA_RETENTION_DAYS, MEDIA_USER_QUOTA, MEDIA_GLOBAL_QUOTA, MEDIA_GC_BATCH, MEDIA_ORPHAN_GRACE
+)
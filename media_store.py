@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import uuid
+from typing import AsyncIterator, List, Optional, Tuple
+import aiofiles
+from aiogram import Bot
+from config import MEDIA_FOLDER, MEDIA_DOWNLOAD_CONCURRENCY, MEDIA_DOWNLOAD_TIMEOUT
+from db_pool import HAS_RETURNING
+
+# Файлы поддержки хранятся по содержимому: <папка>/ab/cd/<sha256><расширение>.
+# Одинаковые вложения хранятся один раз, а владельцы, тикеты и размеры лежат
+# в таблицах media_files (файл) и media_refs (ссылка пользователя на файл).
+
+INCOMING_FOLDER = ".incoming"
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLarge(Exception):
+    """Загрузка превысила допустимый размер и прервана"""
+
+
+class HashingWriter:
+    """Временный файл загрузки: пишет через aiofiles и считает sha256 на лету"""
+
+    def __init__(self, path: str, file):
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = file
+
+    @classmethod
+    async def create(cls, path: str) -> "HashingWriter":
+        return cls(path, await aiofiles.open(path, "wb"))
+
+    async def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        await self._file.write(chunk)
+
+    async def close(self):
+        if not self._file.closed:
+            await self._file.flush()
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            await self._file.close()
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class StoredMedia:
+    __slots__ = ("digest", "path", "size", "media_type")
+
+    def __init__(self, digest: str, path: str, size: int, media_type: str):
+        self.digest = digest
+        self.path = path
+        self.size = size
+        self.media_type = media_type
+
+
+class MediaStore:
+    """Контентно-адресуемое хранилище вложений поддержки.
+
+    Загрузка идёт потоком во временный файл в .incoming через HashingWriter,
+    затем commit() в потоке записи БД переносит его на место по хэшу (или
+    удаляет, если такой файл уже есть) и регистрирует в media_files. Ссылки
+    владельцев добавляются add_ref() и снимаются release(); файл без ссылок
+    удаляется.
+    """
+
+    def __init__(self, folder: str, concurrency: int, timeout: int):
+        self.folder = folder
+        self.timeout = timeout
+        # Одновременных загрузок не больше concurrency, остальные ждут очереди
+        self._downloads = asyncio.Semaphore(concurrency)
+
+    def path_for(self, digest: str, ext: str) -> str:
+        return os.path.join(self.folder, digest[:2], digest[2:4], digest + ext)
+
+    def digest_of(self, path: str) -> Optional[str]:
+        """Хэш файла по его пути в хранилище; None для файлов вне хранилища"""
+        name, _ = os.path.splitext(os.path.basename(path))
+        if len(name) != 64 or os.path.abspath(path) != os.path.abspath(self.path_for(name, os.path.splitext(path)[1])):
+            return None
+        return name
+
+    async def _open_incoming(self) -> HashingWriter:
+        folder = os.path.join(self.folder, INCOMING_FOLDER)
+        await asyncio.to_thread(os.makedirs, folder, exist_ok=True)
+        return await HashingWriter.create(os.path.join(folder, uuid.uuid4().hex))
+
+    async def _discard(self, writer: HashingWriter):
+        # Недокачанный временный файл удаляется
+        await writer.close()
+        if os.path.exists(writer.path):
+            await asyncio.to_thread(os.remove, writer.path)
+
+    def _stream(self, bot: Bot, file_path: str) -> AsyncIterator[bytes]:
+        api = bot.session.api
+        if api.is_local:
+            # Локальный Bot API сервер отдаёт путь к файлу на диске
+            return self._read_local(str(api.wrap_local_file.to_local(file_path)))
+        return bot.session.stream_content(
+            url=api.file_url(bot.token, file_path),
+            timeout=self.timeout,
+            chunk_size=CHUNK_SIZE,
+            raise_for_status=True,
+        )
+
+    async def _read_local(self, path: str) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                yield chunk
+
+    async def download(self, bot: Bot, file_path: str, max_size: int) -> HashingWriter:
+        """Скачивает файл Telegram во временный файл, прерываясь после max_size байт"""
+        async with self._downloads:
+            writer = await self._open_incoming()
+            try:
+                stream = self._stream(bot, file_path)
+                try:
+                    async for chunk in stream:
+                        if writer.size + len(chunk) > max_size:
+                            raise MediaTooLarge(f"файл больше {max_size} байт")
+                        await writer.write(chunk)
+                finally:
+                    # Закрытие генератора закрывает HTTP-ответ и не дочитывает остаток
+                    await stream.aclose()
+                await writer.close()
+            except BaseException:
+                await self._discard(writer)
+                raise
+            return writer
+
+    def commit(self, conn: sqlite3.Connection, writer: HashingWriter, media_type: str, ext: str) -> StoredMedia:
+        """Переносит скачанный файл на место по хэшу и регистрирует его"""
+        digest = writer.digest
+        row = conn.execute("SELECT path FROM media_files WHERE digest = ?", (digest,)).fetchone()
+        path = row[0] if row else self.path_for(digest, ext)
+        if os.path.exists(path):
+            # Такое вложение уже хранится - копия не нужна
+            os.remove(writer.path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(writer.path, path)
+        # Совпадение с уже хранимым файлом продлевает его created_at: ссылка на
+        # него появится отдельным вызовом add_ref(), и до этого очистка не
+        # должна счесть файл осиротевшим
+        conn.execute('''INSERT INTO media_files (digest, path, size, media_type)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (digest) DO UPDATE SET created_at = CURRENT_TIMESTAMP''',
+                     (digest, path, writer.size, media_type))
+        return StoredMedia(digest, path, writer.size, media_type)
+
+    def add_ref(self, conn: sqlite3.Connection, path: str, owner_id: int, ticket_id: Optional[int],
+                role: str, original_name: Optional[str] = None) -> Optional[int]:
+        """Добавляет ссылку владельца на файл хранилища; возвращает id ссылки"""
+        digest = self.digest_of(path)
+        if digest is None:
+            return None
+        return conn.execute('''INSERT INTO media_refs (digest, owner_id, ticket_id, role, original_name)
+                               VALUES (?, ?, ?, ?, ?)''',
+                            (digest, owner_id, ticket_id, role, original_name)).lastrowid
+
+    def release(self, conn: sqlite3.Connection, ref_id: int) -> Optional[str]:
+        """Снимает ссылку; возвращает путь удалённого файла, если ссылок на него не осталось"""
+        row = conn.execute("SELECT digest FROM media_refs WHERE id = ?", (ref_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM media_refs WHERE id = ?", (ref_id,))
+        removed = self.remove_unreferenced(conn, row[0])
+        return removed[0] if removed else None
+
+    def remove_unreferenced(self, conn: sqlite3.Connection, digest: str) -> Optional[Tuple[str, int]]:
+        """Удаляет файл, на который не осталось ссылок; возвращает (путь, размер)"""
+        if conn.execute("SELECT 1 FROM media_refs WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return None
+        if HAS_RETURNING:
+            row = conn.execute("DELETE FROM media_files WHERE digest = ? RETURNING path, size", (digest,)).fetchone()
+        else:
+            # Без RETURNING строка читается до удаления в той же транзакции;
+            # если её успел удалить другой процесс, DELETE ничего не изменит
+            row = conn.execute("SELECT path, size FROM media_files WHERE digest = ?", (digest,)).fetchone()
+            if row is not None and not conn.execute("DELETE FROM media_files WHERE digest = ?", (digest,)).rowcount:
+                row = None
+        if row is None:
+            return None
+        path, size = row
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Не удалось удалить файл {path}: {e}")
+        self.count_reclaimed(conn, 1, size)
+        return path, size
+
+    def count_reclaimed(self, conn: sqlite3.Connection, files: int, size: int):
+        """Счётчики освобождённого места в stats_totals"""
+        conn.executemany('''INSERT INTO stats_totals (key, value) VALUES (?, ?)
+                            ON CONFLICT (key) DO UPDATE SET value = value + excluded.value''',
+                         (("media_reclaimed_files", files), ("media_reclaimed_bytes", size)))
+
+    def user_files(self, conn: sqlite3.Connection, owner_id: int) -> List[Tuple]:
+        """Вложения пользователя: (id ссылки, имя, тип, размер, тикет, дата), новые первыми"""
+        return conn.execute('''
+            SELECT r.id, r.original_name, f.media_type, f.size, r.ticket_id, r.created_at
+            FROM media_refs r JOIN media_files f ON f.digest = r.digest
+            WHERE r.owner_id = ?
+            ORDER BY r.created_at DESC, r.id DESC''', (owner_id,)).fetchall()
+
+
+media_store = MediaStore(MEDIA_FOLDER, MEDIA_DOWNLOAD_CONCURRENCY, MEDIA_DOWNLOAD_TIMEOUT)
@@ -0,0 +1,442 @@
+import sqlite3
+import logging
+from typing import Callable, List, Tuple
+
+# Миграции схемы БД. Номер последней применённой миграции хранится в
+# PRAGMA user_version, поэтому при старте выполняется только одно чтение,
+# а DDL запускается лишь для новых миграций.
+
+
+def _execute_script(conn: sqlite3.Connection, script: str):
+    # executescript() делает COMMIT перед выполнением, поэтому разбираем
+    # скрипт на отдельные выражения и выполняем их внутри транзакции миграции
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: List[Tuple[str, str]]):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column_name, column_def in columns:
+        if column_name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_name} {column_def}")
+            logging.info(f"Добавлена колонка '{column_name}' в таблицу {table}")
+
+
+BASE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS proxy_files (
+    file_name TEXT PRIMARY KEY,
+    display_name TEXT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+CREATE TABLE IF NOT EXISTS proxy_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    proxy TEXT,
+    proxy_type TEXT,
+    issue_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(user_id));
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id INTEGER PRIMARY KEY,
+    language TEXT DEFAULT 'ru',
+    notifications INTEGER DEFAULT 1,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(user_id));
+
+CREATE TABLE IF NOT EXISTS support_tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    message TEXT,
+    media_type TEXT,
+    media_path TEXT,
+    status TEXT DEFAULT 'open',
+    admin_id INTEGER,
+    reply_message TEXT,
+    reply_media_type TEXT,
+    reply_media_path TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    replied_at TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(user_id));
+
+CREATE TABLE IF NOT EXISTS support_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id INTEGER,
+    user_id INTEGER,
+    message_text TEXT,
+    is_from_admin BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(ticket_id) REFERENCES support_tickets(id),
+    FOREIGN KEY(user_id) REFERENCES users(user_id));
+
+CREATE TABLE IF NOT EXISTS proxy_index (
+    file_name TEXT PRIMARY KEY,
+    last_index INTEGER DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS used_proxies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    proxy TEXT NOT NULL,
+    proxy_type TEXT NOT NULL,
+    used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(proxy, proxy_type));
+
+CREATE TABLE IF NOT EXISTS proxy_downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    download_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(user_id));
+'''
+
+
+def _migration_base_schema(conn: sqlite3.Connection):
+    """Базовая схема; для БД старых версий добавляет недостающие колонки"""
+    _execute_script(conn, BASE_SCHEMA)
+    _add_missing_columns(conn, "user_settings", [
+        ('language', "TEXT DEFAULT 'ru'"),
+        ('notifications', 'INTEGER DEFAULT 1'),
+        ('last_update', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'),
+    ])
+    _add_missing_columns(conn, "support_tickets", [
+        ('username', 'TEXT'),
+        ('first_name', 'TEXT'),
+        ('last_name', 'TEXT'),
+        ('message', 'TEXT'),
+        ('media_type', 'TEXT'),
+        ('media_path', 'TEXT'),
+        ('status', "TEXT DEFAULT 'open'"),
+        ('admin_id', 'INTEGER'),
+        ('reply_message', 'TEXT'),
+        ('reply_media_type', 'TEXT'),
+        ('reply_media_path', 'TEXT'),
+        ('replied_at', 'TIMESTAMP'),
+    ])
+
+
+# Таблицы-агрегаты статистики и триггеры, которые поддерживают их при каждой вставке.
+# День в stats_daily - локальная дата, как и граница since в хендлере статистики
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stats_totals (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS stats_daily (
+    day TEXT NOT NULL,
+    proxy_type TEXT NOT NULL,
+    issued INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, proxy_type));
+
+CREATE TABLE IF NOT EXISTS stats_proxy_type (
+    proxy_type TEXT PRIMARY KEY,
+    issued INTEGER NOT NULL DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS stats_user (
+    user_id INTEGER PRIMARY KEY,
+    issued INTEGER NOT NULL DEFAULT 0,
+    downloads INTEGER NOT NULL DEFAULT 0);
+
+CREATE INDEX IF NOT EXISTS idx_stats_user_issued ON stats_user (issued);
+
+CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+BEGIN
+    UPDATE stats_totals SET value = value + 1 WHERE key = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_history_insert AFTER INSERT ON proxy_history
+BEGIN
+    UPDATE stats_totals SET value = value + 1 WHERE key = 'proxies_issued';
+    INSERT INTO stats_daily (day, proxy_type, issued)
+        VALUES (date(NEW.issue_date, 'localtime'), COALESCE(NEW.proxy_type, ''), 1)
+        ON CONFLICT (day, proxy_type) DO UPDATE SET issued = issued + 1;
+    INSERT INTO stats_proxy_type (proxy_type, issued)
+        VALUES (COALESCE(NEW.proxy_type, ''), 1)
+        ON CONFLICT (proxy_type) DO UPDATE SET issued = issued + 1;
+    INSERT INTO stats_user (user_id, issued) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET issued = issued + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_downloads_insert AFTER INSERT ON proxy_downloads
+BEGIN
+    UPDATE stats_totals SET value = value + 1 WHERE key = 'downloads';
+    UPDATE stats_totals SET value = value + 1 WHERE key = 'active_users'
+        AND NOT EXISTS (SELECT 1 FROM stats_user WHERE user_id = NEW.user_id AND downloads > 0);
+    INSERT INTO stats_user (user_id, downloads) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET downloads = downloads + 1;
+END;
+'''
+
+
+# Текущий объём вложений: по владельцам (сумма размеров файлов их ссылок) и
+# всего хранилища (stats_totals: media_stored_files, media_stored_bytes).
+# Поддерживается триггерами, чтобы квоты не пересчитывали суммы по таблицам
+MEDIA_USAGE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_usage (
+    owner_id INTEGER PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0);
+
+CREATE INDEX IF NOT EXISTS idx_media_usage_bytes ON media_usage (bytes);
+
+CREATE TRIGGER IF NOT EXISTS media_refs_insert AFTER INSERT ON media_refs
+BEGIN
+    INSERT INTO media_usage (owner_id, bytes)
+        VALUES (NEW.owner_id, COALESCE((SELECT size FROM media_files WHERE digest = NEW.digest), 0))
+        ON CONFLICT (owner_id) DO UPDATE SET bytes = bytes + excluded.bytes;
+END;
+
+CREATE TRIGGER IF NOT EXISTS media_refs_delete AFTER DELETE ON media_refs
+BEGIN
+    UPDATE media_usage
+        SET bytes = bytes - COALESCE((SELECT size FROM media_files WHERE digest = OLD.digest), 0)
+        WHERE owner_id = OLD.owner_id;
+    DELETE FROM media_usage WHERE owner_id = OLD.owner_id AND bytes <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS media_files_insert AFTER INSERT ON media_files
+BEGIN
+    INSERT INTO stats_totals (key, value) VALUES ('media_stored_files', 1), ('media_stored_bytes', NEW.size)
+        ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+END;
+
+CREATE TRIGGER IF NOT EXISTS media_files_delete AFTER DELETE ON media_files
+BEGIN
+    UPDATE stats_totals SET value = value - 1 WHERE key = 'media_stored_files';
+    UPDATE stats_totals SET value = value - OLD.size WHERE key = 'media_stored_bytes';
+END;
+'''
+
+
+def _rebuild_media_usage(c: sqlite3.Cursor):
+    c.execute("DELETE FROM media_usage")
+    c.execute('''INSERT INTO media_usage (owner_id, bytes)
+                 SELECT r.owner_id, SUM(f.size) FROM media_refs r JOIN media_files f ON f.digest = r.digest
+                 GROUP BY r.owner_id''')
+    c.execute("DELETE FROM stats_totals WHERE key IN ('media_stored_files', 'media_stored_bytes')")
+    c.execute('''INSERT INTO stats_totals (key, value)
+                 SELECT 'media_stored_files', COUNT(*) FROM media_files
+                 UNION ALL SELECT 'media_stored_bytes', COALESCE(SUM(size), 0) FROM media_files''')
+
+
+def _rebuild_daily(c: sqlite3.Cursor):
+    c.execute('''INSERT INTO stats_daily (day, proxy_type, issued)
+                 SELECT date(issue_date, 'localtime'), COALESCE(proxy_type, ''), COUNT(*)
+                 FROM proxy_history
+                 GROUP BY date(issue_date, 'localtime'), COALESCE(proxy_type, '')''')
+
+
+def _rebuild_issue_stats(c: sqlite3.Cursor):
+    for table in ("stats_daily", "stats_proxy_type", "stats_user"):
+        c.execute(f"DELETE FROM {table}")
+    # Счётчики очистки вложений (media_reclaimed_*) не восстановить по таблицам - сохраняем их
+    c.execute("DELETE FROM stats_totals WHERE key IN ('users', 'proxies_issued', 'downloads', 'active_users')")
+
+    c.execute('''INSERT INTO stats_totals (key, value)
+                 SELECT 'users', COUNT(*) FROM users
+                 UNION ALL SELECT 'proxies_issued', COUNT(*) FROM proxy_history
+                 UNION ALL SELECT 'downloads', COUNT(*) FROM proxy_downloads
+                 UNION ALL SELECT 'active_users', COUNT(DISTINCT user_id) FROM proxy_downloads''')
+    _rebuild_daily(c)
+    c.execute('''INSERT INTO stats_proxy_type (proxy_type, issued)
+                 SELECT COALESCE(proxy_type, ''), COUNT(*)
+                 FROM proxy_history
+                 GROUP BY COALESCE(proxy_type, '')''')
+    c.execute('''INSERT INTO stats_user (user_id, issued, downloads)
+                 SELECT user_id, SUM(issued), SUM(downloads) FROM (
+                     SELECT user_id, COUNT(*) AS issued, 0 AS downloads
+                     FROM proxy_history GROUP BY user_id
+                     UNION ALL
+                     SELECT user_id, 0, COUNT(*)
+                     FROM proxy_downloads GROUP BY user_id)
+                 WHERE user_id IS NOT NULL
+                 GROUP BY user_id''')
+
+
+def rebuild_statistics(conn: sqlite3.Connection):
+    """Пересчитывает агрегаты статистики по исходным таблицам"""
+    c = conn.cursor()
+    _rebuild_issue_stats(c)
+    _rebuild_media_usage(c)
+
+
+def _migration_statistics(conn: sqlite3.Connection):
+    """Агрегаты статистики с заполнением по уже накопленным данным"""
+    _execute_script(conn, STATS_SCHEMA)
+    # Таблиц вложений на этой версии схемы ещё нет
+    _rebuild_issue_stats(conn.cursor())
+
+
+def _migration_indexes(conn: sqlite3.Connection):
+    """Индексы для горячих запросов database.py и handlers.py"""
+    _execute_script(conn, '''
+        -- История выдачи пользователя: WHERE user_id = ? ORDER BY issue_date DESC
+        CREATE INDEX IF NOT EXISTS idx_proxy_history_user_date
+            ON proxy_history (user_id, issue_date);
+
+        -- Скачивания пользователя (покрывающий индекс) и общий журнал скачиваний
+        CREATE INDEX IF NOT EXISTS idx_proxy_downloads_user_time
+            ON proxy_downloads (user_id, download_time, file_name);
+        CREATE INDEX IF NOT EXISTS idx_proxy_downloads_time
+            ON proxy_downloads (download_time);
+
+        -- Лимит открытых тикетов, список тикетов пользователя и открытые тикеты
+        CREATE INDEX IF NOT EXISTS idx_support_tickets_user_status
+            ON support_tickets (user_id, status);
+        CREATE INDEX IF NOT EXISTS idx_support_tickets_user_created
+            ON support_tickets (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_support_tickets_status_created
+            ON support_tickets (status, created_at);
+    ''')
+
+
+def _migration_selection_mode(conn: sqlite3.Connection):
+    """Режим выбора прокси для каждого файла"""
+    _add_missing_columns(conn, "proxy_files", [
+        ('selection_mode', "TEXT NOT NULL DEFAULT 'round_robin'"),
+    ])
+
+
+def _migration_leases(conn: sqlite3.Connection):
+    """Аренда прокси с ограниченным сроком"""
+    _execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS proxy_leases (
+            file_name TEXT NOT NULL,
+            proxy TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            leased_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (file_name, proxy));
+
+        -- Одна аренда пользователя в файле и снятие истёкших аренд
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_proxy_leases_user
+            ON proxy_leases (user_id, file_name);
+        CREATE INDEX IF NOT EXISTS idx_proxy_leases_expires
+            ON proxy_leases (expires_at);
+    ''')
+
+
+def _migration_user_seen(conn: sqlite3.Connection):
+    """Выданные пользователю записи каждого файла (сжатая битовая карта)"""
+    _execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS user_seen (
+            user_id INTEGER NOT NULL,
+            file_name TEXT NOT NULL,
+            fingerprint BLOB NOT NULL,
+            bitmap BLOB NOT NULL,
+            PRIMARY KEY (user_id, file_name));
+    ''')
+
+
+def _migration_telegram_files(conn: sqlite3.Connection):
+    """file_id загруженных в Telegram файлов для повторной отправки без загрузки"""
+    _execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            path TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at REAL NOT NULL);
+    ''')
+
+
+def _migration_media_store(conn: sqlite3.Connection):
+    """Хранилище вложений по содержимому: файлы по sha256 и ссылки владельцев"""
+    _execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS media_files (
+            digest TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+        CREATE TABLE IF NOT EXISTS media_refs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            digest TEXT NOT NULL REFERENCES media_files(digest),
+            owner_id INTEGER NOT NULL,
+            ticket_id INTEGER,
+            role TEXT NOT NULL,
+            original_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+        CREATE INDEX IF NOT EXISTS idx_media_refs_owner_created
+            ON media_refs (owner_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_media_refs_digest
+            ON media_refs (digest);
+        CREATE INDEX IF NOT EXISTS idx_media_refs_ticket
+            ON media_refs (ticket_id);
+    ''')
+
+
+def _migration_keyset_indexes(conn: sqlite3.Connection):
+    """Индекс скачиваний пользователя с id перед file_name для постраничной выдачи"""
+    _execute_script(conn, '''
+        -- WHERE user_id = ? AND (download_time, id) < (?, ?) ORDER BY download_time DESC, id DESC
+        DROP INDEX IF EXISTS idx_proxy_downloads_user_time;
+        CREATE INDEX IF NOT EXISTS idx_proxy_downloads_user_time_id
+            ON proxy_downloads (user_id, download_time, id, file_name);
+    ''')
+
+
+def _migration_local_stats_days(conn: sqlite3.Connection):
+    """Дни stats_daily по локальному времени вместо UTC"""
+    conn.execute("DROP TRIGGER IF EXISTS stats_history_insert")
+    _execute_script(conn, STATS_SCHEMA)
+    c = conn.cursor()
+    c.execute("DELETE FROM stats_daily")
+    _rebuild_daily(c)
+
+
+def _migration_media_usage(conn: sqlite3.Connection):
+    """Нарастающие итоги объёма вложений для квот и статистики"""
+    _execute_script(conn, MEDIA_USAGE_SCHEMA)
+    _rebuild_media_usage(conn.cursor())
+
+
+# Порядок важен: номер миграции записывается в PRAGMA user_version
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _migration_base_schema),
+    (2, _migration_statistics),
+    (3, _migration_indexes),
+    (4, _migration_selection_mode),
+    (5, _migration_leases),
+    (6, _migration_user_seen),
+    (7, _migration_telegram_files),
+    (8, _migration_media_store),
+    (9, _migration_keyset_indexes),
+    (10, _migration_local_stats_days),
+    (11, _migration_media_usage),
+]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции и возвращает текущую версию схемы"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        # Каждая миграция вместе с номером версии применяется атомарно
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logging.info(f"Применена миграция БД #{version}: {migration.__doc__}")
+        current = version
+    return current
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from aiogram import Bot
+from config import ADMIN_IDS, ADMIN_DIGEST_WINDOW, ADMIN_DIGEST_MAX_EVENTS
+from sender import outbound, PRIORITY_ADMIN
+
+# Заголовки событий в сводке
+EVENT_TITLES = {
+    "proxy_issued": "🆕 Выдано прокси",
+    "file_downloaded": "📥 Скачано файлов",
+}
+
+# Лимит длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+class AdminDigest:
+    """Сводные уведомления администраторам.
+
+    События копятся в памяти и отправляются одним сообщением раз в window
+    секунд или сразу, когда их набирается max_events. Сводка рассылается
+    всем администраторам параллельно и не задерживает ответ пользователю.
+    """
+
+    def __init__(self, admin_ids: Iterable[int], window: float = 60.0, max_events: int = 50):
+        self.admin_ids = list(admin_ids)
+        self.window = window
+        self.max_events = max_events
+        self._events: List[Tuple[str, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._bot: Optional[Bot] = None
+
+    def notify(self, event_type: str, text: str):
+        """Добавляет событие в ближайшую сводку"""
+        self._events.append((event_type, text))
+        if len(self._events) >= self.max_events:
+            self._wakeup.set()
+
+    def _render(self, events: List[Tuple[str, str]]) -> str:
+        counts = Counter(event_type for event_type, _ in events)
+        header = "📋 <b>Сводка событий</b>\n\n"
+        header += "".join(
+            f"{EVENT_TITLES.get(event_type, event_type)}: <b>{count}</b>\n"
+            for event_type, count in counts.most_common()
+        )
+        text = header + "\n"
+        for shown, (_, line) in enumerate(events):
+            tail = f"… и ещё {len(events) - shown}"
+            if len(text) + len(line) + 1 + len(tail) > MESSAGE_LIMIT:
+                return text + tail
+            text += line + "\n"
+        return text
+
+    async def flush(self):
+        """Отправляет накопленные события всем администраторам"""
+        events, self._events = self._events, []
+        if not events or self._bot is None:
+            return
+
+        text = self._render(events)
+        results = await asyncio.gather(
+            *(outbound.send(self._bot.send_message, admin_id, text,
+                            disable_web_page_preview=True, priority=PRIORITY_ADMIN)
+              for admin_id in self.admin_ids),
+            return_exceptions=True
+        )
+        for admin_id, result in zip(self.admin_ids, results):
+            if isinstance(result, Exception):
+                logging.error(f"Не удалось отправить сводку администратору {admin_id}: {result}")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает рассылку и отправляет последнюю сводку"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+admin_digest = AdminDigest(ADMIN_IDS, ADMIN_DIGEST_WINDOW, ADMIN_DIGEST_MAX_EVENTS)
@@ -0,0 +1,156 @@
+import html
+import re
+from typing import List, Optional, Sequence
+
+# Лимит длины текста сообщения Telegram: считается после разбора разметки
+# (теги не входят, сущность - один символ) в единицах UTF-16
+MESSAGE_LIMIT = 4096
+
+# Тег, HTML-сущность или текст между ними
+_TOKEN = re.compile(r"<[^>]*>|&#?\w+;|[^<&]+|[<&]")
+_TAG_NAME = re.compile(r"</?\s*([a-zA-Z0-9-]+)")
+
+
+class Page:
+    """Страница списка с постраничной навигацией по ключу (время, id).
+
+    Записи идут от новых к старым. Ключ страницы - id крайней записи: для
+    следующей (более старой) страницы это id последней записи, для
+    предыдущей (более новой) - id первой.
+    """
+
+    __slots__ = ("items", "has_newer", "has_older")
+
+    def __init__(self, items: List[dict], has_newer: bool, has_older: bool):
+        self.items = items
+        self.has_newer = has_newer
+        self.has_older = has_older
+
+    @property
+    def first_id(self) -> Optional[int]:
+        return self.items[0]["id"] if self.items else None
+
+    @property
+    def last_id(self) -> Optional[int]:
+        return self.items[-1]["id"] if self.items else None
+
+
+def keyset_page(conn, query: str, params: Sequence, table: str, time_column: str,
+                cursor: Optional[int], newer: bool, limit: int, alias: Optional[str] = None) -> Page:
+    """Одна страница по ключу (time_column, id) одним запросом по индексу.
+
+    query - SELECT ... FROM ... WHERE <фильтр> без ORDER BY и LIMIT. Ключ
+    граничной записи берётся подзапросом по id, поэтому в кнопках навигации
+    достаточно хранить только id. Берётся на одну запись больше limit, чтобы
+    узнать, есть ли что-то дальше в выбранном направлении.
+
+    alias обязателен, если SELECT отдаёт колонку под именем time_column
+    (например, datetime(..., 'localtime') AS issue_date): без префикса
+    ORDER BY сортирует по этому выражению, а не по индексу.
+    """
+    prefix = f"{alias}." if alias else ""
+    key = f"({prefix}{time_column}, {prefix}id)"
+    order = "ASC" if newer else "DESC"
+    params = list(params)
+    if cursor is not None:
+        query += f" AND {key} {'>' if newer else '<'} ((SELECT {time_column} FROM {table} WHERE id = ?), ?)"
+        params += [cursor, cursor]
+    query += f" ORDER BY {prefix}{time_column} {order}, {prefix}id {order} LIMIT ?"
+    params.append(limit + 1)
+
+    rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+        return Page(rows, has_newer=more, has_older=cursor is not None)
+    return Page(rows, has_newer=cursor is not None, has_older=more)
+
+
+def _units(piece: str) -> int:
+    """Длина куска в тексте сообщения после разбора разметки, в единицах UTF-16"""
+    if len(piece) > 1 and piece[0] == "<":
+        return 0
+    if len(piece) > 1 and piece[0] == "&":
+        piece = html.unescape(piece)
+    return len(piece.encode("utf-16-le")) // 2
+
+
+def _closing(stack: List[tuple]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _opening(stack: List[tuple]) -> str:
+    return "".join(tag for _, tag in stack)
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Делит HTML-текст на части не длиннее limit.
+
+    Длина считается как у Telegram: по тексту после разбора разметки в
+    единицах UTF-16 (символ вне BMP, например эмодзи, - это две единицы).
+    Разрез делается по последнему переводу строки, а если его нет - между
+    тегами, сущностями или символами текста; теги и сущности вроде &amp;
+    не разрываются. Открытые на месте разреза теги закрываются в конце части
+    и открываются заново в начале следующей.
+    """
+    # Длина исходного HTML в UTF-16 не меньше длины текста после разбора
+    if len(text.encode("utf-16-le")) // 2 <= limit:
+        return [text]
+
+    pieces = []
+    for token in _TOKEN.findall(text):
+        if len(token) > 1 and token[0] in "<&":
+            pieces.append(token)
+        else:
+            # Текст дробится по строкам, слишком длинные строки - на куски
+            for line in token.splitlines(keepends=True):
+                step = limit // 4
+                pieces.extend(line[i:i + step] for i in range(0, len(line), step))
+
+    parts: List[str] = []
+    stack: List[tuple] = []
+    chunk: List[str] = []
+    size = 0
+    # Позиция после последнего перевода строки и теги, открытые в этот момент
+    last_break: Optional[tuple] = None
+
+    def flush(upto: int, open_tags: List[tuple]):
+        nonlocal chunk, size, last_break
+        body = "".join(chunk[:upto])
+        if body.strip():
+            parts.append(body + _closing(open_tags))
+        chunk = [_opening(open_tags)] + chunk[upto:]
+        size = sum(map(_units, chunk))
+        last_break = None
+
+    for piece in pieces:
+        new_stack = stack
+        if piece.startswith("</"):
+            name = _TAG_NAME.match(piece)
+            if name and stack and stack[-1][0] == name.group(1).lower():
+                new_stack = stack[:-1]
+        elif piece.startswith("<") and len(piece) > 1 and not piece.endswith("/>"):
+            name = _TAG_NAME.match(piece)
+            if name:
+                new_stack = stack + [(name.group(1).lower(), piece)]
+
+        units = _units(piece)
+        # Теги в длину не входят, поэтому пустой кусок - это только
+        # заново открытые теги
+        while size + units > limit and size > 0:
+            if last_break is not None:
+                flush(*last_break)
+            else:
+                flush(len(chunk), stack)
+
+        chunk.append(piece)
+        size += units
+        stack = new_stack
+        if piece.endswith("\n"):
+            last_break = (len(chunk), list(stack))
+
+    body = "".join(chunk)
+    if body.strip():
+        parts.append(body)
+    return parts
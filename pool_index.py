@@ -0,0 +1,225 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterable, Iterator, Optional, Sequence, Tuple, Union
+from proxy_parser import ProxyRecord, parse_proxy_lines
+
+# Скомпилированный пул (.pidx): заголовок, таблица смещений записей (count + 1
+# значений uint64) и упакованные записи. Файл читается через mmap, поэтому
+# запись доступна по индексу за O(1) без разбора всего пула, а страницы
+# файла разделяются между процессами через страничный кэш ОС.
+#
+# Заголовок: сигнатура, версия формата, число записей и (mtime_ns, размер)
+# исходного .txt - по ним индекс считается устаревшим.
+# Запись: порт и длины восьми строк, затем сами строки в UTF-8.
+
+MAGIC = b"PIDX"
+VERSION = 1
+INDEX_SUFFIX = ".pidx"
+
+_HEADER = struct.Struct("<4sHHIqQ")
+_OFFSET = struct.Struct("<Q")
+_RECORD = struct.Struct("<H8I")
+# Сколько смещений копится в памяти перед записью в таблицу
+_OFFSETS_CHUNK = 65536
+# Порядок строк в записи
+_FIELDS = ("protocol", "host", "uuid", "transport", "security", "sni", "remark", "uri")
+
+Signature = Tuple[int, int]
+
+
+def index_path(folder: str, file_name: str) -> str:
+    """Путь индекса рядом с исходным файлом (скрытый, как временные файлы загрузки)"""
+    return os.path.join(folder, f".{file_name}{INDEX_SUFFIX}")
+
+
+def _pack(record: ProxyRecord) -> bytes:
+    fields = [
+        value.encode("utf-8", "surrogatepass")
+        for value in (record.protocol, record.host, record.uuid, record.transport,
+                      record.security, record.sni, record.remark, record.uri)
+    ]
+    return _RECORD.pack(record.port, *map(len, fields)) + b"".join(fields)
+
+
+def write_index(path: str, records: Iterable[ProxyRecord], signature: Signature,
+                count: Optional[int] = None) -> int:
+    """Записывает индекс атомарно (временный файл и os.replace); возвращает число записей.
+
+    Записи упаковываются и пишутся по одной, а смещения попадают в таблицу
+    порциями по _OFFSETS_CHUNK, поэтому records может быть генератором по
+    файлу любого размера. Число записей - count или len(records).
+    """
+    if count is None:
+        count = len(records)
+    table_end = _HEADER.size + (count + 1) * _OFFSET.size
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0, count, *signature))
+            # Первое смещение - 0: оно уже в первой порции таблицы
+            offsets = array("Q", [0])
+            flushed = 0
+            position = 0
+            written = 0
+            f.seek(table_end)
+            for record in records:
+                data = _pack(record)
+                f.write(data)
+                position += len(data)
+                written += 1
+                offsets.append(position)
+                if len(offsets) >= _OFFSETS_CHUNK:
+                    _write_offsets(f, offsets, flushed, table_end + position)
+                    flushed += len(offsets)
+                    offsets = array("Q")
+            if written != count:
+                raise ValueError(f"{path}: ожидалось {count} записей, получено {written}")
+            _write_offsets(f, offsets, flushed, table_end + position)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def _write_offsets(f: BinaryIO, offsets: array, first: int, end: int):
+    # Таблица смещений лежит перед записями: дописываем порцию на её место
+    # и возвращаемся в конец файла
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    f.seek(_HEADER.size + first * _OFFSET.size)
+    f.write(offsets.tobytes())
+    f.seek(end)
+
+
+class PoolIndex(Sequence[ProxyRecord]):
+    """Записи пула, читаемые из отображённого в память .pidx по требованию.
+
+    Ведёт себя как неизменяемый кортеж ProxyRecord: len(), индекс, срез,
+    итерация. Запись декодируется при каждом обращении, поэтому в памяти
+    процесса не держится список строк всего пула.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise ValueError(f"{path}: файл индекса повреждён")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, mtime_ns, source_size = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path}: неподдерживаемый формат индекса")
+        self.path = path
+        self.signature: Signature = (mtime_ns, source_size)
+        self._count = count
+        self._data = _HEADER.size + (count + 1) * _OFFSET.size
+        if self._data + self._offset(count) > size:
+            self._mm.close()
+            raise ValueError(f"{path}: файл индекса повреждён")
+
+    def _offset(self, index: int) -> int:
+        return _OFFSET.unpack_from(self._mm, _HEADER.size + index * _OFFSET.size)[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(*index.indices(self._count)))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("индекс записи вне пула")
+
+        position = self._data + self._offset(index)
+        port, *lengths = _RECORD.unpack_from(self._mm, position)
+        position += _RECORD.size
+        fields = []
+        for length in lengths:
+            fields.append(self._mm[position:position + length].decode("utf-8", "surrogatepass"))
+            position += length
+        protocol, host, uuid, transport, security, sni, remark, uri = fields
+        return ProxyRecord(protocol, host, port, uuid, transport, security, sni, remark, uri)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def column(self, name: str) -> Iterator:
+        """Значения одного поля всех записей по порядку; остальные поля не декодируются"""
+        if name == "port":
+            for index in range(self._count):
+                yield _RECORD.unpack_from(self._mm, self._data + self._offset(index))[0]
+            return
+        field = _FIELDS.index(name)
+        for index in range(self._count):
+            position = self._data + self._offset(index)
+            lengths = _RECORD.unpack_from(self._mm, position)[1:]
+            start = position + _RECORD.size + sum(lengths[:field])
+            yield self._mm[start:start + lengths[field]].decode("utf-8", "surrogatepass")
+
+    def close(self):
+        self._mm.close()
+
+
+def column(records: Sequence[ProxyRecord], name: str) -> Iterator:
+    """Значения поля name всех записей пула; из индекса читается только это поле"""
+    if isinstance(records, PoolIndex):
+        return records.column(name)
+    return (getattr(record, name) for record in records)
+
+
+def endpoints(records: Sequence[ProxyRecord]) -> Iterator[Tuple[str, int]]:
+    """Адреса (host, port) записей пула по порядку"""
+    return zip(column(records, "host"), column(records, "port"))
+
+
+def open_index(path: str, signature: Signature) -> Optional[PoolIndex]:
+    """Открывает индекс, если он есть и построен по текущей версии исходного файла"""
+    try:
+        index = PoolIndex(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        logging.warning(f"Индекс {path} не читается и будет перестроен: {e}")
+        return None
+    if index.signature != signature:
+        index.close()
+        return None
+    return index
+
+
+def compile_file(folder: str, file_name: str) -> int:
+    """Строит индекс для файла пула; возвращает число записей"""
+    file_path = os.path.join(folder, file_name)
+    stat = os.stat(file_path)
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        records, _, _ = parse_proxy_lines(f)
+    return write_index(index_path(folder, file_name), records, (stat.st_mtime_ns, stat.st_size))
+
+
+def compile_folder(folder: str) -> int:
+    """Строит индексы для всех .txt в папке пула; возвращает число файлов"""
+    compiled = 0
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(".txt") and not file_name.startswith("."):
+            count = compile_file(folder, file_name)
+            logging.info(f"{file_name}: {count} записей -> {index_path(folder, file_name)}")
+            compiled += 1
+    return compiled
+
+
+if __name__ == "__main__":
+    # python pool_index.py [папка] - заранее собрать индексы, например при деплое
+    from config import PROXY_FOLDER
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    compile_folder(sys.argv[1] if len(sys.argv) > 1 else PROXY_FOLDER)
@@ -1,3 +1,8 @@
+import time
+
+# Момент запуска процесса - точка отсчёта для замера времени старта
+BOOT_STARTED = time.perf_counter()
+
 import sys
 import os
 import logging
@@ -12,9 +17,9 @@ from aiogram.types import BotCommand
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from config import API_TOKEN
-from database import init_db, migrate_db
 from handlers import setup_handlers
-from utils import init_proxy_files
+from lifecycle import startup, serve, shutdown as stop_services, ReadinessMiddleware
+from sender import outbound, OutboundMiddleware
 
 # Инициализация хранилища состояний
 storage = MemoryStorage()
@@ -36,6 +41,14 @@ async def set_main_menu(bot: Bot):
     ]
     await bot.set_my_commands(main_menu_commands)
 
+def create_dispatcher(boot_started: float = BOOT_STARTED) -> Dispatcher:
+    dp = Dispatcher(storage=storage)
+    # Шлюз готовности и обработчики регистрируются до инициализации: опрос
+    # начинается сразу, обновления дожидаются окончания startup()
+    dp.update.outer_middleware(ReadinessMiddleware(boot_started))
+    setup_handlers(dp)
+    return dp
+
 # Запуск бота
 async def main():
     # Настройка логирования
@@ -44,16 +57,6 @@ async def main():
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
     
-    # Инициализация базы данных и файлов прокси
-    init_db()
-    migrate_db()
-    init_proxy_files()
-    
-    # Проверка доступности прокси-файлов
-    from database import load_proxy_files
-    proxy_files = load_proxy_files()
-    logging.info(f"Загружено {len(proxy_files)} файлов прокси")
-    
     # Проверка администратора
     from config import ADMIN_CHAT_ID
     logging.info(f"ID администратора: {ADMIN_CHAT_ID}")
@@ -63,13 +66,9 @@ async def main():
         token=API_TOKEN, 
         parse_mode=ParseMode.HTML
     )
-    dp = Dispatcher(storage=storage)
-    
-    # Устанавливаем главное меню команд
-    await set_main_menu(bot)
-    
-    # Настройка обработчиков
-    setup_handlers(dp)
+    # Все запросы к Bot API (и ответы хендлеров) идут через очередь с лимитами
+    bot.session.middleware(OutboundMiddleware(outbound))
+    dp = create_dispatcher()
     
     # Настройка обработчиков сигналов
     loop = asyncio.get_event_loop()
@@ -81,12 +80,15 @@ async def main():
         session = bot.session
         session.timeout = 60.0  # 60 секунд таймаут
         
-        logging.info("Запуск бота...")
-        await dp.start_polling(bot, skip_updates=True)
+        logging.info(f"Запуск бота... (до опроса обновлений {time.perf_counter() - BOOT_STARTED:.2f} с)")
+        # Однократная инициализация (БД, прокси-файлы, фоновые сервисы)
+        # идёт параллельно с опросом обновлений и установкой меню команд
+        await serve(bot, dp, asyncio.gather(startup(bot), set_main_menu(bot)), skip_updates=True)
     except Exception as e:
         logging.error(f"Критическая ошибка: {e}")
         raise
     finally:
+        await stop_services()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+from config import POOL_INDEX_ENABLED, PROXY_FOLDER
+from pool_index import PoolIndex, index_path, open_index, write_index
+from proxy_parser import ProxyRecord, parse_proxy_lines, parse_proxy_uri
+
+# Сколько секунд заменённый индекс остаётся открытым: потоки, начавшие обход
+# записей до замены, успевают его закончить. Кэши выбора (балансировщик,
+# страны, множества выданных) только сравнивают с ним новые записи по `is`
+RETIRED_INDEX_GRACE = 60.0
+
+
+class _PoolEntry:
+    __slots__ = ("signature", "proxies")
+
+    def __init__(self, signature: Tuple[int, int], proxies: Sequence[ProxyRecord]):
+        self.signature = signature
+        self.proxies = proxies
+
+
+class ProxyPool:
+    """Разобранные прокси-файлы в памяти.
+
+    Каждый файл читается и разбирается один раз: в памяти хранится кортеж
+    проверенных записей ProxyRecord без комментариев, некорректных строк и
+    дубликатов. При обращении проверяется только os.stat: файл
+    перечитывается, если изменились mtime или размер, либо после явного
+    invalidate().
+
+    С use_index записи читаются из скомпилированного .pidx (pool_index.py)
+    через mmap: при старте индекс только открывается, а разбор .txt нужен
+    лишь когда индекса нет или он построен по другой версии файла.
+    Заменённый индекс закрывается (mmap и дескриптор) через
+    RETIRED_INDEX_GRACE секунд после замены.
+    """
+
+    def __init__(self, folder: str, use_index: bool = False):
+        self.folder = folder
+        self.use_index = use_index
+        self._entries: Dict[str, _PoolEntry] = {}
+        # (момент закрытия, индекс) заменённых индексов в порядке замены
+        self._retired: List[Tuple[float, PoolIndex]] = []
+        self._lock = threading.Lock()
+        # Недоступные по последней проверке адреса (host, port); заменяется
+        # целиком, поэтому читается без блокировки
+        self._unhealthy: FrozenSet[Tuple[str, int]] = frozenset()
+
+    def _load(self, file_name: str, signature: Tuple[int, int]) -> Sequence[ProxyRecord]:
+        file_path = os.path.join(self.folder, file_name)
+        if not self.use_index:
+            return self._parse(file_path)
+
+        index = open_index(index_path(self.folder, file_name), signature)
+        if index is not None:
+            return index
+        return self._compile(file_name, self._parse(file_path), signature)
+
+    def _compile(self, file_name: str, records: Tuple[ProxyRecord, ...],
+                 signature: Tuple[int, int]) -> Sequence[ProxyRecord]:
+        # Если индекс не записать (например, папка только для чтения), пул
+        # остаётся в памяти как раньше
+        path = index_path(self.folder, file_name)
+        try:
+            write_index(path, records, signature)
+        except OSError as e:
+            logging.warning(f"Не удалось записать индекс {path}: {e}")
+            return records
+        index = open_index(path, signature)
+        return index if index is not None else records
+
+    def _replace(self, file_name: str, entry: Optional[_PoolEntry]):
+        # Вызывается под self._lock
+        old = self._entries.pop(file_name, None)
+        if entry is not None:
+            self._entries[file_name] = entry
+        now = time.monotonic()
+        retired = old.proxies if old is not None else None
+        if isinstance(retired, PoolIndex) and (entry is None or entry.proxies is not retired):
+            self._retired.append((now + RETIRED_INDEX_GRACE, retired))
+        self._close_retired(now)
+
+    def _close_retired(self, now: float):
+        while self._retired and self._retired[0][0] <= now:
+            _, index = self._retired.pop(0)
+            index.close()
+
+    def _parse(self, file_path: str) -> Tuple[ProxyRecord, ...]:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            records, invalid, duplicates = parse_proxy_lines(f)
+        if invalid or duplicates:
+            logging.warning(
+                f"Файл {os.path.basename(file_path)}: пропущено {invalid} некорректных строк "
+                f"и {duplicates} дубликатов"
+            )
+        return tuple(records)
+
+    def get(self, file_name: str) -> Sequence[ProxyRecord]:
+        """Возвращает прокси файла, перечитывая его только при изменении"""
+        file_path = os.path.join(self.folder, file_name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            self.invalidate(file_name)
+            return ()
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(file_name)
+        if entry is not None and entry.signature == signature:
+            if self._retired and self._retired[0][0] <= time.monotonic():
+                with self._lock:
+                    self._close_retired(time.monotonic())
+            return entry.proxies
+
+        with self._lock:
+            # Файл мог быть перечитан другим потоком, пока мы ждали блокировку
+            entry = self._entries.get(file_name)
+            if entry is not None and entry.signature == signature:
+                return entry.proxies
+            try:
+                proxies = self._load(file_name, signature)
+            except FileNotFoundError:
+                self._replace(file_name, None)
+                return ()
+            self._replace(file_name, _PoolEntry(signature, proxies))
+            logging.info(f"Загружено {len(proxies)} прокси из файла {file_name}")
+            return proxies
+
+    def install(self, file_name: str, count: int):
+        """Подхватывает только что записанный файл из count проверенных записей.
+
+        Строки файла уже проверены и без дубликатов, поэтому индекс строится
+        потоком по файлу, без списка записей в памяти.
+        """
+        file_path = os.path.join(self.folder, file_name)
+        stat = os.stat(file_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        proxies = None
+        if self.use_index:
+            path = index_path(self.folder, file_name)
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    write_index(path, (parse_proxy_uri(line.strip()) for line in f), signature, count)
+                proxies = open_index(path, signature)
+            except OSError as e:
+                logging.warning(f"Не удалось записать индекс {path}: {e}")
+        if proxies is None:
+            proxies = self._parse(file_path)
+        with self._lock:
+            self._replace(file_name, _PoolEntry(signature, proxies))
+
+    @property
+    def has_unhealthy(self) -> bool:
+        return bool(self._unhealthy)
+
+    def is_healthy(self, record: ProxyRecord) -> bool:
+        """Адрес записи не помечен недоступным (непроверенные считаются живыми)"""
+        return (record.host, record.port) not in self._unhealthy
+
+    def is_endpoint_healthy(self, endpoint: Tuple[str, int]) -> bool:
+        """То же по адресу (host, port), без декодирования записи"""
+        return endpoint not in self._unhealthy
+
+    def set_unhealthy(self, endpoints: FrozenSet[Tuple[str, int]]):
+        """Заменяет набор недоступных адресов результатами новой проверки"""
+        self._unhealthy = endpoints
+
+    def invalidate(self, file_name: Optional[str] = None):
+        """Сбрасывает кэш одного файла или всего пула"""
+        with self._lock:
+            for name in list(self._entries) if file_name is None else [file_name]:
+                self._replace(name, None)
+
+
+proxy_pool = ProxyPool(PROXY_FOLDER, POOL_INDEX_ENABLED)
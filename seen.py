@@ -0,0 +1,349 @@
+import hashlib
+import itertools
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence, Set, Tuple, Union
+from config import PROXY_NO_REPEAT, SEEN_CACHE_SIZE
+from pool_index import PoolIndex, column
+from proxy_parser import ProxyRecord
+
+# Контейнер хранит младшие 16 бит индексов одного блока из 65536 записей:
+# до ARRAY_LIMIT значений - отсортированный array('H') (2 байта на индекс),
+# больше - битовая карта на 8 КБ, как в roaring bitmap
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 65536 // 8
+
+_KIND_ARRAY = 0
+_KIND_BITMAP = 1
+_HEADER = struct.Struct("<I")
+_CONTAINER = struct.Struct("<HBI")
+_INDEX_VERSION = struct.Struct("<Iqq")
+_HASH_MASK = (1 << 64) - 1
+
+
+def _lowest_zero(bits: int) -> int:
+    return (~bits & (bits + 1)).bit_length() - 1
+
+
+def _bitmap_next_unset(bitmap: bytearray, low: int) -> Optional[int]:
+    byte = low >> 3
+    # В первом байте биты ниже low считаются занятыми
+    bits = bitmap[byte] | ((1 << (low & 7)) - 1)
+    if bits != 0xFF:
+        return byte << 3 | _lowest_zero(bits)
+    rest = bitmap[byte + 1:]
+    byte += 1 + len(rest) - len(rest.lstrip(b"\xff"))
+    if byte >= len(bitmap):
+        return None
+    return byte << 3 | _lowest_zero(bitmap[byte])
+
+
+def _array_next_unset(values: array, low: int) -> Optional[int]:
+    position = bisect_left(values, low)
+    # В отсортированном массиве без повторов values[i] - i не убывает и
+    # остаётся равным low - position до первого разрыва после low
+    offset = low - position
+    lo, hi = position, len(values)
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if values[middle] - middle == offset:
+            lo = middle + 1
+        else:
+            hi = middle
+    found = offset + lo
+    return found if found <= 0xFFFF else None
+
+
+class CompactBitmap:
+    """Сжатое множество индексов записей пула"""
+
+    __slots__ = ("_containers", "_size")
+
+    def __init__(self):
+        self._containers: Dict[int, Union[array, bytearray]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] >> (low & 7) & 1)
+        position = bisect_left(container, low)
+        return position < len(container) and container[position] == low
+
+    def add(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            container = self._containers[high] = array('H')
+
+        if isinstance(container, bytearray):
+            mask = 1 << (low & 7)
+            if not container[low >> 3] & mask:
+                container[low >> 3] |= mask
+                self._size += 1
+            return
+
+        position = bisect_left(container, low)
+        if position < len(container) and container[position] == low:
+            return
+        container.insert(position, low)
+        self._size += 1
+        if len(container) > ARRAY_LIMIT:
+            bitmap = bytearray(BITMAP_BYTES)
+            for item in container:
+                bitmap[item >> 3] |= 1 << (item & 7)
+            self._containers[high] = bitmap
+
+    def next_unset(self, start: int) -> int:
+        """Наименьшее значение >= start, которого нет в множестве.
+
+        Битовая карта просматривается целыми байтами, массив - двоичным
+        поиском первого разрыва, поэтому длинные серии выданных индексов
+        пропускаются без проверки каждого.
+        """
+        value = start
+        while True:
+            high = value >> 16
+            container = self._containers.get(high)
+            if container is None:
+                return value
+            low = value & 0xFFFF
+            if isinstance(container, bytearray):
+                found = _bitmap_next_unset(container, low)
+            else:
+                found = _array_next_unset(container, low)
+            if found is not None:
+                return (high << 16) | found
+            value = (high + 1) << 16
+
+    def clear(self):
+        self._containers.clear()
+        self._size = 0
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(len(self._containers))]
+        for high, container in sorted(self._containers.items()):
+            if isinstance(container, bytearray):
+                parts.append(_CONTAINER.pack(high, _KIND_BITMAP, BITMAP_BYTES))
+                parts.append(bytes(container))
+            else:
+                if sys.byteorder != "little":
+                    container = array('H', container)
+                    container.byteswap()
+                parts.append(_CONTAINER.pack(high, _KIND_ARRAY, len(container)))
+                parts.append(container.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CompactBitmap":
+        bitmap = cls()
+        (count,), offset = _HEADER.unpack_from(data), _HEADER.size
+        for _ in range(count):
+            high, kind, length = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == _KIND_BITMAP:
+                container = bytearray(data[offset:offset + length])
+                offset += length
+                bitmap._size += sum(bin(byte).count("1") for byte in container)
+            else:
+                container = array('H')
+                container.frombytes(data[offset:offset + length * 2])
+                if sys.byteorder != "little":
+                    container.byteswap()
+                offset += length * 2
+                bitmap._size += len(container)
+            bitmap._containers[high] = container
+        return bitmap
+
+
+class _PoolInfo:
+    __slots__ = ("records", "fingerprint", "_hashes", "_indices")
+
+    def __init__(self, records: Sequence[ProxyRecord]):
+        self.records = records
+        digest = hashlib.blake2b(digest_size=16)
+        if isinstance(records, PoolIndex):
+            # Содержимое индекса определяется версией исходного файла из его
+            # заголовка, поэтому записи не перебираются
+            digest.update(_INDEX_VERSION.pack(len(records), *records.signature))
+        else:
+            for uri in column(records, "uri"):
+                digest.update(uri.encode())
+                digest.update(b"\n")
+        self.fingerprint = digest.digest()
+        self._hashes: Optional[array] = None
+        self._indices: Optional[array] = None
+
+    def position(self, uri: str) -> Optional[int]:
+        # Поиск URI -> индекс нужен только для восстановления из истории.
+        # Вместо словаря по всем записям - отсортированные хэши URI и индексы
+        # записей (12 байт на запись); совпадение хэша проверяется по записи
+        if self._hashes is None:
+            hashes = array('Q', (hash(uri) & _HASH_MASK for uri in column(self.records, "uri")))
+            order = sorted(range(len(hashes)), key=hashes.__getitem__)
+            self._indices = array('I', order)
+            self._hashes = array('Q', (hashes[index] for index in order))
+        value = hash(uri) & _HASH_MASK
+        position = bisect_left(self._hashes, value)
+        while position < len(self._hashes) and self._hashes[position] == value:
+            index = self._indices[position]
+            if self.records[index].uri == uri:
+                return index
+            position += 1
+        return None
+
+
+class _UserSeen:
+    __slots__ = ("fingerprint", "bitmap")
+
+    def __init__(self, fingerprint: bytes, bitmap: CompactBitmap):
+        self.fingerprint = fingerprint
+        self.bitmap = bitmap
+
+
+class SeenTracker:
+    """Уже выданные пользователю записи каждого файла.
+
+    Множество индексов хранится в памяти (LRU на cache_size пар
+    пользователь/файл) и в таблице user_seen вместе с отпечатком пула.
+    Изменённые множества записываются пакетом в flush(), а не при каждой
+    выдаче. Если файл изменился и индексы сдвинулись, множество один раз
+    восстанавливается из proxy_history и ещё не записанной истории.
+    """
+
+    def __init__(self, enabled: bool, cache_size: int):
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[int, str], _UserSeen]" = OrderedDict()
+        self._pools: Dict[str, _PoolInfo] = {}
+        # Пары пользователь/файл, изменённые после последней записи в БД
+        self._dirty: Set[Tuple[int, str]] = set()
+        # Вытесненные из кэша множества, запись которых откатилась
+        self._unsaved: Dict[Tuple[int, str], _UserSeen] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, file_name: str, records: Tuple[ProxyRecord, ...]) -> _PoolInfo:
+        info = self._pools.get(file_name)
+        if info is None or info.records is not records:
+            info = self._pools[file_name] = _PoolInfo(records)
+        return info
+
+    def _rebuild(self, conn, user_id: int, file_name: str, info: _PoolInfo,
+                 pending: Iterable[Tuple[str, str]]) -> CompactBitmap:
+        # В истории файл записан под отображаемым именем (как при выдаче),
+        # поэтому записи других файлов с тем же URI не учитываются
+        row = conn.execute("SELECT display_name FROM proxy_files WHERE file_name = ?", (file_name,)).fetchone()
+        proxy_type = row[0] if row is not None else file_name
+        bitmap = CompactBitmap()
+        rows = conn.execute("SELECT proxy FROM proxy_history WHERE user_id = ? AND proxy_type = ?",
+                            (user_id, proxy_type))
+        pending_proxies = (proxy for proxy, pending_type in pending if pending_type == proxy_type)
+        for proxy in itertools.chain((row[0] for row in rows), pending_proxies):
+            position = info.position(proxy)
+            if position is not None:
+                bitmap.add(position)
+        return bitmap
+
+    def get(self, conn, user_id: int, file_name: str, records: Tuple[ProxyRecord, ...],
+            pending: Iterable[Tuple[str, str]] = ()) -> CompactBitmap:
+        """Множество выданных пользователю индексов файла.
+
+        pending - ещё не попавшие в proxy_history выдачи пользователя (URI,
+        proxy_type); перебираются, только если множество восстанавливается.
+        """
+        with self._lock:
+            info = self._pool(file_name, records)
+            key = (user_id, file_name)
+            entry = self._cache.get(key)
+            if entry is not None and entry.fingerprint == info.fingerprint:
+                self._cache.move_to_end(key)
+                return entry.bitmap
+
+            unsaved = self._unsaved.pop(key, None)
+            if unsaved is not None and unsaved.fingerprint == info.fingerprint:
+                # Множество вытеснено, пока его запись откатывалась: в БД оно устарело
+                bitmap = unsaved.bitmap
+                self._dirty.add(key)
+            else:
+                row = conn.execute('''SELECT fingerprint, bitmap FROM user_seen
+                                      WHERE user_id = ? AND file_name = ?''', key).fetchone()
+                if row is not None and row[0] == info.fingerprint:
+                    bitmap = CompactBitmap.from_bytes(row[1])
+                else:
+                    bitmap = self._rebuild(conn, user_id, file_name, info, pending)
+
+            self._cache[key] = _UserSeen(info.fingerprint, bitmap)
+            if len(self._cache) > self.cache_size:
+                # Вытесняемое множество с незаписанными изменениями сохраняется сразу
+                evicted_key, evicted = self._cache.popitem(last=False)
+                if evicted_key in self._dirty:
+                    self._dirty.discard(evicted_key)
+                    self._save(conn, *evicted_key, evicted)
+            return bitmap
+
+    def _save(self, conn, user_id: int, file_name: str, entry: _UserSeen):
+        conn.execute('''INSERT OR REPLACE INTO user_seen (user_id, file_name, fingerprint, bitmap)
+                        VALUES (?, ?, ?, ?)''', (user_id, file_name, entry.fingerprint, entry.bitmap.to_bytes()))
+
+    def mark(self, user_id: int, file_name: str, index: int):
+        """Отмечает выданную запись; вызывается после get() для того же файла"""
+        with self._lock:
+            entry = self._cache.get((user_id, file_name))
+            if entry is None:
+                return
+            entry.bitmap.add(index)
+            self._dirty.add((user_id, file_name))
+
+    def reset(self, user_id: int, file_name: str):
+        """Начинает новый круг: пользователь получил все записи файла"""
+        with self._lock:
+            entry = self._cache.get((user_id, file_name))
+            if entry is not None:
+                entry.bitmap.clear()
+                self._dirty.add((user_id, file_name))
+
+    def flush(self, conn):
+        """Записывает изменённые множества одним executemany.
+
+        Возвращает функцию, которая снова помечает их изменёнными, если
+        транзакция будет откачена (см. WriteBehindQueue.defer).
+        """
+        with self._lock:
+            keys, self._dirty = self._dirty, set()
+            entries = {key: self._cache[key] for key in keys if key in self._cache}
+            entries.update(self._unsaved)
+            self._unsaved = {}
+            rows = [
+                (user_id, file_name, entry.fingerprint, entry.bitmap.to_bytes())
+                for (user_id, file_name), entry in entries.items()
+            ]
+        restore = lambda: self._restore(entries)
+        if rows:
+            try:
+                conn.executemany('''INSERT OR REPLACE INTO user_seen (user_id, file_name, fingerprint, bitmap)
+                                    VALUES (?, ?, ?, ?)''', rows)
+            except Exception:
+                restore()
+                raise
+        return restore
+
+    def _restore(self, entries: Dict[Tuple[int, str], _UserSeen]):
+        # Множество, которое успели вытеснить из кэша, хранится до следующего flush()
+        with self._lock:
+            for key, entry in entries.items():
+                if key in self._cache:
+                    self._dirty.add(key)
+                else:
+                    self._unsaved.setdefault(key, entry)
+
+seen_tracker = SeenTracker(PROXY_NO_REPEAT, SEEN_CACHE_SIZE)
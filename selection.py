@@ -0,0 +1,337 @@
+import heapq
+import random
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from balancer import balancer
+from pool_index import endpoints
+from proxy_parser import ProxyRecord
+
+# Режимы выдачи прокси из файла (колонка proxy_files.selection_mode)
+SELECTION_MODES = {
+    "round_robin": "По кругу",
+    "weighted": "Случайно с весом по задержке и доступности",
+    "lru": "Давно не выдававшиеся",
+    "p2c": "Лучший из двух случайных",
+    "balanced": "Наименее загруженный сервер (host:port)",
+}
+DEFAULT_MODE = "round_robin"
+
+# Задержка, которая считается для ещё не проверенных адресов, в секундах
+DEFAULT_RTT = 0.5
+
+# Коэффициент сглаживания EWMA для задержки и доли успешных проверок
+EWMA_ALPHA = 0.3
+
+# Сколько пар перебирает p2c, прежде чем выдать недоступную запись
+P2C_ATTEMPTS = 8
+
+# Сколько кандидатов режима выбора может отклонить фильтр до поиска по кругу
+PICK_ATTEMPTS = 16
+
+Endpoint = Tuple[str, int]
+
+
+class EndpointStats:
+    """Сглаженные результаты проверок одного адреса (host, port)"""
+
+    __slots__ = ("rtt", "success", "alive")
+
+    def __init__(self):
+        self.rtt: Optional[float] = None
+        self.success = 1.0
+        self.alive = True
+
+    def observe(self, rtt: Optional[float]):
+        """Учитывает результат проверки: rtt в секундах или None при ошибке"""
+        self.alive = rtt is not None
+        self.success += EWMA_ALPHA * (float(self.alive) - self.success)
+        if rtt is not None:
+            self.rtt = rtt if self.rtt is None else self.rtt + EWMA_ALPHA * (rtt - self.rtt)
+
+    @property
+    def weight(self) -> float:
+        if not self.alive:
+            return 0.0
+        return self.success / max(self.rtt if self.rtt is not None else DEFAULT_RTT, 0.001)
+
+
+class FenwickTree:
+    """Дерево Фенвика над весами: изменение веса и выбор по префиксной сумме за O(log n)"""
+
+    def __init__(self, weights: Sequence[float]):
+        self.size = len(weights)
+        # Массивы double вместо списков: 8 байт на запись без объектов float
+        self._tree = array('d', bytes(8 * (self.size + 1)))
+        self._weights = array('d', weights)
+        for i, weight in enumerate(self._weights, 1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(self._weights)
+
+    def set(self, index: int, weight: float):
+        delta = weight - self._weights[index]
+        if not delta:
+            return
+        self._weights[index] = weight
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value: float) -> int:
+        """Индекс элемента, на который приходится префиксная сумма value"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            candidate = position + step
+            if candidate <= self.size and self._tree[candidate] <= value:
+                position = candidate
+                value -= self._tree[candidate]
+            step >>= 1
+        return min(position, self.size - 1)
+
+
+class _Strategy(ABC):
+    """Состояние выбора для одного файла; строится заново при смене его содержимого.
+
+    Выбор разделён на два шага: candidates() только предлагает индексы и
+    ничего не меняет, а commit(index) учитывает выдачу. Так кандидаты,
+    отклонённые фильтром (аренда, уже выданные), не сдвигают очередь.
+    """
+
+    def __init__(self, records: Sequence[ProxyRecord], stats: Dict[Endpoint, EndpointStats]):
+        self.records = records
+        self.stats = stats
+
+    def endpoint_weight(self, endpoint: Endpoint) -> float:
+        stats = self.stats.get(endpoint)
+        return stats.weight if stats is not None else 1.0 / DEFAULT_RTT
+
+    def weight(self, index: int) -> float:
+        record = self.records[index]
+        return self.endpoint_weight((record.host, record.port))
+
+    def updated(self, endpoint: Endpoint):
+        """Вызывается после нового измерения адреса"""
+
+    @abstractmethod
+    def candidates(self) -> Iterator[int]:
+        """Индексы в порядке предпочтения; не меняет состояние"""
+
+    def commit(self, index: int):
+        """Учитывает выдачу записи index"""
+
+
+class WeightedStrategy(_Strategy):
+    """Случайный выбор с вероятностью, пропорциональной доле успехов / RTT"""
+
+    def __init__(self, records, stats):
+        super().__init__(records, stats)
+        # Индексы записей по адресам - чтобы обновлять веса после проверки;
+        # из индекса пула читаются только host и port
+        self.by_endpoint: Dict[Endpoint, array] = {}
+        weights = array('d')
+        for index, endpoint in enumerate(endpoints(records)):
+            bucket = self.by_endpoint.get(endpoint)
+            if bucket is None:
+                bucket = self.by_endpoint[endpoint] = array('I')
+            bucket.append(index)
+            weights.append(self.endpoint_weight(endpoint))
+        self.tree = FenwickTree(weights)
+
+    def updated(self, endpoint: Endpoint):
+        weight = self.endpoint_weight(endpoint)
+        for index in self.by_endpoint.get(endpoint, ()):
+            self.tree.set(index, weight)
+
+    def candidates(self) -> Iterator[int]:
+        while True:
+            if self.tree.total <= 0:
+                # Все адреса недоступны - выбираем равновероятно
+                yield random.randrange(len(self.records))
+            else:
+                yield self.tree.find(random.random() * self.tree.total)
+
+
+class LruStrategy(_Strategy):
+    """Выдаётся запись, которая дольше всех не выдавалась (куча по времени выдачи).
+
+    Ещё не выдававшиеся записи идут первыми по порядку файла и в куче не
+    хранятся: в неё попадают только выданные. Выдача не извлекает элемент,
+    а добавляет новый с текущим временем; элементы со старым временем
+    записи считаются устаревшими.
+    """
+
+    def __init__(self, records, stats):
+        super().__init__(records, stats)
+        self.issued_at = array('Q', bytes(8 * len(records)))
+        self.heap: List[Tuple[int, int]] = []
+        self.clock = 0
+        # Все записи до fresh уже выдавались
+        self.fresh = 0
+        self.issued = 0
+
+    def _ordered(self) -> Iterator[int]:
+        for index in range(self.fresh, len(self.records)):
+            if not self.issued_at[index]:
+                yield index
+        # Обход кучи по возрастанию без извлечения: вспомогательная куча
+        # из позиций, у которых уже просмотрен родитель
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier:
+            (issued_at, index), position = heapq.heappop(frontier)
+            if issued_at == self.issued_at[index]:
+                yield index
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+
+    def candidates(self) -> Iterator[int]:
+        # Недоступные записи предлагаются последними, но сохраняют место в очереди
+        skipped = []
+        for index in self._ordered():
+            if self.weight(index) > 0:
+                yield index
+            else:
+                skipped.append(index)
+        yield from skipped
+
+    def commit(self, index: int):
+        self.clock += 1
+        if not self.issued_at[index]:
+            self.issued += 1
+        self.issued_at[index] = self.clock
+        while self.fresh < len(self.records) and self.issued_at[self.fresh]:
+            self.fresh += 1
+        heapq.heappush(self.heap, (self.clock, index))
+        if len(self.heap) > 2 * self.issued:
+            self.heap = [(issued_at, i) for i, issued_at in enumerate(self.issued_at) if issued_at]
+            heapq.heapify(self.heap)
+
+
+class PowerOfTwoStrategy(_Strategy):
+    """Из двух случайных записей выбирается лучшая по весу с учётом числа выдач"""
+
+    def __init__(self, records, stats):
+        super().__init__(records, stats)
+        self.issued = array('I', bytes(4 * len(records)))
+
+    def _score(self, index: int) -> float:
+        return self.weight(index) / (1 + self.issued[index])
+
+    def candidates(self) -> Iterator[int]:
+        while True:
+            # Если обе записи недоступны, пробуем ещё несколько пар
+            for _ in range(P2C_ATTEMPTS):
+                first = random.randrange(len(self.records))
+                second = random.randrange(len(self.records))
+                index = first if self._score(first) >= self._score(second) else second
+                if self.weight(index) > 0:
+                    break
+            yield index
+
+    def commit(self, index: int):
+        self.issued[index] += 1
+
+
+def choose(candidates: Iterator[int], size: int, usable: Optional[Callable[[int], bool]]) -> Optional[int]:
+    """Первый кандидат, для которого usable(index) истинно.
+
+    Перебирается не больше PICK_ATTEMPTS кандидатов, затем ищется ближайшая
+    подходящая запись по кругу от первого из них.
+    """
+    first = next(candidates, None)
+    if first is None or usable is None:
+        return first
+    index = first
+    for _ in range(PICK_ATTEMPTS):
+        if usable(index):
+            return index
+        index = next(candidates, None)
+        if index is None:
+            break
+    for step in range(1, size):
+        candidate = (first + step) % size
+        if usable(candidate):
+            return candidate
+    return None
+
+
+_STRATEGIES = {
+    "weighted": WeightedStrategy,
+    "lru": LruStrategy,
+    "p2c": PowerOfTwoStrategy,
+}
+
+
+class ProxySelector:
+    """Выбор записи для файлов с режимом, отличным от round_robin.
+
+    Режим файла задаётся из каталога (proxy_files.selection_mode), измерения
+    поступают от проверки доступности и обновляют веса инкрементально,
+    без перестроения структур.
+    """
+
+    def __init__(self):
+        self._modes: Dict[str, str] = {}
+        self._stats: Dict[Endpoint, EndpointStats] = {}
+        self._strategies: Dict[str, _Strategy] = {}
+        self._lock = threading.Lock()
+
+    def set_modes(self, modes: Dict[str, str]):
+        with self._lock:
+            self._modes = {
+                name: mode for name, mode in modes.items()
+                if mode in SELECTION_MODES and mode != DEFAULT_MODE
+            }
+            self._strategies = {
+                name: strategy for name, strategy in self._strategies.items()
+                if type(strategy) is _STRATEGIES.get(self._modes.get(name))
+            }
+
+    def mode(self, file_name: str) -> str:
+        return self._modes.get(file_name, DEFAULT_MODE)
+
+    def observe(self, results: Dict[Endpoint, Optional[float]]):
+        """Учитывает результаты проверки: адрес -> RTT в секундах или None"""
+        with self._lock:
+            for endpoint, rtt in results.items():
+                stats = self._stats.get(endpoint)
+                if stats is None:
+                    stats = self._stats[endpoint] = EndpointStats()
+                stats.observe(rtt)
+                for strategy in self._strategies.values():
+                    strategy.updated(endpoint)
+
+    def pick(self, file_name: str, records: Tuple[ProxyRecord, ...], user_id: Optional[int] = None,
+             usable: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """Индекс следующей записи файла, для которой usable(index) истинно.
+
+        None - подходящих записей нет или файл выдаётся по кругу (mode()).
+        Выдача учитывается только для возвращённого индекса.
+        """
+        mode = self.mode(file_name)
+        if mode == "balanced":
+            # Баланс по адресам общий для всех файлов и учитывает пользователя;
+            # фильтр применяется внутри, чтобы назначить только итоговый адрес
+            return balancer.pick(file_name, records, user_id, usable)
+
+        strategy_class = _STRATEGIES.get(mode)
+        if strategy_class is None or not records:
+            return None
+        with self._lock:
+            strategy = self._strategies.get(file_name)
+            if strategy is None or strategy.records is not records:
+                strategy = self._strategies[file_name] = strategy_class(records, self._stats)
+            index = choose(strategy.candidates(), len(records), usable)
+            if index is not None:
+                strategy.commit(index)
+            return index
+
+
+selector = ProxySelector()
@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Set
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_QUEUE_SIZE
+
+# Классы приоритета: ответы пользователям отправляются раньше уведомлений админу
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+
+# Лимит Telegram для групп и каналов - 20 сообщений в минуту
+GROUP_CHAT_RATE = 20 / 60
+MAX_ATTEMPTS = 5
+MAX_CHAT_BUCKETS = 10000
+
+# Истинно внутри воркера очереди: его запросы к Bot API уже учтены лимитами
+_in_worker: ContextVar[bool] = ContextVar("outbound_worker", default=False)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "method", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, chat_id, method, args, kwargs, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Ошибка при отправке сообщения: {future.exception()}")
+
+
+class OutboundScheduler:
+    """Центральная очередь исходящих запросов к Bot API.
+
+    Соблюдает глобальный лимит и лимит на каждый чат (token bucket), отдаёт
+    приоритет ответам пользователям, сам повторяет запрос после RetryAfter и
+    ограничивает длину очереди, чтобы всплески не превращались в лавину 429.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, maxsize: int, workers: int = 4):
+        self.chat_rate = chat_rate
+        self.maxsize = maxsize
+        self.workers = workers
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._delayed: Set[asyncio.Task] = set()
+        self._inflight = 0
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # Забываем чаты, которые давно ничего не получали
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_idle(now)}
+            # Отрицательные id и @username - группы и каналы
+            rate = GROUP_CHAT_RATE if not isinstance(chat_id, int) or chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def _push(self, priority: int, job: _Job):
+        heapq.heappush(self._heap, (priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _requeue_later(self, delay: float, priority: int, job: _Job):
+        task = asyncio.create_task(self._sleep_and_push(delay, priority, job))
+        self._delayed.add(task)
+        task.add_done_callback(self._delayed.discard)
+
+    async def _sleep_and_push(self, delay: float, priority: int, job: _Job):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        self._push(priority, job)
+
+    def _enqueue(self, method, chat_id, args, kwargs, priority) -> Optional[asyncio.Future]:
+        if len(self._heap) + len(self._delayed) >= self.maxsize:
+            logging.warning(f"Очередь исходящих сообщений переполнена, сообщение в чат {chat_id} отброшено")
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._push(priority, _Job(chat_id, method, args, kwargs, future))
+        return future
+
+    def submit(self, method: Callable[..., Any], chat_id: int, *args,
+               priority: int = PRIORITY_USER, **kwargs) -> Optional[asyncio.Future]:
+        """Ставит вызов method(chat_id, *args, **kwargs) в очередь, не дожидаясь отправки.
+
+        Returns:
+            Future с результатом вызова или None, если очередь переполнена
+        """
+        future = self._enqueue(method, chat_id, args, kwargs, priority)
+        if future is not None:
+            future.add_done_callback(_log_failure)
+        return future
+
+    async def send(self, method: Callable[..., Any], chat_id: int, *args,
+                   priority: int = PRIORITY_USER, **kwargs) -> Any:
+        """Отправляет запрос через очередь и дожидается результата"""
+        future = self._enqueue(method, chat_id, args, kwargs, priority)
+        if future is None:
+            raise RuntimeError("Очередь исходящих сообщений переполнена")
+        return await future
+
+    async def _next_job(self):
+        while not self._heap:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        priority, _, job = heapq.heappop(self._heap)
+        return priority, job
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def _worker(self):
+        _in_worker.set(True)
+        while True:
+            priority, job = await self._next_job()
+            if job.future.done():
+                continue
+
+            now = time.monotonic()
+            chat_wait = self._chat_bucket(job.chat_id, now).delay(now)
+            if chat_wait > 0:
+                # Не держим воркер ради одного чата: вернём задачу в очередь позже
+                self._requeue_later(chat_wait, priority, job)
+                continue
+
+            global_wait = self._global.delay(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                now = time.monotonic()
+                self._global.delay(now)
+
+            self._global.consume()
+            self._chat_bucket(job.chat_id, now).consume()
+            job.attempts += 1
+
+            self._inflight += 1
+            try:
+                result = await job.method(job.chat_id, *job.args, **job.kwargs)
+            except TelegramRetryAfter as e:
+                now = time.monotonic()
+                self._chat_bucket(job.chat_id, now).block(now, e.retry_after)
+                if job.attempts >= MAX_ATTEMPTS:
+                    job.future.set_exception(e)
+                    continue
+                logging.warning(f"Flood control для чата {job.chat_id}, повтор через {e.retry_after} с")
+                self._requeue_later(e.retry_after, priority, job)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            finally:
+                self._inflight -= 1
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Даёт очереди опустеть (не дольше timeout секунд) и останавливает воркеры"""
+        deadline = time.monotonic() + timeout
+        while (self._heap or self._delayed or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        tasks = self._tasks + list(self._delayed)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        for _, _, job in self._heap:
+            if not job.future.done():
+                job.future.cancel()
+        self._heap = []
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Пропускает все запросы бота к Bot API через очередь отправки.
+
+    Так лимиты и приоритеты действуют и на ответы хендлеров (message.answer,
+    edit_text, answer_document), а не только на явные вызовы outbound.send.
+    Напрямую идут запросы без chat_id (getFile, answerCallbackQuery), запросы
+    самих воркеров очереди и запросы до запуска очереди.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler, priority: int = PRIORITY_USER):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or _in_worker.get() or not self.scheduler.running:
+            return await make_request(bot, method)
+        return await self.scheduler.send(lambda _: make_request(bot, method), chat_id, priority=self.priority)
+
+
+outbound = OutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_QUEUE_SIZE)
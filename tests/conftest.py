@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# Модули бота читают настройки из окружения при импорте, поэтому тестовое
+# окружение задаётся до первого импорта config. БД и папки - во временном
+# каталоге, чтобы тесты не трогали рабочие данные
+_TMP = tempfile.mkdtemp(prefix="proxy-bot-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("ADMIN_CHAT_ID", "1")
+os.environ["DB_FILE"] = os.path.join(_TMP, "bot.db")
+os.environ["PROXY_FOLDER"] = os.path.join(_TMP, "proxies")
+os.environ["MEDIA_FOLDER"] = os.path.join(_TMP, "media")
+os.environ["HEALTH_CHECK_ENABLED"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import PRAGMAS  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Соединение с теми же настройками, что у DatabasePool"""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    """Путь к новой БД в режиме WAL со всеми миграциями"""
+    path = str(tmp_path / "bot.db")
+    conn = connect(path)
+    apply_migrations(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    connection = connect(db_path)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def bot_db():
+    """БД из DB_FILE со всеми миграциями - для кода, который работает через database.db"""
+    import database
+    connection = connect(os.environ["DB_FILE"])
+    apply_migrations(connection)
+    connection.close()
+    yield database.db
+    database.db.close()
@@ -0,0 +1,162 @@
+import multiprocessing
+import threading
+from collections import Counter
+
+import pytest
+
+import database
+from conftest import connect
+
+FILE_NAME = "stress.txt"
+POOL_SIZE = 50
+WORKERS = 8
+CYCLES = 20
+# Каждый из WORKERS аллокаторов делает свою долю от CYCLES полных кругов
+PER_WORKER = POOL_SIZE * CYCLES // WORKERS
+
+
+def _allocate(db_path: str, count: int, returning: bool) -> list:
+    # Как в _get_next_proxy: сдвиг курсора идёт в транзакции writer'а, где
+    # до него уже выполнялись изменения (снятие истёкших аренд)
+    database.HAS_RETURNING = returning
+    conn = connect(db_path)
+    issued = []
+    try:
+        for _ in range(count):
+            with conn:
+                conn.execute("DELETE FROM proxy_leases WHERE expires_at < 0")
+                issued.append(database._advance_index(conn, FILE_NAME, POOL_SIZE))
+    finally:
+        conn.close()
+    return issued
+
+
+def _process_worker(db_path: str, count: int, returning: bool, results):
+    results.put(_allocate(db_path, count, returning))
+
+
+# Фильтр для _advance_index_matching: часть пула недоступна (как записи,
+# отсеянные арендой, проверкой или страной), выдаваться должны остальные
+USABLE = frozenset(index for index in range(POOL_SIZE) if index % 3 and index != 7)
+POOL = tuple(range(POOL_SIZE))
+PER_MATCHING_WORKER = len(USABLE) * CYCLES // WORKERS
+
+
+def _allocate_matching(db_path: str, count: int, expire_first: bool) -> list:
+    # С арендами транзакция writer'а открыта до сдвига курсора (снятие
+    # истёкших аренд), без них чтение курсора идёт вне транзакции
+    conn = connect(db_path)
+    issued = []
+    try:
+        for _ in range(count):
+            with conn:
+                if expire_first:
+                    conn.execute("DELETE FROM proxy_leases WHERE expires_at < 0")
+                issued.append(database._advance_index_matching(conn, FILE_NAME, POOL, USABLE.__contains__))
+    finally:
+        conn.close()
+    return issued
+
+
+def _matching_process_worker(db_path: str, count: int, expire_first: bool, results):
+    results.put(_allocate_matching(db_path, count, expire_first))
+
+
+def _assert_full_cycles(issued: list):
+    # Ни одна позиция не выдана дважды и не пропущена: за CYCLES кругов
+    # каждый индекс получен ровно CYCLES раз
+    assert len(issued) == POOL_SIZE * CYCLES
+    assert Counter(issued) == {index: CYCLES for index in range(POOL_SIZE)}
+
+
+def _assert_matching_cycles(issued: list):
+    # Недоступные записи не выдаются, доступные - без повторов и пропусков
+    assert len(issued) == len(USABLE) * CYCLES
+    assert Counter(issued) == {index: CYCLES for index in USABLE}
+
+
+@pytest.fixture(params=[True, False], ids=["returning", "update-select"])
+def returning(request, monkeypatch):
+    if request.param and not database.HAS_RETURNING:
+        pytest.skip("SQLite без RETURNING")
+    monkeypatch.setattr(database, "HAS_RETURNING", request.param)
+    return request.param
+
+
+def test_parallel_threads(db_path, returning):
+    issued = []
+    lock = threading.Lock()
+
+    def worker():
+        result = _allocate(db_path, PER_WORKER, returning)
+        with lock:
+            issued.extend(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _assert_full_cycles(issued)
+
+
+def test_parallel_processes(db_path, returning):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_process_worker, args=(db_path, PER_WORKER, returning, results))
+        for _ in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    issued = []
+    for _ in processes:
+        issued.extend(results.get(timeout=120))
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    _assert_full_cycles(issued)
+
+
+@pytest.mark.parametrize("expire_first", [True, False], ids=["in-transaction", "autocommit-read"])
+def test_matching_parallel_threads(db_path, expire_first):
+    issued = []
+    lock = threading.Lock()
+
+    def worker():
+        result = _allocate_matching(db_path, PER_MATCHING_WORKER, expire_first)
+        with lock:
+            issued.extend(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _assert_matching_cycles(issued)
+
+
+@pytest.mark.parametrize("expire_first", [True, False], ids=["in-transaction", "autocommit-read"])
+def test_matching_parallel_processes(db_path, expire_first):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_matching_process_worker,
+                        args=(db_path, PER_MATCHING_WORKER, expire_first, results))
+        for _ in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    issued = []
+    for _ in processes:
+        issued.extend(results.get(timeout=120))
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    _assert_matching_cycles(issued)
+
+
+def test_sequence_starts_after_cursor(conn, returning):
+    with conn:
+        first = [database._advance_index(conn, FILE_NAME, 3) for _ in range(4)]
+    assert first == [1, 2, 0, 1]
@@ -0,0 +1,84 @@
+import pytest
+
+from balancer import EndpointBalancer
+from proxy_parser import ProxyRecord
+from proxy_pool import proxy_pool
+
+TTL = 100.0
+
+
+def _record(i: int, host: int) -> ProxyRecord:
+    return ProxyRecord("trojan", f"10.0.1.{host}", 443, "secret", "tcp", "tls", "", str(i),
+                       f"trojan://secret@10.0.1.{host}:443#{i}")
+
+
+class _Records(tuple):
+    """Пул, запрещающий декодирование записей по индексу"""
+
+    def __getitem__(self, index):
+        raise AssertionError("запись декодирована")
+
+
+@pytest.fixture
+def unhealthy():
+    yield proxy_pool.set_unhealthy
+    proxy_pool.set_unhealthy(frozenset())
+
+
+def test_least_loaded_endpoint_is_chosen():
+    balancer = EndpointBalancer(TTL)
+    # Адрес .0 - три строки, .1 и .2 - по одной
+    records = tuple(_record(i, host) for i, host in enumerate([0, 0, 0, 1, 2]))
+    picked = [balancer.pick("pool.txt", records, user_id, now=0) for user_id in range(6)]
+    assert balancer.load(now=0) == {("10.0.1.0", 443): 2, ("10.0.1.1", 443): 2, ("10.0.1.2", 443): 2}
+    # Внутри адреса записи выдаются по кругу
+    assert sorted(picked) == [0, 1, 3, 3, 4, 4]
+
+
+def test_assignments_expire_after_ttl():
+    balancer = EndpointBalancer(TTL)
+    records = tuple(_record(i, i) for i in range(2))
+    assert balancer.pick("pool.txt", records, 1, now=0) == 0
+    assert balancer.pick("pool.txt", records, 2, now=50) == 1
+    assert balancer.load(now=99) == {("10.0.1.0", 443): 1, ("10.0.1.1", 443): 1}
+
+    # Назначение первого пользователя истекло: адрес .0 снова свободен
+    assert balancer.load(now=100) == {("10.0.1.1", 443): 1}
+    assert balancer.pick("pool.txt", records, 3, now=120) == 0
+
+    # Повторная выдача продлевает срок назначения
+    assert balancer.pick("pool.txt", records, 2, now=140) == 1
+    assert balancer.load(now=200) == {("10.0.1.0", 443): 1, ("10.0.1.1", 443): 1}
+    assert balancer.load(now=240) == {}
+
+
+def test_restore_skips_expired_assignments():
+    balancer = EndpointBalancer(TTL)
+    balancer.restore([
+        (1, "pool.txt", ("10.0.1.0", 443), 950),
+        (2, "pool.txt", ("10.0.1.1", 443), 800),
+        (3, "pool.txt", ("10.0.1.0", 443), 990),
+    ], now=1000)
+    assert balancer.load(now=1000) == {("10.0.1.0", 443): 2}
+    assert balancer.load(now=1050) == {("10.0.1.0", 443): 1}
+
+
+def test_unhealthy_endpoint_checked_without_decoding(unhealthy):
+    balancer = EndpointBalancer(TTL)
+    records = _Records(_record(i, i) for i in range(3))
+    unhealthy(frozenset({("10.0.1.0", 443)}))
+    assert balancer.pick("pool.txt", records, 1, now=0) == 1
+
+    # Недоступны все адреса - выдаётся наименее загруженный из них
+    unhealthy(frozenset({("10.0.1.0", 443), ("10.0.1.1", 443), ("10.0.1.2", 443)}))
+    assert balancer.pick("pool.txt", records, 2, now=0) in (0, 2)
+
+
+def test_release_frees_endpoint():
+    balancer = EndpointBalancer(TTL)
+    records = tuple(_record(i, i) for i in range(2))
+    assert balancer.pick("pool.txt", records, 1, now=0) == 0
+    assert balancer.pick("pool.txt", records, 2, now=0) == 1
+    balancer.release(1, "pool.txt")
+    assert balancer.load(now=0) == {("10.0.1.1", 443): 1}
+    assert balancer.pick("pool.txt", records, 3, now=0) == 0
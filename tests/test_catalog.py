@@ -0,0 +1,101 @@
+import asyncio
+import os
+
+import pytest
+
+import catalog as catalog_module
+from catalog import ProxyCatalog
+from proxy_pool import proxy_pool
+from selection import selector
+
+
+@pytest.fixture
+def pool_files():
+    os.makedirs(proxy_pool.folder, exist_ok=True)
+    names = ["catalog_a.txt", "catalog_b.txt"]
+    for name in names:
+        with open(os.path.join(proxy_pool.folder, name), "w", encoding="utf-8") as f:
+            f.write("trojan://secret@10.0.2.1:443#🇩🇪\n")
+    yield names
+    for name in names:
+        os.remove(os.path.join(proxy_pool.folder, name))
+        proxy_pool.invalidate(name)
+    selector.set_modes({})
+
+
+def _buttons(keyboard) -> list:
+    return [button.callback_data for row in keyboard.inline_keyboard for button in row]
+
+
+def test_reload_builds_menus_from_db_rows(pool_files, monkeypatch):
+    rows = [
+        {"name": "catalog_a.txt", "display": "A", "description": "", "mode": "lru"},
+        {"name": "catalog_b.txt", "display": "B", "description": "", "mode": "round_robin"},
+        # Файла нет на диске: в меню выдачи его нет, в меню скачивания - есть
+        {"name": "missing.txt", "display": "M", "description": "", "mode": "round_robin"},
+    ]
+    calls = []
+
+    async def load_proxy_files():
+        calls.append(True)
+        return list(rows)
+
+    monkeypatch.setattr(catalog_module, "load_proxy_files", load_proxy_files)
+    catalog = ProxyCatalog(proxy_pool.folder)
+
+    assert asyncio.run(catalog.reload()) == 3
+    assert _buttons(catalog.proxy_keyboard) == ["getproxy_catalog_a.txt", "getproxy_catalog_b.txt"]
+    assert _buttons(catalog.download_keyboard) == [
+        "download_catalog_a.txt", "link_catalog_a.txt",
+        "download_catalog_b.txt", "link_catalog_b.txt",
+        "download_missing.txt", "link_missing.txt",
+    ]
+    assert selector.mode("catalog_a.txt") == "lru"
+    assert asyncio.run(catalog.country_keyboard("catalog_a.txt")) is not None
+    assert asyncio.run(catalog.country_keyboard("missing.txt")) is None
+    assert catalog.display_name("catalog_b.txt") == "B"
+
+    # Меню отдаются из памяти, БД читается только при reload()
+    assert len(calls) == 1
+
+    rows[:] = rows[:1]
+    asyncio.run(catalog.reload())
+    assert _buttons(catalog.proxy_keyboard) == ["getproxy_catalog_a.txt"]
+    assert catalog.display_name("catalog_b.txt") == "catalog_b.txt"
+
+
+def test_empty_catalog_has_no_menus(monkeypatch):
+    async def load_proxy_files():
+        return []
+
+    monkeypatch.setattr(catalog_module, "load_proxy_files", load_proxy_files)
+    catalog = ProxyCatalog(proxy_pool.folder)
+    assert asyncio.run(catalog.reload()) == 0
+    assert catalog.proxy_keyboard is None and catalog.download_keyboard is None
+
+
+def test_country_menu_follows_pool_changes(pool_files, monkeypatch):
+    async def load_proxy_files():
+        return [{"name": "catalog_a.txt", "display": "A", "description": "", "mode": "round_robin"}]
+
+    monkeypatch.setattr(catalog_module, "load_proxy_files", load_proxy_files)
+    catalog = ProxyCatalog(proxy_pool.folder)
+    asyncio.run(catalog.reload())
+    first = asyncio.run(catalog.country_keyboard("catalog_a.txt"))
+    assert _buttons(first)[0] == "getcountry_DE_catalog_a.txt"
+    # Пока файл не менялся, меню берётся из кэша
+    assert asyncio.run(catalog.country_keyboard("catalog_a.txt")) is first
+
+    # Файл обновлён без reload() каталога: меню собирается по новому содержимому
+    path = os.path.join(proxy_pool.folder, "catalog_a.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("trojan://secret@10.0.2.1:443#🇩🇪\ntrojan://secret@10.0.2.2:443#🇫🇷\n"
+                "trojan://secret@10.0.2.3:443#🇫🇷 Paris\n")
+    proxy_pool.install("catalog_a.txt", 3)
+    assert _buttons(asyncio.run(catalog.country_keyboard("catalog_a.txt")))[:2] == [
+        "getcountry_FR_catalog_a.txt", "getcountry_DE_catalog_a.txt"]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("trojan://secret@10.0.2.1:443#no-flag\n")
+    proxy_pool.install("catalog_a.txt", 1)
+    assert asyncio.run(catalog.country_keyboard("catalog_a.txt")) is None
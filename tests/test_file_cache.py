@@ -0,0 +1,79 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument
+from aiogram.types import FSInputFile
+
+import file_cache
+from database import write_behind
+from file_cache import FileIdCache
+
+
+class _Outbound:
+    """Очередь отправки, которая отклоняет file_id из rejected"""
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.sent = []
+        self.uploads = 0
+
+    async def send(self, method, chat_id, document, **kwargs):
+        self.sent.append(document)
+        if isinstance(document, FSInputFile):
+            self.uploads += 1
+            return SimpleNamespace(document=SimpleNamespace(file_id=f"id-{self.uploads}"))
+        if document in self.rejected:
+            raise TelegramBadRequest(SendDocument(chat_id=chat_id, document=document), "wrong file identifier")
+        return SimpleNamespace(document=SimpleNamespace(file_id=document))
+
+
+def _bot():
+    async def send_document(**kwargs):
+        raise AssertionError("отправка идёт только через outbound")
+    return SimpleNamespace(send_document=send_document)
+
+
+def _queued(sql_prefix: str) -> list:
+    return [params for sql, params in write_behind.pending() if sql.lstrip().startswith(sql_prefix)]
+
+
+def test_file_id_reused_and_stale_one_reuploaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "_pending", [])
+    path = tmp_path / "proxies.txt"
+    path.write_text("trojan://secret@10.0.5.1:443\n", encoding="utf-8")
+    cache = FileIdCache()
+    outbound = _Outbound()
+    monkeypatch.setattr(file_cache, "outbound", outbound)
+    bot = _bot()
+
+    # Первая отправка загружает файл, вторая передаёт только file_id
+    asyncio.run(cache.send(bot, 1, "document", str(path)))
+    asyncio.run(cache.send(bot, 2, "document", str(path)))
+    assert outbound.uploads == 1
+    assert outbound.sent[1] == "id-1"
+    assert [params[4] for params in _queued("INSERT OR REPLACE INTO telegram_files")] == ["id-1"]
+
+    # Telegram больше не принимает file_id: запись забывается, файл загружается заново
+    outbound.rejected.add("id-1")
+    message = asyncio.run(cache.send(bot, 3, "document", str(path)))
+    assert message.document.file_id == "id-2"
+    assert outbound.uploads == 2
+    assert _queued("DELETE FROM telegram_files") == [(os.path.abspath(path),)]
+    assert cache.lookup(str(path), "document") == "id-2"
+
+
+def test_changed_file_is_uploaded_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "_pending", [])
+    path = tmp_path / "proxies.txt"
+    path.write_text("a\n", encoding="utf-8")
+    cache = FileIdCache()
+    outbound = _Outbound()
+    monkeypatch.setattr(file_cache, "outbound", outbound)
+
+    asyncio.run(cache.send(_bot(), 1, "document", str(path)))
+    path.write_text("a\nb\n", encoding="utf-8")
+    assert cache.lookup(str(path), "document") is None
+    asyncio.run(cache.send(_bot(), 1, "document", str(path)))
+    assert outbound.uploads == 2
@@ -0,0 +1,67 @@
+from geo import CountryIndex, IpRanges, country_flag, flag_country
+from proxy_parser import ProxyRecord
+
+FILE_NAME = "geo.txt"
+
+
+def _record(host: str, remark: str) -> ProxyRecord:
+    return ProxyRecord("trojan", host, 443, "secret", "tcp", "tls", "", remark,
+                       f"trojan://secret@{host}:443#{remark}")
+
+
+def _ranges(tmp_path) -> IpRanges:
+    path = tmp_path / "ranges.csv"
+    path.write_text(
+        "10.0.0.0,10.0.0.255,NL\n"
+        "10.0.1.0,10.0.1.255,\"us\"\n"
+        "2001:db8::,2001:db8::ffff,JP\n"
+        "bad,line,XX\n"
+        "10.0.2.0,2001:db8::1,DE\n",
+        encoding="utf-8",
+    )
+    ranges = IpRanges()
+    # Некорректная строка и диапазон из адресов разных версий пропускаются
+    assert ranges.load(str(path)) == 3
+    return ranges
+
+
+def test_flag_country_roundtrip():
+    assert flag_country("🇷🇺Россия#29") == "RU"
+    assert flag_country("no flag") is None
+    assert flag_country(country_flag("de")) == "DE"
+
+
+def test_ip_ranges_lookup(tmp_path):
+    ranges = _ranges(tmp_path)
+    assert ranges.lookup("10.0.0.7") == "NL"
+    assert ranges.lookup("10.0.1.255") == "US"
+    assert ranges.lookup("2001:db8::10") == "JP"
+    assert ranges.lookup("10.0.2.1") is None
+    assert ranges.lookup("example.com") is None
+
+
+def test_country_index_buckets_and_rotation(tmp_path):
+    index = CountryIndex(_ranges(tmp_path))
+    records = (
+        _record("10.0.0.1", "🇩🇪 a"),
+        _record("10.0.0.2", "plain"),     # страна по таблице: NL
+        _record("10.0.9.9", "plain"),     # страна не определена
+        _record("10.0.0.3", "🇩🇪 b"),
+        _record("10.0.1.1", "🇩🇪 c"),     # флаг важнее таблицы
+    )
+    assert index.countries(FILE_NAME, records) == [("DE", 3), ("NL", 1)]
+
+    assert [index.pick(FILE_NAME, records, "DE") for _ in range(4)] == [0, 3, 4, 0]
+    # Неподходящие записи пропускаются, курсор встаёт за выданной
+    assert index.pick(FILE_NAME, records, "DE", lambda i: i == 4) == 4
+    assert index.pick(FILE_NAME, records, "DE") == 0
+    assert index.pick(FILE_NAME, records, "DE", lambda i: False) is None
+    assert index.pick(FILE_NAME, records, "FR") is None
+
+
+def test_country_index_rebuilt_for_new_records():
+    index = CountryIndex(IpRanges())
+    first = (_record("10.0.0.1", "🇩🇪"),)
+    assert index.countries(FILE_NAME, first) == [("DE", 1)]
+    second = (_record("10.0.0.1", "🇫🇷"), _record("10.0.0.2", "🇫🇷"))
+    assert index.countries(FILE_NAME, second) == [("FR", 2)]
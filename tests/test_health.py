@@ -0,0 +1,90 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+import database
+from health import HealthChecker
+from proxy_parser import ProxyRecord
+from proxy_pool import proxy_pool
+
+FILE_NAME = "health.txt"
+
+
+def _record(port: int, remark: str) -> ProxyRecord:
+    uri = f"trojan://secret@127.0.0.1:{port}?security=none#{remark}"
+    return ProxyRecord("trojan", "127.0.0.1", port, "secret", "tcp", "none", "", remark, uri)
+
+
+def _closed_port() -> int:
+    # Порт, который только что был свободен: подключение к нему отклоняется
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _listener():
+    async def accept(reader, writer):
+        writer.close()
+
+    return await asyncio.start_server(accept, "127.0.0.1", 0)
+
+
+@pytest.fixture
+def pool_file():
+    yield FILE_NAME
+    os.remove(os.path.join(proxy_pool.folder, FILE_NAME))
+    proxy_pool.invalidate(FILE_NAME)
+    proxy_pool.set_unhealthy(frozenset())
+
+
+def _checker() -> HealthChecker:
+    return HealthChecker(interval=60, concurrency=2, per_host=1, timeout=2)
+
+
+def test_check_marks_closed_endpoint():
+    async def scenario():
+        servers = [await _listener(), await _listener()]
+        try:
+            live = [server.sockets[0].getsockname()[1] for server in servers]
+            closed = _closed_port()
+            # Повтор адреса проверяется один раз
+            records = [_record(live[0], "a"), _record(closed, "b"), _record(live[1], "c"), _record(live[0], "d")]
+            return live, closed, await _checker().check(records)
+        finally:
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+
+    live, closed, status = asyncio.run(scenario())
+    assert set(status) == {("127.0.0.1", port) for port in live + [closed]}
+    assert status[("127.0.0.1", closed)] is None
+    assert all(status[("127.0.0.1", port)] is not None for port in live)
+
+
+def test_check_pool_skips_unhealthy(conn, pool_file):
+    async def scenario():
+        server = await _listener()
+        try:
+            live = server.sockets[0].getsockname()[1]
+            records = [_record(live, "a"), _record(_closed_port(), "b"), _record(live, "c")]
+            os.makedirs(proxy_pool.folder, exist_ok=True)
+            with open(os.path.join(proxy_pool.folder, pool_file), "w", encoding="utf-8") as f:
+                f.write("\n".join(record.uri for record in records) + "\n")
+            proxy_pool.invalidate(pool_file)
+            return records, await _checker().check_pool([pool_file])
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    records, status = asyncio.run(scenario())
+    assert len(status) == 2
+    all_proxies = proxy_pool.get(pool_file)
+    assert [record.uri for record in all_proxies] == [record.uri for record in records]
+    assert [proxy_pool.is_healthy(record) for record in all_proxies] == [True, False, True]
+
+    with conn:
+        issued = [database._next_index(conn, pool_file, all_proxies, None) for _ in range(6)]
+    assert 1 not in issued
+    assert set(issued) == {0, 2}
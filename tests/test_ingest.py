@@ -0,0 +1,142 @@
+import asyncio
+import gzip
+import os
+import tracemalloc
+import zipfile
+
+import pytest
+
+import database
+import ingest
+import pool_index
+from conftest import connect
+from ingest import ingest_proxy_file
+from proxy_pool import proxy_pool
+
+FILE_NAME = "ingest.txt"
+OTHER_NAME = "ingest_other.txt"
+
+
+def _uri(name: str) -> str:
+    return f"trojan://secret@{name}.example.com:443#{name}"
+
+
+def _write(path: str, lines: list):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+@pytest.fixture
+def pool(bot_db, tmp_path):
+    os.makedirs(proxy_pool.folder, exist_ok=True)
+    paths = [os.path.join(proxy_pool.folder, name) for name in (FILE_NAME, OTHER_NAME)]
+    _write(paths[0], [_uri(f"r{i}") for i in range(5)])
+    _write(paths[1], [_uri("other")])
+    for name in (FILE_NAME, OTHER_NAME):
+        proxy_pool.invalidate(name)
+    conn = connect(os.environ["DB_FILE"])
+    # Выданы r0, r1, r2: курсор стоит на r2
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO proxy_index (file_name, last_index) VALUES (?, 2)", (FILE_NAME,))
+    yield conn
+    with conn:
+        conn.execute("DELETE FROM proxy_index WHERE file_name = ?", (FILE_NAME,))
+    conn.close()
+    for path in paths:
+        os.remove(path)
+    for name in (FILE_NAME, OTHER_NAME):
+        proxy_pool.invalidate(name)
+
+
+def test_upload_is_applied_as_diff_and_keeps_cursor(pool, tmp_path):
+    upload = str(tmp_path / "upload.txt")
+    # r1 удалён, n1 добавлен; повтор, чужая запись и мусор отбрасываются
+    _write(upload, [_uri("n1"), _uri("r4"), _uri("r3"), _uri("r2"), _uri("r0"), _uri("r2"),
+                    _uri("other"), "not a proxy"])
+
+    report = asyncio.run(ingest_proxy_file(FILE_NAME, upload, [FILE_NAME, OTHER_NAME]))
+    assert (report.added, report.removed, report.unchanged) == (1, 1, 4)
+    assert (report.invalid, report.duplicates, report.cross_duplicates) == (1, 1, 1)
+    assert not os.path.exists(upload)
+
+    # Сохранившиеся записи - в прежнем порядке, новые - после них
+    expected = [_uri(name) for name in ("r0", "r2", "r3", "r4", "n1")]
+    with open(os.path.join(proxy_pool.folder, FILE_NAME), encoding="utf-8") as f:
+        assert f.read().splitlines() == expected
+    assert [record.uri for record in proxy_pool.get(FILE_NAME)] == expected
+
+    # Курсор перенесён на последнюю выданную запись r2: дальше идут r3, r4, n1
+    assert report.cursor == 1
+    issued = [asyncio.run(database.get_next_proxy(FILE_NAME)) for _ in range(3)]
+    assert issued == [_uri("r3"), _uri("r4"), _uri("n1")]
+
+
+def _content(lines: list) -> bytes:
+    return "".join(line + "\n" for line in lines).encode()
+
+
+@pytest.mark.parametrize("upload_name", ["upload.txt.gz", "upload.zip"])
+def test_compressed_uploads(pool, tmp_path, upload_name):
+    lines = [_uri("r0"), _uri("n1"), "# комментарий", _uri("n2")]
+    upload = tmp_path / upload_name
+    if upload_name.endswith(".gz"):
+        upload.write_bytes(gzip.compress(_content(lines)))
+    else:
+        with zipfile.ZipFile(upload, "w") as archive:
+            # Из архива читаются только .txt
+            archive.writestr("part1.txt", _content(lines[:2]))
+            archive.writestr("readme.md", b"not a proxy\n")
+            archive.writestr("dir/part2.txt", _content(lines[2:]))
+
+    report = asyncio.run(ingest_proxy_file(FILE_NAME, str(upload), [FILE_NAME], upload_name=upload_name))
+    assert (report.total, report.added, report.removed, report.invalid) == (3, 2, 4, 0)
+    assert [record.uri for record in proxy_pool.get(FILE_NAME)] == [_uri("r0"), _uri("n1"), _uri("n2")]
+
+
+def test_byte_cap_counts_unpacked_utf8(pool, tmp_path, monkeypatch):
+    # 40 строк по 50 символов кириллицы - 4000 байт UTF-8, но 2000 символов
+    upload = tmp_path / "upload.txt.gz"
+    upload.write_bytes(gzip.compress(("#" + "я" * 49 + "\n").encode() * 40))
+    monkeypatch.setattr(ingest, "INGEST_MAX_BYTES", 3000)
+    with pytest.raises(ValueError):
+        asyncio.run(ingest_proxy_file(FILE_NAME, str(upload), [FILE_NAME], upload_name="upload.txt.gz"))
+    # Пул не тронут, временные файлы удалены
+    assert len(proxy_pool.get(FILE_NAME)) == 5
+    assert [name for name in os.listdir(proxy_pool.folder) if name.endswith((".ingest", ".tmp"))] == []
+
+
+def test_long_line_is_skipped_as_invalid(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_MAX_LINE", 100)
+    upload = tmp_path / "upload.txt"
+    long_uri = _uri("x" * 200)
+    # Длинная строка в середине и в конце файла без перевода строки
+    upload.write_bytes(_content([_uri("n1"), long_uri, _uri("n2")]) + long_uri.encode())
+
+    report = asyncio.run(ingest_proxy_file(FILE_NAME, str(upload), [FILE_NAME]))
+    assert (report.total, report.invalid) == (2, 2)
+    assert [record.uri for record in proxy_pool.get(FILE_NAME)] == [_uri("n1"), _uri("n2")]
+
+
+def _ingest_peak(tmp_path, count: int) -> int:
+    upload = tmp_path / f"upload{count}.txt"
+    with open(upload, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(f"trojan://secret@10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:443#{i}\n")
+    tracemalloc.start()
+    try:
+        report = asyncio.run(ingest_proxy_file(FILE_NAME, str(upload), [FILE_NAME]))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert report.total == count
+    return peak
+
+
+def test_peak_memory_does_not_grow_with_upload(pool, tmp_path, monkeypatch):
+    # Таблица смещений индекса копится порциями по _OFFSETS_CHUNK: берём
+    # порцию меньше загрузки, чтобы замер показал и этот предел
+    monkeypatch.setattr(pool_index, "_OFFSETS_CHUNK", 1024)
+    small = _ingest_peak(tmp_path, 5000)
+    large = _ingest_peak(tmp_path, 50000)
+    # В 10 раз больше строк - пик памяти Python почти тот же
+    assert large < small * 1.5, (small, large)
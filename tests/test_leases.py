@@ -0,0 +1,134 @@
+import asyncio
+import os
+
+import pytest
+
+import database
+import leases
+from conftest import connect
+from leases import LeaseManager
+from proxy_pool import proxy_pool
+
+FILE_NAME = "leases.txt"
+TTL = 60.0
+
+
+@pytest.fixture
+def pool_file():
+    os.makedirs(proxy_pool.folder, exist_ok=True)
+    path = os.path.join(proxy_pool.folder, FILE_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(f"trojan://secret@10.0.3.{i}:443#{i}\n" for i in range(2))
+    yield [f"trojan://secret@10.0.3.{i}:443#{i}" for i in range(2)]
+    os.remove(path)
+    proxy_pool.invalidate(FILE_NAME)
+
+
+def _rows(conn) -> list:
+    return sorted(tuple(row) for row in conn.execute("SELECT proxy, user_id FROM proxy_leases"))
+
+
+def _issue(monkeypatch, manager, conn, user_id):
+    # Отдельные LeaseManager и соединение - как два процесса бота с общей БД
+    monkeypatch.setattr(database, "lease_manager", manager)
+    with conn:
+        return database._get_next_proxy(conn, FILE_NAME, user_id)
+
+
+def test_lease_expires_after_ttl(conn):
+    manager = LeaseManager(TTL)
+    with conn:
+        assert manager.acquire(conn, FILE_NAME, "p1", 1, now=0) == TTL
+    assert manager.is_leased(FILE_NAME, "p1", TTL - 1)
+
+    with conn:
+        assert manager.expire(conn, TTL) == 1
+    assert not manager.is_leased(FILE_NAME, "p1", TTL)
+    assert manager.leased_count(FILE_NAME) == 0
+    assert _rows(conn) == []
+
+
+def test_busy_proxy_is_not_leased_twice(db_path):
+    first, second = connect(db_path), connect(db_path)
+    try:
+        a, b = LeaseManager(TTL), LeaseManager(TTL)
+        with first:
+            assert a.acquire(first, FILE_NAME, "p1", 1, now=0) is not None
+        # Память второго процесса не знает об аренде, но таблица её не отдаёт
+        assert not b.is_leased(FILE_NAME, "p1", 0)
+        with second:
+            assert b.acquire(second, FILE_NAME, "p1", 2, now=0) is None
+        assert b.is_leased(FILE_NAME, "p1", 0)
+        assert _rows(second) == [("p1", 1)]
+    finally:
+        first.close()
+        second.close()
+
+
+def test_rolled_back_changes_are_reloaded(conn):
+    manager = LeaseManager(TTL)
+    with conn:
+        manager.acquire(conn, FILE_NAME, "p1", 1, now=0)
+
+    with pytest.raises(RuntimeError):
+        with conn:
+            manager.release(conn, 1, FILE_NAME)
+            manager.acquire(conn, FILE_NAME, "p2", 1, now=0)
+            raise RuntimeError("rollback")
+    # Память уже изменена, а таблица - нет
+    assert manager.is_leased(FILE_NAME, "p2", 0)
+
+    manager.invalidate(FILE_NAME)
+    with conn:
+        manager.refresh(conn, FILE_NAME, 0)
+    assert manager.is_leased(FILE_NAME, "p1", 0)
+    assert not manager.is_leased(FILE_NAME, "p2", 0)
+    assert manager.leased_count(FILE_NAME) == 1
+
+
+def test_sweeper_expires_and_syncs(conn, monkeypatch):
+    manager, other = LeaseManager(TTL), LeaseManager(TTL)
+    with conn:
+        manager.acquire(conn, FILE_NAME, "p1", 1, now=0)
+        # Аренда другого процесса, о которой эта память ещё не знает
+        other.acquire(conn, FILE_NAME, "p2", 2, now=30)
+
+    class Pool:
+        async def write(self, func, *args):
+            with conn:
+                return func(conn, *args)
+
+    async def scenario():
+        manager.start(Pool(), 0.01)
+        await asyncio.sleep(0.1)
+        await manager.stop()
+
+    # Срок первой аренды истёк, вторая ещё действует
+    monkeypatch.setattr(leases.time, "time", lambda: TTL + 1)
+    asyncio.run(scenario())
+    assert not manager.is_leased(FILE_NAME, "p1", TTL + 1)
+    assert manager.is_leased(FILE_NAME, "p2", TTL + 1)
+    assert _rows(conn) == [("p2", 2)]
+
+
+def test_pool_exhausted_until_other_process_releases(pool_file, db_path, monkeypatch):
+    first, second = connect(db_path), connect(db_path)
+    try:
+        a, b = LeaseManager(TTL), LeaseManager(TTL)
+        # Процессы по очереди выдают записи, не зная об арендах друг друга
+        issued = {_issue(monkeypatch, a, first, 1)}
+        # Курсор сброшен: второй процесс сначала попадает на занятую запись
+        with first:
+            first.execute("DELETE FROM proxy_index")
+        issued.add(_issue(monkeypatch, b, second, 2))
+        assert issued == set(pool_file)
+        assert _issue(monkeypatch, a, first, 3) is None
+
+        # Второй процесс снимает аренду: первый видит это по таблице
+        with second:
+            b.release(second, 2, FILE_NAME)
+        assert _issue(monkeypatch, a, first, 3) in pool_file
+        assert len(_rows(first)) == 2
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from lifecycle import ReadinessMiddleware, app_state, serve
+
+
+@pytest.fixture
+def not_ready():
+    app_state.ready = False
+    yield
+    app_state.ready = False
+
+
+class _Dispatcher:
+    """Опрос обновлений, который идёт до stop_polling()"""
+
+    def __init__(self):
+        self.started = False
+        self._stop = asyncio.Event()
+
+    async def start_polling(self, bot, **kwargs):
+        self.started = True
+        await self._stop.wait()
+
+    async def stop_polling(self):
+        self._stop.set()
+
+
+def test_update_before_startup_waits_for_readiness(not_ready):
+    async def scenario():
+        middleware = ReadinessMiddleware(time.perf_counter())
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event)
+            return "done"
+
+        waiting = asyncio.ensure_future(middleware(handler, "update", {}))
+        await asyncio.sleep(0.05)
+        # Обновление не пропущено, а ждёт окончания инициализации
+        assert not waiting.done() and handled == []
+        app_state.ready = True
+        return await waiting, handled
+
+    assert asyncio.run(scenario()) == ("done", ["update"])
+    assert {"first_update", "first_handler"} <= set(app_state.phases)
+
+
+def test_serve_polls_during_startup():
+    async def scenario():
+        dp = _Dispatcher()
+        init_done = asyncio.Event()
+
+        async def init():
+            await asyncio.sleep(0.05)
+            # Опрос начался раньше, чем закончилась инициализация
+            assert dp.started
+            init_done.set()
+
+        async def stop_later():
+            await init_done.wait()
+            await dp.stop_polling()
+
+        stopper = asyncio.create_task(stop_later())
+        await serve(None, dp, init())
+        await stopper
+
+    asyncio.run(scenario())
+
+
+def test_serve_stops_polling_when_startup_fails():
+    async def scenario():
+        async def init():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("migrations failed")
+
+        await serve(None, _Dispatcher(), init())
+
+    with pytest.raises(RuntimeError, match="migrations failed"):
+        asyncio.run(asyncio.wait_for(scenario(), timeout=5))
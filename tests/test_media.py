@@ -0,0 +1,121 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+import media_gc
+import media_store
+from media_gc import MediaGarbageCollector
+from media_store import MediaStore
+
+
+@pytest.fixture(params=[True, False], ids=["returning", "select-delete"])
+def returning(request, monkeypatch):
+    if request.param and not media_store.HAS_RETURNING:
+        pytest.skip("SQLite без RETURNING")
+    monkeypatch.setattr(media_store, "HAS_RETURNING", request.param)
+    monkeypatch.setattr(media_gc, "HAS_RETURNING", request.param)
+    return request.param
+
+
+@pytest.fixture
+def store(tmp_path) -> MediaStore:
+    return MediaStore(str(tmp_path / "media"), 1, 10)
+
+
+def _put(conn, store: MediaStore, content: bytes) -> str:
+    """Кладёт файл в хранилище так же, как commit(): по хэшу и строкой media_files"""
+    digest = hashlib.sha256(content).hexdigest()
+    path = store.path_for(digest, ".txt")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    conn.execute("INSERT OR IGNORE INTO media_files (digest, path, size, media_type) VALUES (?, ?, ?, 'document')",
+                 (digest, path, len(content)))
+    return path
+
+
+def _reclaimed(conn) -> dict:
+    return dict(conn.execute("SELECT key, value FROM stats_totals WHERE key LIKE 'media_reclaimed_%'").fetchall())
+
+
+def test_release_removes_last_reference(conn, store, returning):
+    with conn:
+        path = _put(conn, store, b"shared")
+        first = store.add_ref(conn, path, 1, None, "ticket")
+        second = store.add_ref(conn, path, 2, None, "ticket")
+        assert store.release(conn, first) is None
+        assert os.path.exists(path)
+        assert store.release(conn, second) == path
+    assert not os.path.exists(path)
+    assert _reclaimed(conn) == {"media_reclaimed_files": 1, "media_reclaimed_bytes": 6}
+
+
+def test_gc_release_counts_removed_files(conn, store, returning):
+    gc = MediaGarbageCollector(store, 0, 0, 0, 100, 0)
+    with conn:
+        path = _put(conn, store, b"payload")
+        ref_id = store.add_ref(conn, path, 1, None, "ticket")
+        report = media_gc.GcReport()
+        gc._release(conn, [ref_id, ref_id], report)
+    assert (report.refs, report.files, report.bytes) == (1, 1, 7)
+    assert not os.path.exists(path)
+
+
+def _usage(conn) -> tuple:
+    owners = dict(conn.execute("SELECT owner_id, bytes FROM media_usage").fetchall())
+    totals = dict(conn.execute("SELECT key, value FROM stats_totals WHERE key LIKE 'media_stored_%'").fetchall())
+    return owners, totals
+
+
+def test_running_totals_follow_refs_and_files(conn, store):
+    with conn:
+        shared = _put(conn, store, b"0123456789")
+        single = _put(conn, store, b"abcd")
+        first = store.add_ref(conn, shared, 1, None, "ticket")
+        store.add_ref(conn, shared, 2, None, "ticket")
+        store.add_ref(conn, single, 1, None, "ticket")
+    assert _usage(conn) == ({1: 14, 2: 10}, {"media_stored_files": 2, "media_stored_bytes": 14})
+
+    with conn:
+        store.release(conn, first)
+    assert _usage(conn) == ({1: 4, 2: 10}, {"media_stored_files": 2, "media_stored_bytes": 14})
+
+
+def test_global_quota_counts_only_freed_bytes(conn, store):
+    gc = MediaGarbageCollector(store, 0, 0, 15, 100, 3600)
+    with conn:
+        shared = _put(conn, store, b"0123456789")
+        single = _put(conn, store, b"abcdefghij")
+        # Старейшие ссылки - на общий файл: снятие первой места не освобождает
+        store.add_ref(conn, shared, 1, None, "ticket")
+        store.add_ref(conn, shared, 2, None, "ticket")
+        store.add_ref(conn, single, 3, None, "ticket")
+        report = media_gc.GcReport()
+        gc._enforce_global_quota(conn, report)
+    assert (report.refs, report.files, report.bytes) == (2, 1, 10)
+    assert not os.path.exists(shared)
+    assert os.path.exists(single)
+
+
+def test_dedup_hit_protects_file_from_orphan_cleanup(conn, store, tmp_path):
+    gc = MediaGarbageCollector(store, 0, 0, 0, 100, 3600)
+    content = b"same attachment"
+    with conn:
+        path = _put(conn, store, content)
+        conn.execute("UPDATE media_files SET created_at = datetime('now', '-2 days')")
+
+    # Повторная загрузка того же файла: commit() находит его по хэшу
+    incoming = tmp_path / "upload.tmp"
+    incoming.write_bytes(content)
+    writer = media_store.HashingWriter(str(incoming), None)
+    writer._hash.update(content)
+    writer.size = len(content)
+    with conn:
+        stored = store.commit(conn, writer, "document", ".txt")
+        report = media_gc.GcReport()
+        gc._remove_orphans(conn, time.time(), report)
+    assert stored.path == path
+    assert report.files == 0
+    assert os.path.exists(path)
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import notifications
+from notifications import MESSAGE_LIMIT, AdminDigest
+from sender import PRIORITY_ADMIN
+
+
+class _Outbound:
+    """Подмена очереди отправки: запоминает сообщения вместо запросов к Bot API"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, method, chat_id, text, priority, **kwargs):
+        self.sent.append((chat_id, text, priority))
+
+
+def test_render_counts_events_and_fits_message_limit():
+    digest = AdminDigest([1])
+    events = [("proxy_issued", f"user {i} " + "x" * 100) for i in range(100)] + [("file_downloaded", "file")]
+    text = digest._render(events)
+    assert "🆕 Выдано прокси: <b>100</b>" in text
+    assert "📥 Скачано файлов: <b>1</b>" in text
+    assert len(text) <= MESSAGE_LIMIT
+    shown = text.count("\nuser ")
+    assert text.endswith(f"… и ещё {len(events) - shown}")
+
+
+def test_events_are_sent_as_one_digest_per_admin(monkeypatch):
+    outbound = _Outbound()
+    monkeypatch.setattr(notifications, "outbound", outbound)
+
+    async def scenario():
+        digest = AdminDigest([1, 2], window=60, max_events=3)
+        digest.start(SimpleNamespace(send_message=None))
+        digest.notify("proxy_issued", "first")
+        digest.notify("file_downloaded", "second")
+        await asyncio.sleep(0.05)
+        # Окно ещё не прошло - сводка не отправлена
+        assert outbound.sent == []
+        # Набралось max_events событий - сводка уходит сразу
+        digest.notify("proxy_issued", "third")
+        await asyncio.sleep(0.05)
+        sent = list(outbound.sent)
+        await digest.stop()
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert [(chat_id, priority) for chat_id, _, priority in sent] == [(1, PRIORITY_ADMIN), (2, PRIORITY_ADMIN)]
+    assert all(text.endswith("first\nsecond\nthird\n") for _, text, _ in sent)
+    # После остановки пустая сводка не отправляется
+    assert len(outbound.sent) == 2
@@ -0,0 +1,69 @@
+import html
+import re
+
+import pytest
+
+import database
+from pagination import MESSAGE_LIMIT, split_html
+
+
+def _units(part: str) -> int:
+    # Длина, которую считает Telegram: текст без тегов, в единицах UTF-16
+    return len(html.unescape(re.sub(r"<[^>]*>", "", part)).encode("utf-16-le")) // 2
+
+
+def test_short_text_is_single_part():
+    assert split_html("<b>a</b>") == ["<b>a</b>"]
+
+
+def test_markup_does_not_count_towards_limit():
+    # Разметка в 8 раз длиннее текста, но после разбора текст влезает в лимит
+    text = "<b>x</b>&amp;" * 2000
+    assert len(text) > MESSAGE_LIMIT
+    assert split_html(text) == [text]
+
+
+def test_emoji_are_counted_in_utf16_units():
+    text = "😀" * 3000
+    parts = split_html(text)
+    assert len(parts) == 2
+    assert "".join(parts) == text
+    assert all(_units(part) <= MESSAGE_LIMIT for part in parts)
+
+
+@pytest.mark.parametrize("line", ["строка 😀 &lt;proxy&gt;\n", "x" * 5000])
+def test_open_tags_are_reopened_in_next_part(line):
+    text = "<b><i>" + line * 400 + "</i></b>"
+    parts = split_html(text, limit=1000)
+    assert len(parts) > 1
+    for part in parts:
+        assert part.startswith("<b><i>") and part.endswith("</i></b>")
+        assert _units(part) <= 1000
+    assert "".join(re.sub(r"</?[bi]>", "", part) for part in parts) == line * 400
+
+
+def _history(conn, cursor=None, newer=False):
+    page = database._get_proxy_history(conn, 1, cursor, newer, 2)
+    return [item["id"] for item in page.items], page.has_newer, page.has_older
+
+
+def test_keyset_pages_with_equal_timestamps(conn):
+    with conn:
+        conn.executemany("""INSERT INTO proxy_history (id, user_id, proxy, proxy_type, issue_date)
+                            VALUES (?, 1, ?, 'T', ?)""", [
+            (1, "p1", "2026-01-01 10:00:00"),
+            # Одинаковое время - порядок задаёт id
+            (2, "p2", "2026-01-01 11:00:00"),
+            (3, "p3", "2026-01-01 11:00:00"),
+            (4, "p4", "2026-01-01 11:00:00"),
+            (5, "p5", "2026-01-01 12:00:00"),
+        ])
+
+    assert _history(conn) == ([5, 4], False, True)
+    assert _history(conn, 4) == ([3, 2], True, True)
+    assert _history(conn, 2) == ([1], True, False)
+
+    # Обратно к новым: граница внутри группы с одинаковым временем
+    assert _history(conn, 2, newer=True) == ([4, 3], True, True)
+    assert _history(conn, 3, newer=True) == ([5, 4], False, True)
+    assert _history(conn, 1, newer=True) == ([3, 2], True, True)
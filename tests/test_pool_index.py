@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+
+import proxy_pool as proxy_pool_module
+from pool_index import PoolIndex, compile_folder, index_path
+from proxy_pool import ProxyPool
+
+FILE_NAME = "pool.txt"
+
+
+def _write(folder, hosts) -> None:
+    (folder / FILE_NAME).write_text("".join(f"trojan://secret@10.0.4.{i}:443#{i}\n" for i in hosts),
+                                    encoding="utf-8")
+
+
+def test_compile_folder_logs_progress(tmp_path, caplog):
+    _write(tmp_path, range(3))
+    (tmp_path / ".hidden.txt").write_text("", encoding="utf-8")
+    with caplog.at_level(logging.INFO):
+        assert compile_folder(str(tmp_path)) == 1
+    assert f"{FILE_NAME}: 3 записей -> {index_path(str(tmp_path), FILE_NAME)}" in caplog.messages
+
+
+def test_replaced_index_is_closed_after_grace(tmp_path, monkeypatch):
+    pool = ProxyPool(str(tmp_path), use_index=True)
+    _write(tmp_path, range(2))
+    old = pool.get(FILE_NAME)
+    assert isinstance(old, PoolIndex)
+
+    # Читатель, начавший обход до замены, дочитывает старый индекс
+    _write(tmp_path, range(3))
+    pool.install(FILE_NAME, 3)
+    assert [record.host for record in old] == ["10.0.4.0", "10.0.4.1"]
+
+    # Срок истёк: индекс закрывается при следующем обращении к пулу
+    monotonic = proxy_pool_module.time.monotonic
+    monkeypatch.setattr(proxy_pool_module.time, "monotonic",
+                        lambda: monotonic() + proxy_pool_module.RETIRED_INDEX_GRACE)
+    assert len(pool.get(FILE_NAME)) == 3
+    with pytest.raises(ValueError):
+        old[0]
+
+
+def test_invalidated_index_is_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxy_pool_module, "RETIRED_INDEX_GRACE", 0)
+    pool = ProxyPool(str(tmp_path), use_index=True)
+    _write(tmp_path, range(2))
+    current = pool.get(FILE_NAME)
+    pool.invalidate()
+    assert len(current) == 2
+    with pytest.raises(ValueError):
+        current[0]
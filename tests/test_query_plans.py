@@ -0,0 +1,86 @@
+import re
+
+import pytest
+
+import database
+import seen
+
+# Таблицы, для которых полный проход без индекса недопустим
+HOT_TABLES = ("proxy_history", "proxy_downloads", "support_tickets")
+# Псевдонимы таблиц в запросах database.py
+ALIASES = {"h": "proxy_history", "d": "proxy_downloads"}
+
+_SCAN = re.compile(r"^SCAN (\w+)(.*)$")
+
+
+def _seed(conn) -> int:
+    with conn:
+        ticket_id = database._create_support_ticket(conn, 1, "user", "First", "Last", "text", None, None, None)
+        conn.execute("INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (1, 'p', 'HTTP')")
+        conn.execute("INSERT INTO proxy_downloads (user_id, file_name) VALUES (1, 'http.txt')")
+    return ticket_id
+
+
+def _hot_queries(conn, ticket_id: int) -> list:
+    """Запросы, которые выполняют функции database.py за хендлерами бота"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        with conn:
+            database._create_support_ticket(conn, 2, "user", "First", "Last", "text", None, None, None)
+            database._update_ticket_reply(conn, ticket_id, 1, "reply", None, None)
+            database._update_ticket_status(conn, ticket_id, "open")
+        for cursor in (None, ticket_id):
+            for newer in (False, True):
+                database._get_open_tickets(conn, cursor, newer, 10)
+                database._get_user_tickets(conn, 1, cursor, newer, 10)
+                database._get_proxy_history(conn, 1, cursor, newer, 10)
+                database._get_proxy_downloads(conn, cursor, newer, 10)
+                database._get_user_proxy_downloads(conn, 1, cursor, newer, 10)
+        database._get_ticket_info(conn, ticket_id)
+        database._get_latest_issues(conn)
+        seen.SeenTracker(True, 4).get(conn, 1, "http.txt", ())
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().split()[0].upper() in ("SELECT", "UPDATE", "DELETE")]
+
+
+def _plan(conn, sql: str) -> list:
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def test_hot_queries_use_indexes(conn):
+    ticket_id = _seed(conn)
+    queries = _hot_queries(conn, ticket_id)
+    touched = {table for sql in queries for table in HOT_TABLES if table in sql}
+    assert touched == set(HOT_TABLES)
+
+    for sql in queries:
+        for step in _plan(conn, sql):
+            match = _SCAN.match(step)
+            if match:
+                table = ALIASES.get(match.group(1), match.group(1))
+                assert table not in HOT_TABLES or "USING" in match.group(2), (sql, step)
+
+
+@pytest.mark.parametrize("cursor", [None, 1])
+@pytest.mark.parametrize("newer", [False, True])
+def test_pages_follow_index_order(conn, cursor, newer):
+    # Страница по ключу (время, id) должна идти по индексу без сортировки
+    _seed(conn)
+    pages = [
+        lambda: database._get_open_tickets(conn, cursor, newer, 10),
+        lambda: database._get_user_tickets(conn, 1, cursor, newer, 10),
+        lambda: database._get_proxy_history(conn, 1, cursor, newer, 10),
+        lambda: database._get_proxy_downloads(conn, cursor, newer, 10),
+        lambda: database._get_user_proxy_downloads(conn, 1, cursor, newer, 10),
+    ]
+    for page in pages:
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            page()
+        finally:
+            conn.set_trace_callback(None)
+        for sql in statements:
+            assert not any("TEMP B-TREE FOR ORDER BY" in step for step in _plan(conn, sql)), sql
@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+
+import database
+from db_pool import DatabasePool
+from pool_index import PoolIndex, column, write_index
+from proxy_parser import ProxyRecord
+from seen import ARRAY_LIMIT, CompactBitmap, SeenTracker
+from write_behind import WriteBehindQueue
+
+FILE_NAME = "seen.txt"
+
+
+def _records(count: int) -> tuple:
+    return tuple(
+        ProxyRecord("trojan", f"10.0.1.{i}", 443, "secret", "tcp", "tls", "", str(i),
+                    f"trojan://secret@10.0.1.{i}:443#{i}")
+        for i in range(count)
+    )
+
+
+def _stored(conn, user_id: int):
+    row = conn.execute("SELECT bitmap FROM user_seen WHERE user_id = ? AND file_name = ?",
+                       (user_id, FILE_NAME)).fetchone()
+    return None if row is None else sorted(i for i in range(64) if i in CompactBitmap.from_bytes(row[0]))
+
+
+def test_marks_are_written_by_flush(conn):
+    tracker = SeenTracker(True, 16)
+    records = _records(5)
+    with conn:
+        tracker.get(conn, 1, FILE_NAME, records)
+        for index in (0, 3, 4):
+            tracker.mark(1, FILE_NAME, index)
+    assert _stored(conn, 1) is None
+
+    with conn:
+        tracker.flush(conn)
+    assert _stored(conn, 1) == [0, 3, 4]
+
+
+def test_evicted_entry_is_saved(conn):
+    tracker = SeenTracker(True, 1)
+    records = _records(3)
+    with conn:
+        tracker.get(conn, 1, FILE_NAME, records)
+        tracker.mark(1, FILE_NAME, 2)
+        tracker.get(conn, 2, FILE_NAME, records)
+    assert _stored(conn, 1) == [2]
+
+
+def test_rebuild_merges_pending_history(conn):
+    tracker = SeenTracker(True, 16)
+    records = _records(4)
+    with conn:
+        conn.execute("INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (1, ?, ?)",
+                     (records[0].uri, FILE_NAME))
+    pending = [(records[2].uri, FILE_NAME), ("vless://unknown", FILE_NAME), (records[3].uri, "other.txt")]
+    bitmap = tracker.get(conn, 1, FILE_NAME, records, pending)
+    assert [index for index in range(4) if index in bitmap] == [0, 2]
+
+
+def test_pending_history_reads_write_behind_queue(monkeypatch):
+    monkeypatch.setattr(database.write_behind, "_pending", [])
+    database.save_proxy_history(1, "trojan://a", "T")
+    database.save_proxy_history(2, "trojan://b", "T")
+    database.save_proxy_history(1, "trojan://c", "T")
+    assert list(database._pending_history(1)) == [("trojan://a", "T"), ("trojan://c", "T")]
+
+
+def test_rebuild_from_pool_index(conn, tmp_path):
+    records = _records(6)
+    path = str(tmp_path / "seen.pidx")
+    write_index(path, records, (1, 2))
+    index = PoolIndex(path)
+    assert list(column(index, "uri")) == [record.uri for record in records]
+
+    with conn:
+        for i in (5, 1):
+            conn.execute("INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (1, ?, ?)",
+                         (records[i].uri, FILE_NAME))
+    bitmap = SeenTracker(True, 16).get(conn, 1, FILE_NAME, index)
+    assert [i for i in range(6) if i in bitmap] == [1, 5]
+    index.close()
+
+
+def test_rebuild_uses_history_of_this_file_only(conn):
+    records = _records(3)
+    with conn:
+        conn.execute("INSERT INTO proxy_files (file_name, display_name) VALUES (?, 'Trojan')", (FILE_NAME,))
+        # История пишется под отображаемым именем; тот же URI в другом файле не считается
+        conn.executemany("INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (1, ?, ?)",
+                         [(records[0].uri, "Trojan"), (records[1].uri, "Other")])
+    bitmap = SeenTracker(True, 16).get(conn, 1, FILE_NAME, records, [(records[2].uri, "Trojan")])
+    assert [i for i in range(3) if i in bitmap] == [0, 2]
+
+
+@pytest.mark.parametrize("count", [10, ARRAY_LIMIT + 10])
+def test_next_unset_skips_runs(count):
+    bitmap = CompactBitmap()
+    # Серия выданных индексов с разрывом и продолжение в следующем блоке
+    values = set(range(count)) - {count // 2} | set(range(65536, 65536 + count))
+    for value in values:
+        bitmap.add(value)
+    assert bitmap.next_unset(0) == count // 2
+    assert bitmap.next_unset(count // 2 + 1) == count
+    assert bitmap.next_unset(65536) == 65536 + count
+    assert bitmap.next_unset(count + 5) == count + 5
+
+
+def test_full_block_continues_in_next_block():
+    bitmap = CompactBitmap()
+    for value in range(65536 + 3):
+        bitmap.add(value)
+    assert bitmap.next_unset(100) == 65539
+
+
+def test_allocator_skips_seen_without_calling_usable(conn):
+    seen = CompactBitmap()
+    for index in range(90):
+        seen.add(index)
+    checked = []
+
+    def usable(index):
+        checked.append(index)
+        return index % 2 == 1
+
+    with conn:
+        assert database._advance_index_matching(conn, FILE_NAME, range(100), usable, seen) == 91
+    assert checked == [90, 91]
+
+    with conn:
+        conn.execute("UPDATE proxy_index SET last_index = 98 WHERE file_name = ?", (FILE_NAME,))
+        # По кругу: после 99 - сразу к невыданным, выданные 0..89 пропускаются
+        assert database._advance_index_matching(conn, FILE_NAME, range(100), lambda i: i == 90, seen) == 90
+
+
+def test_mark_after_flush_is_written_next_time(conn):
+    tracker = SeenTracker(True, 16)
+    records = _records(4)
+    with conn:
+        tracker.get(conn, 1, FILE_NAME, records)
+        tracker.mark(1, FILE_NAME, 0)
+        tracker.flush(conn)
+        tracker.mark(1, FILE_NAME, 3)
+    assert _stored(conn, 1) == [0]
+
+    with conn:
+        tracker.reset(1, FILE_NAME)
+        tracker.mark(1, FILE_NAME, 1)
+        tracker.flush(conn)
+    assert _stored(conn, 1) == [1]
+
+
+def test_rolled_back_flush_survives_eviction(conn):
+    tracker = SeenTracker(True, 1)
+    records = _records(3)
+    with conn:
+        tracker.get(conn, 1, FILE_NAME, records)
+        tracker.mark(1, FILE_NAME, 2)
+    with pytest.raises(RuntimeError):
+        with conn:
+            restore = tracker.flush(conn)
+            raise RuntimeError("rollback")
+    # До отката множество вытеснено: оно уже не отмечено изменённым
+    with conn:
+        tracker.get(conn, 2, FILE_NAME, records)
+    restore()
+
+    bitmap = tracker.get(conn, 1, FILE_NAME, records)
+    assert 2 in bitmap
+    with conn:
+        tracker.flush(conn)
+    assert _stored(conn, 1) == [2]
+
+
+def test_write_behind_retry_keeps_marks(db_path, conn, monkeypatch):
+    pool = DatabasePool(db_path, readers=1)
+    tracker = SeenTracker(True, 16)
+    records = _records(4)
+    with conn:
+        tracker.get(conn, 1, FILE_NAME, records)
+        tracker.mark(1, FILE_NAME, 0)
+    write = pool.write
+    calls = []
+
+    async def flaky_write(func, *args):
+        calls.append(func)
+        if len(calls) == 1:
+            try:
+                await write(lambda c, *a: (func(c, *a), c.execute("SELECT * FROM missing_table")), *args)
+            finally:
+                # Выдача между неудачной попыткой и повтором тоже попадает в запись
+                tracker.mark(1, FILE_NAME, 3)
+        return await write(func, *args)
+
+    async def scenario():
+        queue = WriteBehindQueue(pool, retries=3, retry_delay=0.01)
+        queue.defer(tracker.flush)
+        await queue.flush()
+
+    monkeypatch.setattr(pool, "write", flaky_write)
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.close()
+    assert len(calls) == 2
+    assert _stored(conn, 1) == [0, 3]
@@ -0,0 +1,74 @@
+import pytest
+
+from balancer import EndpointBalancer
+from proxy_parser import ProxyRecord
+from selection import LruStrategy, PowerOfTwoStrategy, ProxySelector, _Strategy
+
+
+def _records(count: int) -> tuple:
+    return tuple(
+        ProxyRecord("trojan", f"10.0.0.{i}", 443, "secret", "tcp", "tls", "", str(i),
+                    f"trojan://secret@10.0.0.{i}:443#{i}")
+        for i in range(count)
+    )
+
+
+def _selector(mode: str) -> ProxySelector:
+    selector = ProxySelector()
+    selector.set_modes({"pool.txt": mode})
+    return selector
+
+
+def test_strategy_base_is_abstract():
+    with pytest.raises(TypeError):
+        _Strategy(_records(1), {})
+
+
+def test_lru_rejected_candidates_keep_their_place():
+    selector = _selector("lru")
+    records = _records(4)
+    # Фильтр отклоняет записи 0 и 1: выдаётся 2, а 0 и 1 остаются первыми в очереди
+    assert selector.pick("pool.txt", records, 1, lambda index: index >= 2) == 2
+    assert [selector.pick("pool.txt", records) for _ in range(4)] == [0, 1, 3, 2]
+
+
+def test_lru_candidates_do_not_mutate():
+    strategy = LruStrategy(_records(5), {})
+    before = list(strategy.heap)
+    assert list(strategy.candidates()) == [0, 1, 2, 3, 4]
+    assert strategy.heap == before
+    strategy.commit(0)
+    strategy.commit(3)
+    assert list(strategy.candidates()) == [1, 2, 4, 0, 3]
+
+
+def test_p2c_counts_only_returned_index():
+    selector = _selector("p2c")
+    records = _records(8)
+    for _ in range(50):
+        assert selector.pick("pool.txt", records, 1, lambda index: index == 5) == 5
+    strategy = selector._strategies["pool.txt"]
+    assert isinstance(strategy, PowerOfTwoStrategy)
+    assert list(strategy.issued) == [0, 0, 0, 0, 0, 50, 0, 0]
+
+
+def test_nothing_usable_returns_none():
+    selector = _selector("lru")
+    records = _records(3)
+    assert selector.pick("pool.txt", records, 1, lambda index: False) is None
+    assert selector._strategies["pool.txt"].clock == 0
+
+
+def test_balancer_assigns_only_final_choice():
+    balancer = EndpointBalancer()
+    records = _records(4)
+    # Фильтр отклоняет наименее загруженные адреса: назначается только выданный
+    assert balancer.pick("pool.txt", records, 1, lambda index: index == 3) == 3
+    assert balancer.load() == {("10.0.0.3", 443): 1}
+
+    # Подходящих записей нет - прежнее назначение пользователя сохраняется
+    assert balancer.pick("pool.txt", records, 1, lambda index: False) is None
+    assert balancer.load() == {("10.0.0.3", 443): 1}
+
+    assert balancer.pick("pool.txt", records, 1) == 0
+    assert balancer.load() == {("10.0.0.0", 443): 1}
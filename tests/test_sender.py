@@ -0,0 +1,86 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import sender
+from sender import PRIORITY_ADMIN, PRIORITY_USER, OutboundMiddleware, OutboundScheduler
+
+
+def _scheduler(workers: int = 1) -> OutboundScheduler:
+    return OutboundScheduler(global_rate=100, chat_rate=100, maxsize=10, workers=workers)
+
+
+def test_retry_after_job_is_retried_after_block():
+    async def scenario():
+        scheduler = _scheduler()
+        scheduler.start()
+        calls = []
+
+        async def method(chat_id, text):
+            calls.append((chat_id, time.monotonic()))
+            if chat_id == 1 and len(calls) == 1:
+                raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood control", 1)
+            return text
+
+        try:
+            blocked = asyncio.ensure_future(scheduler.send(method, 1, "first"))
+            await asyncio.sleep(0.1)
+            # Пока чат 1 заблокирован, другие чаты обслуживаются
+            other = await scheduler.send(method, 2, "second")
+            return await blocked, other, calls
+        finally:
+            await scheduler.stop()
+
+    result, other, calls = asyncio.run(scenario())
+    assert (result, other) == ("first", "second")
+    assert [chat_id for chat_id, _ in calls] == [1, 2, 1]
+    assert calls[2][1] - calls[0][1] >= 1
+
+
+def test_user_replies_go_before_admin_notices():
+    async def scenario():
+        scheduler = _scheduler()
+        order = []
+
+        async def method(chat_id, text):
+            order.append(text)
+
+        sent = [
+            scheduler.submit(method, 10, "admin", priority=PRIORITY_ADMIN),
+            scheduler.submit(method, 11, "user", priority=PRIORITY_USER),
+        ]
+        scheduler.start()
+        try:
+            await asyncio.gather(*sent)
+        finally:
+            await scheduler.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["user", "admin"]
+
+
+def test_middleware_routes_chat_requests_through_scheduler():
+    async def scenario():
+        scheduler = _scheduler()
+        middleware = OutboundMiddleware(scheduler)
+        seen = []
+
+        async def make_request(bot, method):
+            seen.append((method.name, sender._in_worker.get()))
+            return method.name
+
+        scheduler.start()
+        try:
+            await middleware(make_request, None, SimpleNamespace(name="send", chat_id=5))
+            # Запросы без chat_id (getFile, answerCallbackQuery) идут напрямую
+            await middleware(make_request, None, SimpleNamespace(name="get_file"))
+        finally:
+            await scheduler.stop()
+        # До запуска очереди запросы тоже идут напрямую
+        await middleware(make_request, None, SimpleNamespace(name="early", chat_id=5))
+        return seen
+
+    assert asyncio.run(scenario()) == [("send", True), ("get_file", False), ("early", False)]
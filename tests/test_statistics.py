@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+import database
+from migrations import rebuild_statistics
+
+STATS_TABLES = ("stats_totals", "stats_daily", "stats_proxy_type", "stats_user")
+
+
+@pytest.fixture
+def local_tz(monkeypatch):
+    # Часовой пояс UTC+10: 20:00 UTC - это уже следующий день
+    monkeypatch.setenv("TZ", "UTC-10")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _seed(conn):
+    with conn:
+        conn.executemany("INSERT INTO users (user_id, first_name) VALUES (?, ?)", [(1, "A"), (2, "B")])
+        conn.executemany("INSERT INTO proxy_history (user_id, proxy, proxy_type, issue_date) VALUES (?, ?, ?, ?)", [
+            (1, "p1", "HTTP", "2026-01-01 10:00:00"),
+            (1, "p2", "HTTP", "2026-01-01 20:00:00"),
+            (2, "p3", "SOCKS", "2026-01-02 09:00:00"),
+        ])
+        conn.executemany("INSERT INTO proxy_downloads (user_id, file_name) VALUES (?, ?)",
+                         [(1, "http.txt"), (1, "http.txt"), (2, "socks.txt")])
+
+
+def _dump(conn) -> dict:
+    return {table: sorted(tuple(row) for row in conn.execute(f"SELECT * FROM {table}")) for table in STATS_TABLES}
+
+
+def test_triggers_maintain_rollups(conn, local_tz):
+    _seed(conn)
+    stats = database._get_statistics(conn, "2026-01-01")
+    assert stats["totals"] == (2, 3, 3, 2)
+    # Выдача в 20:00 UTC попадает в следующий местный день
+    assert stats["daily"] == [("2026-01-02", 2), ("2026-01-01", 1)]
+    assert stats["top_proxies"] == [("HTTP", 2), ("SOCKS", 1)]
+    assert stats["active_users"][0] == (1, "A", None, 2)
+
+
+def test_rebuild_matches_incremental_rollups(conn, local_tz):
+    _seed(conn)
+    incremental = _dump(conn)
+    with conn:
+        rebuild_statistics(conn)
+    assert _dump(conn) == incremental
@@ -0,0 +1,94 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from db_pool import DatabasePool
+from write_behind import WriteBehindQueue
+
+HISTORY = "INSERT INTO proxy_history (user_id, proxy, proxy_type) VALUES (?, ?, ?)"
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = DatabasePool(db_path, readers=1)
+    yield pool
+    pool.close()
+
+
+def _history(conn) -> list:
+    return [row[0] for row in conn.execute("SELECT proxy FROM proxy_history ORDER BY id")]
+
+
+def _queue(pool: DatabasePool) -> WriteBehindQueue:
+    return WriteBehindQueue(pool, retries=3, retry_delay=0.01)
+
+
+def test_bad_row_does_not_drop_neighbours(pool, conn):
+    async def scenario():
+        queue = _queue(pool)
+        queue.add(HISTORY, (1, "trojan://a", "T"))
+        queue.add("INSERT INTO users (user_id) VALUES (?)", (1,))
+        # Повтор первичного ключа: пакет целиком не записывается
+        queue.add("INSERT INTO users (user_id) VALUES (?)", (1,))
+        queue.add(HISTORY, (1, "trojan://b", "T"))
+        await queue.flush()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert _history(conn) == ["trojan://a", "trojan://b"]
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    assert queue.pending() == []
+
+
+def test_transient_error_retries_batch_and_deferred(pool, conn, monkeypatch):
+    write = pool.write
+    calls = []
+    restored = []
+
+    async def flaky_write(func, *args):
+        calls.append(func)
+        if len(calls) == 1:
+            # Транзакция откатывается после отложенной функции
+            await write(lambda c, *a: (func(c, *a), c.execute("SELECT * FROM missing_table")), *args)
+        return await write(func, *args)
+
+    def deferred(c):
+        c.execute(HISTORY, (2, "trojan://deferred", "T"))
+        return lambda: restored.append(True)
+
+    monkeypatch.setattr(pool, "write", flaky_write)
+
+    async def scenario():
+        queue = _queue(pool)
+        queue.add(HISTORY, (1, "trojan://a", "T"))
+        queue.defer(deferred)
+        await queue.flush()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert restored == [True]
+    assert _history(conn) == ["trojan://a", "trojan://deferred"]
+
+
+def test_unavailable_db_requeues_batch(pool, conn, monkeypatch):
+    write = pool.write
+
+    async def failing_write(func, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+    async def scenario():
+        queue = _queue(pool)
+        queue.add(HISTORY, (1, "trojan://a", "T"))
+        monkeypatch.setattr(pool, "write", failing_write)
+        await queue.flush()
+        queue.add(HISTORY, (1, "trojan://b", "T"))
+        pending = [params[1] for _, params in queue.pending()]
+
+        monkeypatch.setattr(pool, "write", write)
+        await queue.flush()
+        return pending
+
+    # Пакет остаётся в начале очереди и записывается следующим сбросом
+    assert asyncio.run(scenario()) == ["trojan://a", "trojan://b"]
+    assert _history(conn) == ["trojan://a", "trojan://b"]
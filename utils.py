@@ -2,13 +2,13 @@ import os
 import datetime
 import logging
 from aiogram import types, Bot
-from database import add_proxy_file, load_proxy_files
+from aiogram.exceptions import TelegramBadRequest
+from database import add_proxy_file, load_proxy_files, db
 from config import MEDIA_FOLDER, PROXY_FOLDER
+from media_store import media_store, MediaTooLarge
 
 # Сохранение медиафайла
 async def save_media(media: types.PhotoSize | types.Video | types.Document, user_id: int, bot: Bot):
-    os.makedirs(MEDIA_FOLDER, exist_ok=True)
-    
     if isinstance(media, types.PhotoSize):
         file_ext = ".jpg"
         media_type = "photo"
@@ -24,25 +24,44 @@ async def save_media(media: types.PhotoSize | types.Video | types.Document, user
     else:
         return None, None
     
-    # Проверяем размер файла
-    if hasattr(media, 'file_size') and media.file_size > max_size:
+    # Проверяем размер файла (поле file_size необязательное)
+    if media.file_size and media.file_size > max_size:
         logging.warning(f"Файл слишком большой: {media.file_size} байт")
         return "too_big", None
     
-    # Генерируем уникальное имя файла
-    file_name = f"{user_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}{file_ext}"
-    file_path = os.path.join(MEDIA_FOLDER, file_name)
-    
-    # Скачиваем файл
     try:
         file = await bot.get_file(media.file_id)
-        await bot.download_file(file.file_path, destination=file_path)
-        return media_type, file_path
-    except Exception as e:
-        # Проверяем, является ли ошибка связанной с размером файла
-        if "too big" in str(e).lower() or "file is too big" in str(e).lower():
+    except TelegramBadRequest as e:
+        # Bot API не отдаёт файлы больше 20 МБ и сообщает об этом только текстом ошибки
+        if "too big" in str(e).lower():
             logging.warning(f"Файл слишком большой для Telegram: {e}")
             return "too_big", None
+        logging.error(f"Ошибка при получении медиафайла: {e}")
+        return None, None
+    except Exception as e:
+        logging.error(f"Ошибка при получении медиафайла: {e}")
+        return None, None
+    
+    # Скачиваем потоком во временный файл хранилища, считая sha256 на лету и
+    # прерываясь на max_size байт; имя файла в хранилище - его хэш
+    if file.file_size and file.file_size > max_size:
+        logging.warning(f"Файл слишком большой: {file.file_size} байт")
+        return "too_big", None
+    try:
+        writer = await media_store.download(bot, file.file_path, max_size)
+    except MediaTooLarge as e:
+        logging.warning(f"Загрузка прервана: {e}")
+        return "too_big", None
+    except Exception as e:
+        logging.error(f"Ошибка при сохранении медиафайла: {e}")
+        return None, None
+    
+    try:
+        stored = await db.write(media_store.commit, writer, media_type, file_ext.lower())
+        return media_type, stored.path
+    except Exception as e:
+        if os.path.exists(writer.path):
+            os.remove(writer.path)
         logging.error(f"Ошибка при сохранении медиафайла: {e}")
         return None, None
 
@@ -62,7 +81,7 @@ def format_date(date_value):
         return str(date_value)
 
 # Инициализация прокси-файлов
-def init_proxy_files():
+async def init_proxy_files():
     # Создаем папки
     os.makedirs(PROXY_FOLDER, exist_ok=True)
     os.makedirs(MEDIA_FOLDER, exist_ok=True)
@@ -75,7 +94,7 @@ def init_proxy_files():
     
     # Получаем список существующих файлов из базы данных
     try:
-        existing_files = [f['name'] for f in load_proxy_files()]
+        existing_files = [f['name'] for f in await load_proxy_files()]
     except Exception as e:
         logging.error(f"Ошибка при загрузке списка прокси-файлов: {e}")
         existing_files = []
@@ -89,7 +108,7 @@ def init_proxy_files():
         # Добавляем файл в базу данных, если его там еще нет
         if file_name not in existing_files:
             try:
-                add_proxy_file(
+                await add_proxy_file(
                     file_name=file_name,
                     display_name=file_info["display"],
                     description=file_info["description"]
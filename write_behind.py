@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import sqlite3
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Tuple
+from db_pool import DatabasePool
+
+
+def _execute_batch(conn, batch: List[Tuple[str, tuple]]):
+    # Подряд идущие одинаковые запросы отправляем одним executemany,
+    # сохраняя исходный порядок записей
+    for sql, items in groupby(batch, key=lambda item: item[0]):
+        conn.executemany(sql, [params for _, params in items])
+
+
+class WriteBehindQueue:
+    """Отложенная пакетная запись журналов и аудита.
+
+    Запросы накапливаются в памяти и записываются одной транзакцией, когда
+    набирается batch_size записей или проходит interval секунд. При остановке
+    оставшиеся записи обязательно сбрасываются в БД. Кроме запросов в пакет
+    можно отложить функцию func(conn) (defer), которая сама соберёт, что
+    записать, - например, изменённые в памяти состояния.
+
+    Если пакет не записался из-за временной ошибки (БД занята, ошибка
+    ввода-вывода), он повторяется до retries раз с растущей паузой. Если пакет
+    так и не записан, запросы выполняются по одному: ошибочный запрос
+    пропускается, а остальные записываются. Если недоступна сама БД, пакет
+    возвращается в начало очереди до следующего сброса.
+    """
+
+    def __init__(self, pool: DatabasePool, batch_size: int = 200, interval: float = 1.0,
+                 retries: int = 3, retry_delay: float = 0.2):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending: List[Tuple[str, tuple]] = []
+        # Пакет, который уже забран из очереди, но ещё не записан
+        self._inflight: List[Tuple[str, tuple]] = []
+        self._deferred: Dict[Callable, None] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def add(self, sql: str, params: tuple = ()):
+        """Ставит запрос в очередь, не дожидаясь записи в БД"""
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def defer(self, func: Callable):
+        """Выполнит func(conn) один раз в транзакции ближайшего пакета.
+
+        func может вернуть функцию без аргументов - она вызывается, если эта
+        транзакция откатилась, например чтобы снова пометить состояния
+        несохранёнными. Затем func повторяется со следующей попыткой.
+        """
+        self._deferred[func] = None
+
+    def pending(self) -> List[Tuple[str, tuple]]:
+        """Ещё не записанные в БД запросы; можно вызывать из потока writer'а"""
+        # Очередь читается раньше забранного пакета: flush сначала переносит
+        # её в _inflight, поэтому запрос не теряется между ними
+        pending = list(self._pending)
+        return self._inflight + pending
+
+    def _run_deferred(self, conn, func: Callable, undo: List[Callable]):
+        restore = func(conn)
+        if restore is not None:
+            undo.append(restore)
+
+    def _write(self, conn, batch: List[Tuple[str, tuple]], deferred: List[Callable], undo: List[Callable]):
+        _execute_batch(conn, batch)
+        for func in deferred:
+            self._run_deferred(conn, func, undo)
+
+    def _write_rows(self, conn, batch: List[Tuple[str, tuple]], deferred: List[Callable],
+                    undo: List[Callable]) -> List[Callable]:
+        # Ошибка запроса в SQLite откатывает только сам запрос, транзакция с
+        # остальными записями продолжается
+        for sql, params in batch:
+            try:
+                conn.execute(sql, params)
+            except sqlite3.Error as e:
+                logging.error(f"Запись пропущена из-за ошибки БД ({e}): {' '.join(sql.split())} {params}")
+        failed = []
+        for func in deferred:
+            try:
+                self._run_deferred(conn, func, undo)
+            except sqlite3.Error as e:
+                logging.error(f"Ошибка отложенной записи {getattr(func, '__qualname__', func)}: {e}")
+                failed.append(func)
+        return failed
+
+    def _requeue(self, batch: List[Tuple[str, tuple]], deferred: List[Callable]):
+        self._pending[:0] = batch
+        for func in deferred:
+            self._deferred.setdefault(func, None)
+
+    async def _attempt(self, write: Callable, batch: List[Tuple[str, tuple]], deferred: List[Callable]):
+        undo: List[Callable] = []
+        try:
+            return await self.pool.write(write, batch, deferred, undo)
+        except Exception:
+            for restore in undo:
+                restore()
+            raise
+
+    async def _write_batch(self, batch: List[Tuple[str, tuple]], deferred: List[Callable]):
+        for attempt in range(self.retries):
+            try:
+                await self._attempt(self._write, batch, deferred)
+                return
+            except sqlite3.OperationalError as e:
+                # БД занята или сбой ввода-вывода - повторяем пакет целиком
+                delay = self.retry_delay * 2 ** attempt
+                logging.warning(f"Пакетная запись не удалась ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+            except sqlite3.Error as e:
+                logging.warning(f"Пакетная запись не удалась ({e}), запись по одному запросу")
+                break
+
+        try:
+            failed = await self._attempt(self._write_rows, batch, deferred)
+        except sqlite3.Error as e:
+            self._requeue(batch, deferred)
+            logging.error(f"Ошибка при пакетной записи в БД ({len(batch)} записей отложено): {e}")
+            return
+        # Отложенные функции с ошибкой повторятся со следующим пакетом
+        self._requeue([], failed)
+
+    async def flush(self):
+        """Записывает все накопленные запросы одной транзакцией"""
+        async with self._flush_lock:
+            self._inflight = batch = self._pending
+            self._pending = []
+            deferred, self._deferred = list(self._deferred), {}
+            if not batch and not deferred:
+                return
+            try:
+                await self._write_batch(batch, deferred)
+            finally:
+                self._inflight = []
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток очереди"""
+        if self._task is not None:
+            # Не отменяем задачу, чтобы не прервать уже начатую запись пакета
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logging.error(f"При остановке не записано в БД {len(self._pending)} записей")